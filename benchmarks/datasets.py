@@ -0,0 +1,39 @@
+import numpy as np
+
+from src.data import Calculator
+from src.store import FellStore
+
+
+# roughly the area of the Lake District fells
+LONGITUDES = (-3.45, -2.7)
+LATITUDES = (54.25, 54.8)
+HEIGHTS_M = (200, 978)
+PROMINENCES_FT = (30, 3000)
+NAME_PREFIXES = ['Great', 'Little', 'High', 'Low', 'Black', 'White', 'Red', 'Grey', 'Long', 'Round', 'Hart', 'Ill']
+NAME_SUFFIXES = ['Pike', 'Crag', 'Fell', 'How', 'Knott', 'Man', 'Dodd', 'Rigg', 'Top', 'Edge', 'Bell', 'Side']
+
+
+def synthetic_fells(size: int, seed: int = 0) -> FellStore:
+    """a store of size made up fells placed at random within the Lake District, in height rank order like the real data"""
+    rng = np.random.default_rng(seed)
+    longitudes = rng.uniform(*LONGITUDES, size)
+    latitudes = rng.uniform(*LATITUDES, size)
+    heights_m = rng.integers(HEIGHTS_M[0], HEIGHTS_M[1] + 1, size)
+    order = np.argsort(-heights_m, kind='stable')
+    longitudes, latitudes, heights_m = longitudes[order], latitudes[order], heights_m[order]
+    prefixes = rng.choice(NAME_PREFIXES, size)
+    suffixes = rng.choice(NAME_SUFFIXES, size)
+    names = [f'{prefix} {suffix} {i}' for i, (prefix, suffix) in enumerate(zip(prefixes.tolist(), suffixes.tolist()))]
+    # 6 figure grid references like the real data, e.g. NY 21500 07200 -> NY215072
+    grid_references = [letters + easting[:3] + northing[:3]
+                       for letters, easting, northing in (reference.split() for reference in Calculator.convert_longlats_to_grid(longitudes, latitudes))]
+    return FellStore(
+        names,
+        np.arange(1, size + 1),
+        heights_m,
+        np.round(heights_m * 3.28084),
+        rng.integers(PROMINENCES_FT[0], PROMINENCES_FT[1] + 1, size),
+        grid_references,
+        longitudes,
+        latitudes,
+    )
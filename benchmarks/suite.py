@@ -0,0 +1,225 @@
+import argparse
+from contextlib import contextmanager
+import fnmatch
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, List
+
+import numpy as np
+
+from benchmarks.datasets import synthetic_fells
+from src import api
+from src.data import Calculator
+from src.encoding import encode_json
+from src.grid import grid_reference_to_longlat
+from src.store import COLUMNS, FellStore
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_SIZES = ['real', '1000', '100000']
+# a benchmark only regresses when slower by more than the threshold and this many milliseconds, so tiny timings are not noise
+MIN_REGRESSION_MS = 0.05
+MIN_REGRESSION_KIB = 64
+# most fells serialised by the json benchmark, so it measures the same work at every size
+SERIALISE_ROWS = 10000
+
+
+class FixedDataset:
+    """stands in for the api's DatasetManager, always serving one store, already loaded and never reloaded"""
+    loaded = True
+    reloads = 0
+    load_seconds = loaded_at = None
+
+    def __init__(self, store: FellStore):
+        self.store = store
+        self.listeners = []
+
+    def current(self) -> FellStore:
+        return self.store
+
+
+@contextmanager
+def serving(store: FellStore):
+    """serves store from the api with the query cache turned off, so every request runs its query"""
+    datasets, max_entries = api.datasets, api.query_cache.max_entries
+    api.datasets = FixedDataset(store)
+    api.query_cache.max_entries = 0
+    api.query_cache.invalidate()
+    try:
+        yield api.app.test_client()
+    finally:
+        api.datasets = datasets
+        api.query_cache.max_entries = max_entries
+
+
+def load_dataset(size: str) -> FellStore:
+    """the real fells for 'real', otherwise that many synthetic fells"""
+    if size == 'real':
+        return FellStore.from_csv(api.filepath)
+    return synthetic_fells(int(size))
+
+
+# each benchmark sets up from the store (untimed), with a random generator and the api test client, and returns the operation to time
+def bench_get_longlat(store: FellStore, rng: np.random.Generator, client) -> Callable:
+    grid_references = store.grid_references[rng.integers(0, len(store), 64)].tolist()
+    def run():
+        grid_reference_to_longlat.cache_clear()
+        for grid_reference in grid_references:
+            Calculator.get_longlat(grid_reference)
+    return run
+
+
+def bench_get_longlats(store: FellStore, rng: np.random.Generator, client) -> Callable:
+    grid_references = store.grid_references.tolist()
+    return lambda: Calculator.get_longlats(grid_references)
+
+
+def bench_calculate_nearest_fells(store: FellStore, rng: np.random.Generator, client) -> Callable:
+    import pandas as pd
+    df = pd.DataFrame(dict(zip(COLUMNS, store.columns)))
+    longitude, latitude = store.longitudes[rng.integers(len(store))], store.latitudes[rng.integers(len(store))]
+    return lambda: Calculator.calculate_nearest_fells(df, longitude, latitude, store.coordinates)
+
+
+def bench_sort_by_distance(store: FellStore, rng: np.random.Generator, client) -> Callable:
+    longitude, latitude = store.longitudes[rng.integers(len(store))], store.latitudes[rng.integers(len(store))]
+    return lambda: store.view().sort_by_distance(longitude, latitude)
+
+
+def bench_filter_chain(store: FellStore, rng: np.random.Generator, client) -> Callable:
+    store.sorted_indexes, store.spatial_index, store.box_index
+    grid_reference = store.grid_references[rng.integers(len(store))]
+    query = {'above': 600.0, 'unit': 'm', 'min_prom': 100.0, 'gridref': (grid_reference,), 'limit': 20, 'bbox': (-3.3, 54.35, -2.9, 54.65)}
+    def run():
+        with api.app.test_request_context():
+            api.find_fells(query)
+    return run
+
+
+def bench_serialise_json(store: FellStore, rng: np.random.Generator, client) -> Callable:
+    view = store.view().head(SERIALISE_ROWS)
+    return lambda: b''.join(encode_json(view))
+
+
+def endpoint(url: str, indexes: List[str] = ()) -> Callable:
+    """benchmark of a GET request to the api, with the indexes it uses built beforehand"""
+    def bench(store: FellStore, rng: np.random.Generator, client) -> Callable:
+        for index in indexes:
+            getattr(store, index)
+        grid_reference = store.grid_references[rng.integers(len(store))]
+        id = int(rng.integers(len(store)))
+        path = url.format(gridref=grid_reference, id=id)
+        return lambda: client.get(path)
+    return bench
+
+
+BENCHMARKS = {
+    'calculator.get_longlat': bench_get_longlat,
+    'calculator.get_longlats': bench_get_longlats,
+    'calculator.calculate_nearest_fells': bench_calculate_nearest_fells,
+    'store.sort_by_distance': bench_sort_by_distance,
+    'api.find_fells': bench_filter_chain,
+    'encoding.json': bench_serialise_json,
+    'endpoint.fell': endpoint('/fell/{id}', ['rendered']),
+    'endpoint.fells_height': endpoint('/fells/?above=900&limit=50', ['sorted_indexes']),
+    'endpoint.fells_nearest': endpoint('/fells/?gridref={gridref}&limit=10', ['spatial_index']),
+    'endpoint.fells_name': endpoint('/fells/?name=pike&match=prefix&limit=50', ['name_index']),
+    'endpoint.fells_bbox': endpoint('/fells/?bbox=-3.2,54.4,-3.1,54.5&limit=50', ['box_index']),
+}
+
+
+def measure(run: Callable, budget: float = 0.5, min_runs: int = 5, max_runs: int = 1000) -> dict:
+    """times run until budget seconds have passed (within min_runs and max_runs), then once more for peak memory"""
+    run()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_runs or (len(timings) < max_runs and time.perf_counter() - started < budget):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    # traced separately, as tracing memory slows everything down
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    timings = np.array(timings) * 1000
+    return {
+        'runs': len(timings),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'mean_ms': float(timings.mean()),
+        'ops_per_s': float(1000 / timings.mean()),
+        'peak_kib': peak / 1024,
+    }
+
+
+def run_suite(sizes: List[str] = DEFAULT_SIZES, only: str = '*', budget: float = 0.5, log=print) -> dict:
+    """runs the benchmarks matching only against each dataset size, returning the results with details of the machine"""
+    results = {}
+    for size in sizes:
+        store = load_dataset(size)
+        with serving(store) as client:
+            for name, bench in BENCHMARKS.items():
+                key = f'{size}/{name}'
+                if not fnmatch.fnmatch(key, only) and not fnmatch.fnmatch(name, only):
+                    continue
+                results[key] = dict(dataset=size, fells=len(store), **measure(bench(store, np.random.default_rng(0), client), budget))
+                log(f"{key:<45} p50 {results[key]['p50_ms']:9.3f}ms  p99 {results[key]['p99_ms']:9.3f}ms  "
+                    f"{results[key]['ops_per_s']:10.1f}/s  peak {results[key]['peak_kib']:10.1f}KiB")
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.25) -> List[str]:
+    """descriptions of the benchmarks slower (p50) or using more memory (peak) than the baseline by more than threshold"""
+    regressions = []
+    for key, result in results['results'].items():
+        previous = baseline['results'].get(key, None)
+        if previous is None:
+            continue
+        for metric, floor in (('p50_ms', MIN_REGRESSION_MS), ('peak_kib', MIN_REGRESSION_KIB)):
+            if result[metric] > previous[metric] * (1 + threshold) and result[metric] - previous[metric] > floor:
+                regressions.append(f'{key} {metric} {previous[metric]:.3f} -> {result[metric]:.3f} '
+                                   f'(+{100 * (result[metric] / previous[metric] - 1):.0f}%)')
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    """runs the benchmarks, saving them as the baseline or comparing with it, returning 1 if any regressed"""
+    parser = argparse.ArgumentParser(prog='python main.py benchmark', description=main.__doc__)
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help="datasets: 'real' and/or numbers of synthetic fells, e.g. 1000000")
+    parser.add_argument('--only', default='*', help='only run benchmarks matching this pattern, e.g. endpoint.*')
+    parser.add_argument('--budget', type=float, default=0.5, help='seconds to spend timing each benchmark')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='json baseline to compare with or save to')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='fraction slower than the baseline that fails')
+    parser.add_argument('--output', help='also write the results to this json file')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.only, args.budget)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'saved baseline to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, run with --save to create one')
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    for regression in regressions:
+        print('REGRESSION', regression, file=sys.stderr)
+    return 1 if regressions else 0
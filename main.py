@@ -1,9 +1,13 @@
-from src.api import app
-from src.scraper import Scraper
+import os
+import sys
+
+from src.api import app, BASE_DIR, SNAPSHOT_DIR, catalogue, filepath
+from src.snapshot import build_snapshot
 
 
 def scrape():
     """uses Scraper class to retrieve Wainwright fell and outlying fell data"""
+    from src.scraper import Scraper
     scraper = Scraper()
     scraper.scrape_wikipedia()
     scraper.convert_grid_references()
@@ -11,5 +15,41 @@ def scrape():
     return df
 
 
+def refresh(snapshot_path: str = None) -> dict:
+    """refreshes wainwrights.csv and outlying_fells.csv, only writing new versions if the page has changed"""
+    from src.scraper import Scraper
+    scraper = Scraper(snapshot_path=snapshot_path, cache_dir=os.path.join(BASE_DIR, '.cache'))
+    changes = scraper.refresh(filepath, os.path.join(BASE_DIR, 'outlying_fells.csv'))
+    if any(changes[filepath].values()):
+        build_snapshot(filepath, SNAPSHOT_DIR)
+    return changes
+
+
+def snapshot() -> dict:
+    """builds the binary snapshot of wainwrights.csv, and of every other list in the catalogue, loaded by the API"""
+    return {name: build_snapshot(catalogue.lists[name].source_path, catalogue.lists[name].snapshot_dir) for name in catalogue.names()}
+
+
+def benchmark(args: list) -> int:
+    """runs the offline benchmark suite, returning 1 if anything has regressed from the baseline"""
+    from benchmarks.suite import main
+    return main(args)
+
+
+def serve(args: list) -> int:
+    """serves the api in production, with preforked workers sharing the preloaded dataset"""
+    from src.serve import main
+    return main(args)
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    if sys.argv[1:2] == ['refresh']:
+        print(refresh(*sys.argv[2:3]))
+    elif sys.argv[1:2] == ['snapshot']:
+        print(snapshot())
+    elif sys.argv[1:2] == ['benchmark']:
+        sys.exit(benchmark(sys.argv[2:]))
+    elif sys.argv[1:2] == ['serve']:
+        sys.exit(serve(sys.argv[2:]))
+    else:
+        app.run(debug=True)
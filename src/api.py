@@ -1,31 +1,175 @@
+from contextlib import nullcontext
 from pathlib import Path
+import base64
+import binascii
+import hashlib
+import hmac
+import json
 import os
+import re
+import time
+from threading import Event
 from typing import List
-import json
+from urllib.parse import urlencode
 
-from flask import Flask, abort, request
+from flask import Flask, Response, abort, g, request
 from flask_restful import Api, Resource
-import pandas as pd
+from OSGridConverter.base import OSGridError
+import numpy as np
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
 
+from src.cache import QueryCache
+from src.catalogue import Catalogue
 from src.data import Calculator
+from src.index import MATCH_MODES
+from src.dataset import DatasetManager
+from src.encoding import CODINGS, ENCODERS, JSON, STREAMABLE, compress, encode_json
+from src.grid import grid_square_bounds
+from src.metrics import Metrics, StageTimer, format_metric
+from src.planner import BoxPredicate, NamePredicate, Predicate, RangePredicate, SquarePredicate, Step, select
+from src.route import plan_route, route_costs
+from src.store import FIELDS, FellStore, FellView
+from src.tracking import NearestTracker, TrackingSessions
 
 
 # configure flask app
 app = Flask(__name__)
 api = Api(app)
+app.config.setdefault('FELLS_CACHE_ENTRIES', 1024)
+app.config.setdefault('FELLS_CACHE_BYTES', 16 * 1024 * 1024)
+app.config.setdefault('FELLS_CACHE_TTL', None)
+app.config.setdefault('FELLS_CACHE_PRECISION', 5)
+app.config.setdefault('FELLS_STREAM_ROWS', 1000)
+app.config.setdefault('FELLS_COMPRESS_MIN_BYTES', 1024)
+app.config.setdefault('FELLS_BATCH_MAX_QUERIES', 1000)
+# longest name and most names searched for by one query, as fuzzy matching costs grow with their length
+app.config.setdefault('FELLS_MAX_NAME_LENGTH', 100)
+app.config.setdefault('FELLS_MAX_NAMES', 20)
+app.config.setdefault('DISTANCES_MAX_IDS', 1000)
+app.config.setdefault('ROUTE_MAX_FELLS', 300)
+app.config.setdefault('ROUTE_TIME_BUDGET', 0.1)
+app.config.setdefault('ROUTE_MAX_TIME_BUDGET', 2.0)
+app.config.setdefault('TRACK_MAX_LIMIT', 100)
+app.config.setdefault('TRACK_MAX_SESSIONS', 1000)
+app.config.setdefault('TRACK_SESSION_TTL', 300)
+app.config.setdefault('TRACK_MARGIN_KM', 2.0)
+app.config.setdefault('TRACK_HEARTBEAT', 15.0)
+# seconds between checks of a streamed session for locations sent to other workers (those sent to its own wake it at once)
+app.config.setdefault('TRACK_POLL', 1.0)
+# open streams per process, each holding a request thread (python main.py serve sets it below its pool size)
+app.config.setdefault('TRACK_MAX_STREAMS', None)
+# the folder of the tracking sessions, shared by every worker (by default a temporary folder, made on first use)
+app.config.setdefault('TRACK_DIR', os.environ.get('WAINWRIGHTS_TRACK_DIR'))
+app.config.setdefault('CACHE_MAX_AGE', 300)
+app.config.setdefault('CACHE_STALE_WHILE_REVALIDATE', 86400)
+app.config.setdefault('CACHE_CONTROL', {})
+app.config.setdefault('INSTRUMENTATION', os.environ.get('WAINWRIGHTS_INSTRUMENTATION', '') == '1')
+app.config.setdefault('DATASET_CHECK_INTERVAL', 5.0)
+app.config.setdefault('LISTS_MAX_LOADED', 8)
+app.config.setdefault('ADMIN_TOKEN', os.environ.get('WAINWRIGHTS_ADMIN_TOKEN'))
+
+
+# columns searched by the above/below parameters for each unit
+HEIGHT_UNITS = {'m': 'Height (m)', 'ft': 'Height (ft)'}
+# nearest fells are searched for in the spatial index only when the filters leave more than this share of the
+# store, otherwise the fells left are measured and sorted, which is then faster than walking the index
+SPATIAL_INDEX_MIN_SHARE = 0.25
 
 
 # download raw data
 # filepath = Path("/Users/claytonrossiter/Python/wainwright/wainwrights.csv")
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 filepath = os.path.join(BASE_DIR, 'wainwrights.csv')
-df = pd.read_csv(filepath, encoding='utf-8')
+SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshot')
+LISTS_DIR = os.path.join(BASE_DIR, 'lists')
+datasets = DatasetManager(filepath, SNAPSHOT_DIR, app.config['DATASET_CHECK_INTERVAL'])
+# the wainwrights, also served without a /lists/<list> prefix, the outlying fells and any other lists in LISTS_DIR
+catalogue = Catalogue(LISTS_DIR, SNAPSHOT_DIR, app.config['DATASET_CHECK_INTERVAL'], app.config['LISTS_MAX_LOADED'])
+catalogue.add('wainwrights', filepath, datasets, pinned=True)
+catalogue.add('outlying-fells', os.path.join(BASE_DIR, 'outlying_fells.csv'))
+query_cache = QueryCache(app.config['FELLS_CACHE_ENTRIES'], app.config['FELLS_CACHE_BYTES'], app.config['FELLS_CACHE_TTL'])
+datasets.listeners.append(lambda previous, store: query_cache.invalidate())
+tracking_sessions = TrackingSessions(app.config['TRACK_DIR'], app.config['TRACK_SESSION_TTL'], app.config['TRACK_MAX_SESSIONS'])
+# set when the server is shutting down, so it stops reporting ready while it finishes the requests in progress
+draining = Event()
+metrics = Metrics()
+metrics.describe('wainwrights_request_duration_seconds', 'Time to answer requests, by endpoint')
+metrics.describe('wainwrights_stage_duration_seconds', 'Time spent in each stage of answering requests, by endpoint')
+
+
+def get_store() -> FellStore:
+    """the store for this request, taken once so a reload part way through does not mix dataset versions
+
+    the store of the list under /lists/<list>/, otherwise the wainwrights
+    """
+    if 'store' not in g:
+        g.store = list_store(g.list) if g.get('list', None) is not None else datasets.current()
+    return g.store
+
+
+def list_store(name: str) -> FellStore:
+    """the current store of a list in the catalogue, aborting with 503 if its csv cannot be loaded"""
+    try:
+        store = catalogue.current(name)
+    except (OSError, ValueError) as err:
+        abort(503, f"List {name} could not be loaded: {err}")
+    if store is None:
+        abort(404, "List is not valid")
+    return store
+
+
+@app.url_value_preprocessor
+def pull_list(endpoint: str, values: dict):
+    """takes the list out of /lists/<list>/ urls for get_store(), so the same resources serve every list"""
+    if values is not None and 'list' in values:
+        g.list = values.pop('list')
+
+
+@app.before_request
+def start_timer():
+    """starts timing the stages of the request, if INSTRUMENTATION is on"""
+    if app.config['INSTRUMENTATION']:
+        g.timer = StageTimer()
+
+
+def stage(name: str):
+    """context timing a stage of the request when instrumentation is on, otherwise doing nothing"""
+    timer = g.get('timer', None)
+    return nullcontext() if timer is None else timer.stage(name)
+
+
+@app.after_request
+def record_timings(response: Response) -> Response:
+    """adds the stage timings to a Server-Timing header and the /metrics histograms"""
+    timer = g.get('timer', None)
+    if timer is not None and request.endpoint is not None:
+        response.headers['Server-Timing'] = timer.server_timing()
+        metrics.observe('wainwrights_request_duration_seconds', timer.elapsed(), endpoint=request.endpoint)
+        for name, seconds in timer.stages.items():
+            metrics.observe('wainwrights_stage_duration_seconds', seconds, endpoint=request.endpoint, stage=name)
+    return response
+
+
+@app.after_request
+def add_dataset_version(response: Response) -> Response:
+    """tags every response with the version of the dataset that answered it
+
+    only from a store already taken by the request, or the wainwrights if loaded, so responses that
+    need no dataset (e.g. health checks) are never held up by loading one, or failed by it
+    """
+    store = g.get('store', None)
+    if store is None and datasets.loaded:
+        store = datasets.current()
+    if store is not None:
+        response.headers['X-Dataset-Version'] = store.version
+    return response
 
 
 # Authentication Checks
 def abort_if_fell_does_not_exist(id:int):
-    """simple check to see if Fell id exists within dataframe index range"""
-    if not id in df.index:
+    """simple check to see if Fell id exists within the store"""
+    if not 0 <= id < len(get_store()):
         abort(404, "Fell ID is not valid")
 
 def abort_if_not_a_number(text: List[str]):
@@ -34,59 +178,763 @@ def abort_if_not_a_number(text: List[str]):
         text = [float(t) for t in text]
     except:
         abort(404, "Parameter is not a number")
-        
+
+
+def parse_finite(text: str) -> float:
+    """the number in text, aborting if it is not one or is not finite (inf or nan)"""
+    abort_if_not_a_number([text])
+    number = float(text)
+    if not np.isfinite(number):
+        abort(404, "Parameter is not a number")
+    return number
+
+
+def parse_integer(text: str) -> int:
+    """the whole number in text, aborting if it is not one (e.g. 2.5, inf or nan)"""
+    number = parse_finite(text)
+    if not number.is_integer():
+        abort(404, "Parameter is not a number")
+    return int(number)
+
+
+def parse_fells_query(args) -> dict:
+    """validates the /fells/ arguments and normalises them, so equivalent queries share a cache key
+
+    names are lower cased, de-duplicated and sorted, numbers are parsed and longitude/latitude are rounded
+    to FELLS_CACHE_PRECISION decimal places (the rounded location is the one searched from)
+    """
+    query = {}
+    names = sorted({name.strip().lower() for name in args.getlist('name')} - {''})
+    if len(names) > app.config['FELLS_MAX_NAMES']:
+        abort(404, f"At most {app.config['FELLS_MAX_NAMES']} names can be searched for")
+    if any(len(name) > app.config['FELLS_MAX_NAME_LENGTH'] for name in names):
+        abort(404, f"Names must be at most {app.config['FELLS_MAX_NAME_LENGTH']} characters")
+    if names:
+        query['name'] = tuple(names)
+        match = args.get('match', 'contains').lower()
+        if match not in MATCH_MODES:
+            abort(404, "Match must be one of " + ', '.join(MATCH_MODES))
+        query['match'] = match
+    for parameter in ('above', 'below', 'min_prom', 'max_prom', 'min_rank', 'max_rank'):
+        value = args.get(parameter, None)
+        if value is not None:
+            query[parameter] = parse_finite(value)
+    # radius_km is another name for within_km
+    within_km = args.get('within_km', args.get('radius_km', None))
+    if within_km is not None:
+        query['within_km'] = parse_finite(within_km)
+    bbox = args.get('bbox', None)
+    if bbox is not None:
+        bbox = [round(parse_finite(value), app.config['FELLS_CACHE_PRECISION']) for value in bbox.split(',')]
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            abort(404, "Bounding box must be min longitude,min latitude,max longitude,max latitude")
+        query['bbox'] = tuple(bbox)
+    # each OS grid square with its bounds, read here so an invalid one fails with the other arguments
+    squares = sorted({re.sub(r'\s+', '', square).upper() for square in args.getlist('square')} - {''})
+    if squares:
+        try:
+            query['square'] = tuple((square, grid_square_bounds(square)) for square in squares)
+        except OSGridError:
+            abort(404, "Grid square is not valid")
+    if 'above' in query or 'below' in query:
+        unit = args.get('unit', 'm').lower()
+        if unit not in HEIGHT_UNITS:
+            abort(404, "Unit must be one of " + ', '.join(HEIGHT_UNITS))
+        query['unit'] = unit
+    limit = args.get('limit', None)
+    if limit is not None:
+        query['limit'] = max(parse_integer(limit), 0)
+    # pages after the first start from an offset, or the cursor given with the previous page
+    offset = args.get('offset', None)
+    if args.get('cursor', None) is not None:
+        offset = decode_cursor(args['cursor'])
+    elif offset is not None:
+        offset = max(parse_integer(offset), 0)
+    if offset:
+        query['offset'] = offset
+    fields = [field.strip() for value in args.getlist('fields') for field in value.split(',') if field.strip()]
+    if fields:
+        for field in fields:
+            if field not in FIELDS:
+                abort(404, "Field is not valid: " + field)
+        query['fields'] = tuple(dict.fromkeys(fields))
+
+    # the grid references are used by default, otherwise both longitude and latitude are needed
+    grid_references = args.getlist('gridref')
+    longitude = args.get('longitude', None)
+    latitude = args.get('latitude', None)
+    if grid_references != []:
+        query['gridref'] = tuple(sorted({grid_reference.replace(' ', '').upper() for grid_reference in grid_references}))
+    elif latitude is not None and longitude is not None:
+        precision = app.config['FELLS_CACHE_PRECISION']
+        query['longitude'] = round(parse_finite(longitude), precision)
+        query['latitude'] = round(parse_finite(latitude), precision)
+    # Nearest only has values when searching from a location, so alone it would leave every fell empty
+    if query.get('fields', None) == ('Nearest',) and 'gridref' not in query and 'longitude' not in query:
+        abort(404, "Field Nearest needs a location")
+    return query
+
+
+def encode_cursor(offset: int) -> str:
+    """opaque cursor for the page starting at offset of the current dataset"""
+    cursor = json.dumps({'offset': offset, 'version': get_store().version}).encode('utf-8')
+    return base64.urlsafe_b64encode(cursor).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    """offset of the page a cursor is for, which must be from the current dataset"""
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        offset, version = int(cursor['offset']), cursor['version']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        abort(404, "Cursor is not valid")
+    if version != get_store().version:
+        abort(410, "Cursor is from an older version of the dataset")
+    return max(offset, 0)
+
+
+def fells_cache_key(query: dict, media_type: str = JSON, coding: str = None) -> tuple:
+    """key of a normalised /fells/ query in the query cache, specific to the current dataset and encoding"""
+    return (get_store().version, media_type, coding) + tuple(sorted(query.items()))
+
+
+def query_location(query: dict) -> tuple:
+    """longitudes and latitudes the query searches from (None, None if it has no location)
+
+    the grid references are used if given (each conversion is memoised), otherwise longitude/latitude
+    """
+    if 'gridref' in query:
+        try:
+            longitude, latitude = zip(*(Calculator.get_longlat(grid_reference) for grid_reference in query['gridref']))
+        except OSGridError:
+            abort(404, "Grid reference is not valid")
+        return longitude, latitude
+    return query.get('longitude', None), query.get('latitude', None)
+
+
+def fells_predicates(query: dict) -> List[Predicate]:
+    """compiles the filters of a normalised /fells/ query into predicates, each answered by one of the store's indexes"""
+    predicates = []
+    # by name, ranking the best matches first
+    if 'name' in query:
+        predicates.append(NamePredicate(query['name'], query['match']))
+    # by height (above/below in metres or feet), prominence (feet) and height rank ranges, each two binary searches of a sorted index
+    if 'unit' in query:
+        predicates.append(RangePredicate(HEIGHT_UNITS[query['unit']], query.get('above', None), query.get('below', None)))
+    if 'min_prom' in query or 'max_prom' in query:
+        predicates.append(RangePredicate('Prom. (ft)', query.get('min_prom', None), query.get('max_prom', None), inclusive=True))
+    if 'min_rank' in query or 'max_rank' in query:
+        predicates.append(RangePredicate('Height Rank', query.get('min_rank', None), query.get('max_rank', None), inclusive=True))
+    # by bounding box and OS grid squares, only looking in the buckets of the grid indexes they overlap
+    if 'bbox' in query:
+        predicates.append(BoxPredicate(query['bbox']))
+    if 'square' in query:
+        names, squares = zip(*query['square'])
+        predicates.append(SquarePredicate(list(squares), list(names)))
+    return predicates
+
+
+def find_fells(query: dict, distances: np.ndarray = None, store: FellStore = None, plan: list = None) -> FellView:
+    """runs a normalised /fells/ query against the store (by default that of the request)
+
+    the filters are evaluated most selective first (see planner.select), then the nearest of the fells left
+    are found, from the spatial index if most of the store is left, otherwise by measuring and sorting them. distances (km from the query's location to every fell) can be
+    given when already calculated, e.g. for a batch, and the Step taken for each part is added to plan if given
+    """
+    store = get_store() if store is None else store
+    predicates = fells_predicates(query)
+    if 'name' in query:
+        with stage('name'):
+            ranked = predicates[0].ranked(store)
+    with stage('filter'):
+        positions, steps = select(store, predicates)
+    if plan is not None:
+        plan.extend(steps)
+    if 'name' in query:
+        data = FellView(store, ranked).restrict(positions) if len(predicates) > 1 else FellView(store, ranked)
+    else:
+        data = store.view(positions)
+
+    # filter by nearest to the grid references OR longitude/latitude
+    with stage('gridref'):
+        longitude, latitude = query_location(query)
+
+    # limit the number of fells returned (after skipping offset) and/or the distance (km) from the location
+    offset = query.get('offset', 0)
+    limit = query.get('limit', None)
+    if limit is not None:
+        limit += offset
+    within_km = query.get('within_km', None)
+    if longitude is None:
+        return data.head(limit).skip(offset)
+    started, candidates = time.perf_counter(), len(data)
+    with stage('distance'):
+        if distances is not None:
+            method = 'precalculated'
+            data = data.sort_by_distances(distances, limit, within_km)
+        elif (limit is not None or within_km is not None) and candidates > len(store) * SPATIAL_INDEX_MIN_SHARE:
+            method = 'spatial index'
+            data = data.nearest_to(longitude, latitude, limit, within_km)
+        else:
+            method = 'sort'
+            data = data.sort_by_distance(longitude, latitude, limit, within_km)
+    if plan is not None:
+        label = 'nearest' + (f' {limit}' if limit is not None else '') + (f' within {within_km:g} km' if within_km is not None else '')
+        plan.append(Step(label, candidates, method, len(data), (time.perf_counter() - started) * 1000))
+    return data.skip(offset)
+
+
+def fells_page(query: dict, distances: np.ndarray = None) -> tuple:
+    """runs a /fells/ query, returning its fells and the offset of the next page if there are more (otherwise None)"""
+    limit = query.get('limit', None)
+    if limit is None:
+        return find_fells(query, distances), None
+    # one more than the limit tells if there is another page
+    data = find_fells(dict(query, limit=limit + 1), distances)
+    # an empty page never leads on to another, which would be itself
+    next_offset = query.get('offset', 0) + limit if 0 < limit < len(data) else None
+    return data.head(limit), next_offset
+
+
+def batch_arguments(params) -> MultiDict:
+    """turns one query of a /fells/batch body (a json object) into arguments like those of a /fells/ query string"""
+    if not isinstance(params, dict):
+        abort(400, "Each query must be an object")
+    args = MultiDict()
+    for key, value in params.items():
+        for item in value if isinstance(value, list) else [value]:
+            if item is not None:
+                args.add(key, str(item))
+    return args
+
+
+def find_fells_batch(queries: list) -> List[bytes]:
+    """runs many /fells/ queries, returning the json of each in order (or of its error)
+
+    the distances from every location in the batch to every fell are calculated as one matrix, and
+    results already in the query cache (shared with /fells/) are reused
+    """
+    bodies = [None] * len(queries)
+    pending = []
+    for i, params in enumerate(queries):
+        try:
+            query = parse_fells_query(batch_arguments(params))
+            key = fells_cache_key(query)
+            cached = query_cache.get(key)
+            if cached is None:
+                pending.append((i, query, key, query_location(query)))
+            else:
+                bodies[i] = cached[0]
+        except HTTPException as e:
+            bodies[i] = json.dumps({'status': e.code, 'message': e.description}).encode('utf-8')
+
+    # one row of the matrix per location, each query taking the closest of its rows
+    located = [(longitude, latitude) for _, _, _, (longitude, latitude) in pending if longitude is not None]
+    if located:
+        longitudes = np.concatenate([np.atleast_1d(longitude) for longitude, _ in located])
+        latitudes = np.concatenate([np.atleast_1d(latitude) for _, latitude in located])
+        matrix = get_store().distance_matrix(longitudes, latitudes)
+    row = 0
+    for i, query, key, (longitude, _) in pending:
+        distances = None
+        if longitude is not None:
+            points = len(np.atleast_1d(longitude))
+            distances = matrix[row:row + points].min(axis=0)
+            row += points
+        data, next_offset = fells_page(query, distances)
+        bodies[i] = b''.join(encode_json(data, query.get('fields', None)))
+        query_cache.set(key, (bodies[i], None, next_offset), len(bodies[i]))
+    return bodies
+
+
+def parse_fell_ids(args) -> np.ndarray:
+    """positions of the fells in the ids argument, given as a comma separated list and/or repeated"""
+    ids = [id for value in args.getlist('ids') for id in value.split(',') if id.strip()]
+    if not ids:
+        abort(404, "Fell IDs are not provided")
+    if len(ids) > app.config['DISTANCES_MAX_IDS']:
+        abort(413, f"At most {app.config['DISTANCES_MAX_IDS']} fell IDs can be sent at once")
+    positions = [parse_integer(id) for id in ids]
+    for position in positions:
+        abort_if_fell_does_not_exist(position)
+    return np.array(positions, dtype=np.int64)
+
+
+def not_modified(etag: str) -> bool:
+    """whether the client's copy is still current, by its If-None-Match or otherwise its If-Modified-Since"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag.strip('"'))
+    modified_at = get_store().modified_at
+    if request.if_modified_since is not None and modified_at is not None:
+        return int(modified_at) <= request.if_modified_since.timestamp()
+    return False
+
+
+def cache_control() -> str:
+    """Cache-Control policy of the endpoint, from CACHE_CONTROL if set for it, otherwise CACHE_MAX_AGE and CACHE_STALE_WHILE_REVALIDATE"""
+    policy = app.config['CACHE_CONTROL'].get(request.endpoint, None)
+    if policy is None:
+        policy = f"public, max-age={app.config['CACHE_MAX_AGE']}"
+        if app.config['CACHE_STALE_WHILE_REVALIDATE']:
+            policy += f", stale-while-revalidate={app.config['CACHE_STALE_WHILE_REVALIDATE']}"
+    return policy
+
+
+def conditional_response(etag: str, build) -> Response:
+    """returns 304 Not Modified if the client has the current version, otherwise the response from build()
+
+    both with the ETag, Last-Modified (when the dataset changed) and Cache-Control headers
+    """
+    response = Response(status=304) if not_modified(etag) else build()
+    response.headers['ETag'] = etag
+    if get_store().modified_at is not None:
+        response.last_modified = int(get_store().modified_at)
+    response.headers['Cache-Control'] = cache_control()
+    return response
+
+
+def query_etag(key: tuple) -> str:
+    """strong ETag of a normalised query of the current dataset, known before the query is run"""
+    return '"' + hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).hexdigest() + '"'
+
+
+def request_etag() -> str:
+    """strong ETag of this request's path and arguments for the current dataset"""
+    return query_etag((get_store().version, request.path) + tuple(sorted(request.args.items(multi=True))))
+
+
+def fell_response(position: int) -> Response:
+    """returns the pre-rendered json bytes of a single fell, or 304 if the client has them"""
+    rendered = get_store().rendered[position]
+    return conditional_response(rendered.etag, lambda: Response(rendered.body, headers=rendered.headers))
+
 
 
 # Resources
 class Fell(Resource):
     """returns single instance of a fell"""
+    def get(self, id:int):
+        with stage('validate'):
+            abort_if_fell_does_not_exist(id)
+        with stage('render'):
+            return fell_response(id)
+
+
+class FellByName(Resource):
+    """returns single instance of a fell from its name slug, e.g. scafell-pike"""
+    def get(self, slug:str):
+        position = get_store().find_by_slug(slug)
+        if position is None:
+            abort(404, "Fell name is not valid")
+        return fell_response(position)
+
+
+class FellByGridReference(Resource):
+    """returns single instance of a fell from its OS grid reference"""
+    def get(self, grid_reference:str):
+        position = get_store().find_by_grid_reference(grid_reference)
+        if position is None:
+            abort(404, "Fell grid reference is not valid")
+        return fell_response(position)
+
+
+class FellNeighbours(Resource):
+    """returns the other fells closest to a fell first, with their distance (km, to the metre) as Nearest"""
     def get(self, id:int):
         abort_if_fell_does_not_exist(id)
-        return json.loads(df.iloc[id].to_json())
+        limit = request.args.get('limit', None)
+        if limit is not None:
+            limit = max(parse_integer(limit), 0)
+        store = get_store()
+        def build():
+            positions, distances = store.pairwise.nearest(id, limit)
+            nearest = np.round(distances.astype(np.float64), 3)
+            return Response(json.dumps(FellView(store, positions, nearest).records()), mimetype='application/json')
+        return conditional_response(request_etag(), build)
+
+
+class Distances(Resource):
+    """returns the distances (km, to the metre) between each pair of the fells in ids"""
+    def get(self):
+        positions = parse_fell_ids(request.args)
+        store = get_store()
+        def build():
+            distances = np.round(store.pairwise.between(positions).astype(np.float64), 3)
+            body = {'ids': positions.tolist(), 'names': store.names[positions].tolist(), 'distances': distances.tolist()}
+            return Response(json.dumps(body), mimetype='application/json')
+        return conditional_response(request_etag(), build)
+
+
+class Route(Resource):
+    """returns a short order to walk the fells in ids (or those matching the /fells/ arguments) from a start location
+
+    the start is the grid reference or longitude/latitude, if given, and the route ends back there with return=1.
+    ascent_weight adds that many km for every 100 m climbed between fells, and time_budget caps the
+    milliseconds spent improving the route
+    """
+    def get(self):
+        args = request.args
+        query = parse_fells_query(args)
+        store = get_store()
+        positions = np.unique(parse_fell_ids(args)) if 'ids' in args else find_fells(query).positions
+        if len(positions) > app.config['ROUTE_MAX_FELLS']:
+            abort(413, f"At most {app.config['ROUTE_MAX_FELLS']} fells can be routed at once")
+        longitude, latitude = query_location(query)
+        if longitude is not None and len(np.atleast_1d(longitude)) != 1:
+            abort(404, "Route must have a single start location")
+        return_to_start = args.get('return', '0') == '1'
+        if return_to_start and longitude is None:
+            abort(404, "Route must have a start location to return to")
+        numbers = {'ascent_weight': 0.0, 'time_budget': app.config['ROUTE_TIME_BUDGET'] * 1000}
+        for parameter in numbers:
+            if args.get(parameter, None) is not None:
+                numbers[parameter] = max(parse_finite(args[parameter]), 0.0)
+        time_budget = min(numbers['time_budget'] / 1000, app.config['ROUTE_MAX_TIME_BUDGET'])
+
+        distances = store.pairwise.between(positions).astype(np.float64)
+        start_distances = store.distances(longitude, latitude, positions) if longitude is not None else None
+        heights = store.height_m[positions]
+        costs = route_costs(distances, start_distances, heights, numbers['ascent_weight'], return_to_start)
+        tour = plan_route(costs, time_budget)
+
+        # the walking distance of each leg, the last being back to the start if returning
+        legs = route_costs(distances, start_distances, return_to_start=return_to_start)[tour[:-1], tour[1:]]
+        order = positions[tour[1:-1] - 1]
+        fells = FellView(store, order).records()
+        for fell, leg in zip(fells, legs.tolist()):
+            fell['Leg (km)'] = round(leg, 3)
+        body = {
+            'start': None if longitude is None else {'Longitude': float(np.atleast_1d(longitude)[0]), 'Latitude': float(np.atleast_1d(latitude)[0])},
+            'return_to_start': return_to_start,
+            'distance_km': round(float(legs.sum()), 3),
+            'ascent_m': int(np.maximum(np.diff(store.height_m[order]), 0).sum()),
+            'fells': fells,
+        }
+        return Response(json.dumps(body), mimetype='application/json')
+
+
+def fells_response(response: Response, coding: str, next_offset: int) -> Response:
+    """adds the content coding and, if there are more fells, a cursor and link to the next page"""
+    if coding is not None:
+        response.headers['Content-Encoding'] = coding
+    if next_offset is not None:
+        cursor = encode_cursor(next_offset)
+        args = [(key, value) for key, value in request.args.items(multi=True) if key not in ('offset', 'cursor')]
+        response.headers['X-Next-Cursor'] = cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args + [("cursor", cursor)])}>; rel="next"'
+    return response
 
 
 class Fells(Resource):
-    """returns all instances that satisfy arguments provided"""
+    """returns all instances that satisfy arguments provided
+
+    encoded as json, csv, GeoJSON or a NumPy .npz archive (by the Accept header) and compressed by Accept-Encoding,
+    or with explain=1 how the query was run instead
+    """
+    def get(self):
+        with stage('parse'):
+            query = parse_fells_query(request.args)
+        if request.args.get('explain', '0') == '1':
+            return self.explain(query)
+        with stage('parse'):
+            media_type = request.accept_mimetypes.best_match(list(ENCODERS), default=JSON)
+            coding = request.accept_encodings.best_match(CODINGS)
+            key = fells_cache_key(query, media_type, coding)
+        # the ETag is known from the query alone, so a client with the current result is answered before it is run
+        response = conditional_response(query_etag(key), lambda: self.build(query, key, media_type, coding))
+        response.headers['Vary'] = 'Accept, Accept-Encoding'
+        return response
+
+    @staticmethod
+    def explain(query: dict) -> Response:
+        """the plan of the query, each predicate with its estimated and actual fells, how it was evaluated and its time"""
+        plan = []
+        data = find_fells(query, plan=plan)
+        body = {'plan': [step._asdict() for step in plan], 'rows': len(data)}
+        return Response(json.dumps(body), mimetype='application/json', headers={'Cache-Control': 'no-store'})
+
+    @staticmethod
+    def build(query: dict, key: tuple, media_type: str, coding: str) -> Response:
+        with stage('cache'):
+            cached = query_cache.get(key)
+        if cached is None:
+            data, next_offset = fells_page(query)
+            chunks = ENCODERS[media_type](data, query.get('fields', None))
+            if len(data) > app.config['FELLS_STREAM_ROWS'] and media_type in STREAMABLE:
+                # streamed as it is encoded rather than held in memory, so not cached (nor its encoding timed)
+                return fells_response(Response(compress(chunks, coding), mimetype=media_type), coding, next_offset)
+            with stage('encode'):
+                body = b''.join(chunks)
+            if coding is not None and len(body) >= app.config['FELLS_COMPRESS_MIN_BYTES']:
+                with stage('compress'):
+                    body = b''.join(compress([body], coding))
+            else:
+                coding = None
+            cached = (body, coding, next_offset)
+            query_cache.set(key, cached, len(body))
+        body, coding, next_offset = cached
+        return fells_response(Response(body, mimetype=media_type), coding, next_offset)
+
+
+class FellsBatch(Resource):
+    """returns the results of many /fells/ queries, posted as a json list of objects of their arguments"""
+    def post(self):
+        queries = request.get_json(silent=True)
+        if isinstance(queries, dict):
+            queries = queries.get('queries', None)
+        if not isinstance(queries, list):
+            abort(400, "Body must be a list of queries")
+        if len(queries) > app.config['FELLS_BATCH_MAX_QUERIES']:
+            abort(413, f"At most {app.config['FELLS_BATCH_MAX_QUERIES']} queries can be sent at once")
+        body = b'[' + b','.join(find_fells_batch(queries)) + b']'
+        return Response(body, mimetype='application/json')
+
+
+class Reload(Resource):
+    """reloads the dataset and swaps it in without a restart (requires X-Admin-Token to be ADMIN_TOKEN, and is disabled if it is not set)"""
+    def post(self):
+        token = app.config['ADMIN_TOKEN']
+        if not token:
+            abort(403, "Reloading is disabled as no admin token is set")
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode('utf-8'), token.encode('utf-8')):
+            abort(403, "Admin token is not valid")
+        if request.args.get('wait', '1') == '0':
+            datasets.reload(wait=False)
+            return {'status': 'reloading', 'version': datasets.current().version}, 202
+        store = datasets.reload()
+        g.store = store
+        return {'status': 'reloaded', 'version': store.version}
+
+
+def find_fells_across(stores: dict, query: dict) -> List[dict]:
+    """runs a /fells/ query against each list's store (by name), merging the results with the list of each fell as List
+
+    fells are ordered nearest first when the query has a location, otherwise highest first
+    """
+    offset = query.get('offset', 0)
+    limit = query.get('limit', None)
+    # every list's first offset + limit fells, as the page could come from any of them
+    window = {key: value for key, value in query.items() if key not in ('offset', 'fields')}
+    if limit is not None:
+        window['limit'] = offset + limit
+    fields = query.get('fields', None)
+    ranked = []
+    for name, store in stores.items():
+        data = find_fells(window, store=store)
+        keys = data.nearest if data.nearest is not None else -data.store.height_m[data.positions]
+        for key, record in zip(keys.tolist(), data.records(fields)):
+            record['List'] = name
+            ranked.append((key, record))
+    ranked.sort(key=lambda item: item[0])
+    end = None if limit is None else offset + limit
+    return [record for _, record in ranked[offset:end]]
+
+
+def parse_position(args) -> tuple:
+    """the single location given by a grid reference or longitude/latitude, otherwise (None, None)"""
+    longitude, latitude = query_location(parse_fells_query(args))
+    if longitude is None:
+        return None, None
+    if len(np.atleast_1d(longitude)) != 1:
+        abort(404, "Position must be a single location")
+    return float(np.atleast_1d(longitude)[0]), float(np.atleast_1d(latitude)[0])
+
+
+def get_tracking_session(id: str):
+    session = tracking_sessions.get(id)
+    if session is None:
+        abort(404, "Tracking session is not valid")
+    return session
+
+
+def server_sent_event(event: str, data, id: int = None) -> bytes:
+    """one Server-Sent Event with json data"""
+    lines = f'id: {id}\n' if id is not None else ''
+    return f'{lines}event: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8')
+
+
+def tracking_events(id: str, tracker: NearestTracker):
+    """streams the changes to the session's nearest fells as each location arrives, with a comment every TRACK_HEARTBEAT seconds to keep the connection open
+
+    when the server is shutting down the stream ends without a closed event, so the client reconnects to another worker
+    """
+    yield b'retry: 3000\n\n'
+    sequence = 0
+    for location in tracking_sessions.watch(id, app.config['TRACK_HEARTBEAT'], app.config['TRACK_POLL'], draining):
+        if location is None:
+            yield b': keep-alive\n\n'
+            continue
+        changes = tracker.update(*location)
+        if changes is not None:
+            sequence += 1
+            yield server_sent_event('nearest', changes, sequence)
+    if not draining.is_set():
+        yield server_sent_event('closed', {})
+
+
+class Track(Resource):
+    """opens a tracking session for the nearest limit fells (by default 10) to a moving location, optionally starting at one"""
+    def post(self):
+        query = parse_fells_query(request.args)
+        limit = query.get('limit', 10)
+        if limit > app.config['TRACK_MAX_LIMIT']:
+            abort(413, f"At most the nearest {app.config['TRACK_MAX_LIMIT']} fells can be tracked")
+        longitude, latitude = parse_position(request.args)
+        # checks the list exists
+        get_store()
+        location = None if longitude is None else [longitude, latitude]
+        id = tracking_sessions.create({'list': g.get('list', None), 'limit': limit}, location)
+        if id is None:
+            abort(503, "Too many tracking sessions are open")
+        base = request.url_root + 'track'
+        return {'id': id, 'events': f'{base}/{id}/events', 'position': f'{base}/{id}/position'}, 201
+
+
+class TrackEvents(Resource):
+    """streams the changes to a tracking session's nearest fells as Server-Sent Events, from the session's list
+
+    each open stream holds a request thread, so at most TRACK_MAX_STREAMS are open in a process at once
+    """
+    def get(self, id: str):
+        session = get_tracking_session(id)
+        g.list = session['settings']['list']
+        tracker = NearestTracker(get_store(), session['settings']['limit'], app.config['TRACK_MARGIN_KM'])
+        if not tracking_sessions.start_stream(app.config['TRACK_MAX_STREAMS']):
+            abort(503, "Too many tracking streams are open")
+        response = Response(tracking_events(id, tracker), mimetype='text/event-stream')
+        response.call_on_close(tracking_sessions.end_stream)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class TrackPosition(Resource):
+    """sends a tracking session's new location, by grid reference or longitude/latitude"""
+    def post(self, id: str):
+        get_tracking_session(id)
+        longitude, latitude = parse_position(request.args)
+        if longitude is None:
+            abort(404, "Position must have a grid reference or longitude/latitude")
+        if not tracking_sessions.send(id, longitude, latitude):
+            abort(404, "Tracking session is not valid")
+        return {'status': 'queued'}, 202
+
+
+class TrackSession(Resource):
+    """closes a tracking session, ending its stream"""
+    def delete(self, id: str):
+        if not tracking_sessions.close(id):
+            abort(404, "Tracking session is not valid")
+        return Response(status=204)
+
+
+class Lists(Resource):
+    """returns the hill lists in the catalogue, with their number of fells if loaded"""
+    def get(self):
+        return [{'name': name, 'fells': len(catalogue.lists[name].current()) if catalogue.lists[name].loaded else None}
+                for name in catalogue.names()]
+
+
+class ListsFells(Resource):
+    """returns the fells of several lists (those in lists, by default all) that satisfy the /fells/ arguments
+
+    by default lists whose csv cannot be loaded are left out, rather than failing the whole query
+    """
+    def get(self):
+        names = [name for value in request.args.getlist('lists') for name in value.split(',') if name.strip()]
+        if names:
+            stores = {name: list_store(name) for name in dict.fromkeys(names)}
+        else:
+            stores = {}
+            for name in catalogue.names():
+                try:
+                    store = catalogue.current(name)
+                except (OSError, ValueError):
+                    continue
+                if store is not None:
+                    stores[name] = store
+        query = parse_fells_query(request.args)
+        versions = tuple(store.version for store in stores.values())
+        key = ('lists', tuple(stores), versions) + tuple(sorted(query.items()))
+        cached = query_cache.get(key)
+        if cached is None:
+            cached = json.dumps(find_fells_across(stores, query)).encode('utf-8')
+            query_cache.set(key, cached)
+        return Response(cached, mimetype='application/json')
+
+
+class Liveness(Resource):
+    """returns 200 while the process can answer requests at all"""
+    def get(self):
+        return {'status': 'live'}
+
+
+class Readiness(Resource):
+    """returns 200 once the dataset is loaded, or 503 before then and while shutting down, so no new requests are sent"""
+    def get(self):
+        if draining.is_set():
+            return {'status': 'draining'}, 503
+        if not datasets.loaded:
+            return {'status': 'loading'}, 503
+        return {'status': 'ready', 'version': datasets.current().version}
+
+
+class CacheStats(Resource):
+    """returns the hit/miss/eviction counters of the fells query cache"""
+    def get(self):
+        return query_cache.stats()
+
+
+class PrometheusMetrics(Resource):
+    """returns the request and stage timings, query cache counters and dataset details in the Prometheus text format
+
+    the figures are those of this process, so every series is labelled with its process id as worker
+    """
     def get(self):
-        data=df
-        # filter by name
-        name = request.args.getlist('name')
-        if name != []:
-            data = data[data['Name'].str.contains('|'.join(name), case=False, regex=True)]
-        
-        # filter by above (in metres)
-        # TODO: add metres/feet option
-        above = request.args.get('above', None)
-        if above is not None:
-            abort_if_not_a_number([above])
-            data = data[data['Height (m)'] > float(above)]
-        
-        # filter by below (in metres)
-        # TODO: add metres/feet option
-        below = request.args.get('below', None)
-        if below is not None:
-            abort_if_not_a_number([below])
-            data = data[data['Height (m)'] < float(below)]
-
-        # filter by nearest to this grid reference
-        grid_reference = request.args.get('gridref', None)
-        longitude = request.args.get('longitude', None)
-        latitude = request.args.get('latitude', None)
-        if grid_reference is not None:
-            longitude, latitude = Calculator.get_longlat(grid_reference)
-            data = Calculator.calculate_nearest_fells(data, longitude, latitude)
-
-        # OR if grid reference is not provided, check if latitude/longitude is provided
-        condition1 = grid_reference is None
-        condition2 = latitude is not None
-        condition3 = longitude is not None
-        if all((condition1, condition2, condition3)):
-            abort_if_not_a_number([longitude, latitude])
-            data = Calculator.calculate_nearest_fells(data, float(longitude), float(latitude))
-
-        return json.loads(data.to_json(orient="records"))
+        stats = query_cache.stats()
+        store = datasets.current() if datasets.loaded else None
+        worker = {'worker': str(os.getpid())}
+        text = metrics.render(worker)
+        for name, kind, description in (
+            ('hits', 'counter', 'Fells queries answered from the cache'),
+            ('misses', 'counter', 'Fells queries not in the cache'),
+            ('evictions', 'counter', 'Entries evicted to keep the cache within its bounds'),
+            ('expirations', 'counter', 'Entries dropped after their time to live'),
+            ('invalidations', 'counter', 'Times the whole cache was dropped'),
+        ):
+            text += format_metric(f'wainwrights_query_cache_{name}_total', kind, description, [(worker, stats[name])])
+        text += format_metric('wainwrights_query_cache_entries', 'gauge', 'Entries in the query cache', [(worker, stats['entries'])])
+        text += format_metric('wainwrights_query_cache_bytes', 'gauge', 'Bytes held by the query cache', [(worker, stats['bytes'])])
+        if store is not None:
+            text += format_metric('wainwrights_dataset_fells', 'gauge', 'Fells in the current dataset', [(worker, len(store))])
+            text += format_metric('wainwrights_dataset_info', 'gauge', 'Version of the current dataset', [({'version': store.version, **worker}, 1)])
+        text += format_metric('wainwrights_dataset_reloads_total', 'counter', 'Times the dataset was reloaded', [(worker, datasets.reloads)])
+        if datasets.load_seconds is not None:
+            text += format_metric('wainwrights_dataset_load_seconds', 'gauge', 'Time taken to load the current dataset and its indexes',
+                                  [(worker, datasets.load_seconds)])
+        if datasets.loaded_at is not None:
+            text += format_metric('wainwrights_dataset_loaded_timestamp_seconds', 'gauge', 'When the current dataset was loaded',
+                                  [(worker, datasets.loaded_at)])
+        return Response(text, content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 # configure api links
-api.add_resource(Fell, "/fell/<int:id>")
-api.add_resource(Fells, "/fells/")
\ No newline at end of file
+api.add_resource(Fell, "/fell/<int:id>", "/lists/<string:list>/fell/<int:id>")
+api.add_resource(FellByName, "/fell/name/<string:slug>", "/lists/<string:list>/fell/name/<string:slug>")
+api.add_resource(FellByGridReference, "/fell/gridref/<string:grid_reference>", "/lists/<string:list>/fell/gridref/<string:grid_reference>")
+api.add_resource(FellNeighbours, "/fell/<int:id>/neighbours", "/lists/<string:list>/fell/<int:id>/neighbours")
+api.add_resource(Fells, "/fells/", "/lists/<string:list>/fells")
+api.add_resource(FellsBatch, "/fells/batch", "/lists/<string:list>/fells/batch")
+api.add_resource(Distances, "/distances", "/lists/<string:list>/distances")
+api.add_resource(Route, "/route", "/lists/<string:list>/route")
+api.add_resource(Track, "/track", "/lists/<string:list>/track")
+api.add_resource(TrackSession, "/track/<string:id>")
+api.add_resource(TrackEvents, "/track/<string:id>/events")
+api.add_resource(TrackPosition, "/track/<string:id>/position")
+api.add_resource(Lists, "/lists")
+api.add_resource(ListsFells, "/lists/fells")
+api.add_resource(CacheStats, "/stats/cache")
+api.add_resource(Liveness, "/health/live")
+api.add_resource(Readiness, "/health/ready")
+api.add_resource(Reload, "/admin/reload")
+api.add_resource(PrometheusMetrics, "/metrics")
\ No newline at end of file
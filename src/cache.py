@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class QueryCache:
+    """bounded LRU cache of rendered query results with optional time-to-live and hit/miss/eviction counters
+
+    entries are evicted least recently used first once either max_entries or max_bytes is exceeded
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024, ttl: float = None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key):
+        """returns the cached value for key, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and self.clock() - entry[1] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size: int = None):
+        """stores value under key, evicting the least recently used entries to stay within bounds
+
+        size is the number of bytes the value is counted as, by default its length (e.g. of bytes)
+        """
+        size = len(value) if size is None else size
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, self.clock(), size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self):
+        """drops every entry, e.g. when the dataset changes"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        """counters and current size of the cache"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.size -= size
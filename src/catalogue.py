@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import os
+from threading import Lock
+from typing import List
+
+from src.dataset import DatasetManager
+from src.store import FellStore, slugify
+
+
+class Catalogue:
+    """the hill lists that can be served by name, each a DatasetManager of its own csv, snapshot and indexes
+
+    lists are added by name or found as csv files in lists_dir (e.g. lists/birketts.csv is birketts),
+    their snapshots kept in a folder of snapshot_dir named after them. A list is only loaded when first
+    used, and once more than max_loaded are held the least recently used (unless pinned) is unloaded,
+    so memory is bounded by the lists in use rather than the size of the catalogue
+    """
+
+    def __init__(self, lists_dir: str, snapshot_dir: str, check_interval: float = 5.0, max_loaded: int = None):
+        self.lists_dir = lists_dir
+        self.snapshot_dir = snapshot_dir
+        self.check_interval = check_interval
+        self.max_loaded = max_loaded
+        self.lists = {}
+        self.pinned = set()
+        self._used = OrderedDict()
+        self._lock = Lock()
+
+    def add(self, name: str, source_path: str, manager: DatasetManager = None, pinned: bool = False) -> DatasetManager:
+        """adds the list in source_path (csv) under name, or the existing manager of it"""
+        if manager is None:
+            manager = DatasetManager(source_path, os.path.join(self.snapshot_dir, name), self.check_interval)
+        self.lists[name] = manager
+        if pinned:
+            self.pinned.add(name)
+        return manager
+
+    def scan(self):
+        """adds the csv files in lists_dir that are not in the catalogue yet"""
+        if not os.path.isdir(self.lists_dir):
+            return
+        for filename in sorted(os.listdir(self.lists_dir)):
+            name = slugify(os.path.splitext(filename)[0])
+            if filename.endswith('.csv') and name not in self.lists:
+                self.add(name, os.path.join(self.lists_dir, filename))
+
+    def names(self) -> List[str]:
+        """names of the lists whose csv exists, in the order they were added"""
+        self.scan()
+        return [name for name, manager in self.lists.items() if os.path.exists(manager.source_path)]
+
+    def manager(self, name: str) -> DatasetManager:
+        """the DatasetManager of the list, otherwise None"""
+        if name not in self.lists:
+            self.scan()
+        manager = self.lists.get(name)
+        if manager is None or not os.path.exists(manager.source_path):
+            return None
+        return manager
+
+    def current(self, name: str) -> FellStore:
+        """the current store of the list (loading it if needed), otherwise None if there is no such list"""
+        manager = self.manager(name)
+        if manager is None:
+            return None
+        store = manager.current()
+        if name in self.pinned:
+            return store
+        with self._lock:
+            self._used[name] = None
+            self._used.move_to_end(name)
+            while self.max_loaded is not None and len(self._used) > self.max_loaded:
+                unused, _ = self._used.popitem(last=False)
+                self.lists[unused].unload()
+        return store
@@ -1,10 +1,45 @@
 from abc import ABC, abstractmethod
 from math import sqrt, radians, cos, sin, asin
-from pandas import DataFrame
+from typing import TYPE_CHECKING
 
-from OSGridConverter import grid2latlong, latlong2grid
+import numpy as np
 
+from OSGridConverter import latlong2grid
 
+from src.grid import grid_reference_to_longlat, grid_references_to_longlat, longlat_to_grid_references
+
+if TYPE_CHECKING:
+    # pandas is only needed by callers passing dataframes, so it is not imported when serving
+    from pandas import DataFrame
+
+
+EARTH_RADIUS_KM = 6371
+
+
+class Coordinates:
+    """longitude/latitude arrays held in radians, with cos(latitude) precomputed for vectorized Haversine distances"""
+
+    def __init__(self, longitudes, latitudes):
+        self.longitude = np.radians(np.asarray(longitudes, dtype=np.float64))
+        self.latitude = np.radians(np.asarray(latitudes, dtype=np.float64))
+        self.cos_latitude = np.cos(self.latitude)
+
+    def __len__(self) -> int:
+        return len(self.longitude)
+
+    def distances(self, longitude: float, latitude: float, positions=None) -> np.ndarray:
+        """calculate straight-line distance in km from every point (or only those at positions) to the provided longitude and latitude"""
+        return self.distance_matrix([longitude], [latitude], positions)[0]
+
+    def distance_matrix(self, longitudes, latitudes, positions=None) -> np.ndarray:
+        """distances in km from each of the provided longitudes and latitudes (rows) to every point, or only those at positions (columns)"""
+        longitude = np.radians(np.asarray(longitudes, dtype=np.float64))[:, None]
+        latitude = np.radians(np.asarray(latitudes, dtype=np.float64))[:, None]
+        longitudes, latitudes, cos_latitudes = self.longitude, self.latitude, self.cos_latitude
+        if positions is not None:
+            longitudes, latitudes, cos_latitudes = longitudes[positions], latitudes[positions], cos_latitudes[positions]
+        a = np.sin((latitude - latitudes) / 2)**2 + cos_latitudes * np.cos(latitude) * np.sin((longitude - longitudes) / 2)**2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
 
 
 class Calculator(ABC):
@@ -12,15 +47,24 @@ class Calculator(ABC):
 
     @abstractmethod
     def get_longlat(grid_reference:str):
-        """takes the OS ordnance grid reference and converts to a longitude, latitude pair"""
-        l = grid2latlong(grid_reference)
-        return l.longitude, l.latitude
+        """takes the OS ordnance grid reference and converts to a longitude, latitude pair (memoised)"""
+        return grid_reference_to_longlat(grid_reference)
+
+    @abstractmethod
+    def get_longlats(grid_references):
+        """batch get_longlat, converting a list of grid references to arrays of longitudes and latitudes"""
+        return grid_references_to_longlat(list(grid_references))
 
     @abstractmethod
     def convert_longlat_to_grid(longitude: float, latitude:float) -> str:
         """takes longtitude and latitude co-ordinates to return as OS grid reference"""
         return latlong2grid(latitude, longitude)
 
+    @abstractmethod
+    def convert_longlats_to_grid(longitudes, latitudes) -> list:
+        """batch convert_longlat_to_grid, converting arrays of longitudes and latitudes to a list of grid references"""
+        return longlat_to_grid_references(longitudes, latitudes)
+
     @abstractmethod
     def calculate_distance(lon1:float, lat1:float, lon2:float, lat2:float) -> float:
         """calculate straight-line distance in km between two fells using Haversine formula"""
@@ -31,12 +75,23 @@ class Calculator(ABC):
         # calculate distance taking curvature into account
         a = sin(delta_lat/2)**2 + cos(lat1) * cos(lat2) * sin(delta_lon/2)**2
         c = 2 * asin(sqrt(a)) 
-        r = 6371 # radius of the earth in km
+        r = EARTH_RADIUS_KM
         # return circular distance * angle in radians
         return c*r
     
     @abstractmethod
-    def calculate_nearest_fells(df: DataFrame, longitude: float, latitude: float) -> DataFrame:
-        """takes provided wainwrights dataframe and calculates nearest fells against provided longitude and latitude"""
-        df['Nearest'] = df[['Longitude','Latitude']].apply(lambda x: Calculator.calculate_distance(*x, longitude, latitude), axis=1)
-        return df.sort_values(by=['Nearest'])
\ No newline at end of file
+    def calculate_distances(longitudes, latitudes, longitude: float, latitude: float) -> np.ndarray:
+        """vectorized calculate_distance from arrays of longitudes and latitudes to a single longitude and latitude"""
+        return Coordinates(longitudes, latitudes).distances(longitude, latitude)
+
+    @abstractmethod
+    def calculate_nearest_fells(df: 'DataFrame', longitude: float, latitude: float, coordinates: Coordinates = None) -> 'DataFrame':
+        """takes provided wainwrights dataframe and calculates nearest fells against provided longitude and latitude
+
+        coordinates can be supplied precomputed for the full dataset, in which case df must be a slice of it
+        """
+        if coordinates is None:
+            distances = Calculator.calculate_distances(df['Longitude'], df['Latitude'], longitude, latitude)
+        else:
+            distances = coordinates.distances(longitude, latitude, df.index)
+        return df.assign(Nearest=distances).sort_values(by=['Nearest'], kind='stable')
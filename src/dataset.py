@@ -0,0 +1,103 @@
+import os
+from threading import Lock, Thread
+import time
+
+from src.snapshot import load_fells
+from src.store import FellStore
+
+
+class DatasetManager:
+    """holds the current FellStore and swaps in new versions of the dataset without a restart
+
+    a new version is loaded, with all of its indexes built, before a single reference swap makes it
+    current, so requests that already hold the old store finish on it. The csv (and snapshot) are
+    checked for changes at most every check_interval seconds, reloading in the background when
+    they change, or reload() can be called directly, e.g. from an admin endpoint
+    """
+
+    def __init__(self, source_path: str, snapshot_dir: str, check_interval: float = 5.0):
+        self.source_path = source_path
+        self.snapshot_dir = snapshot_dir
+        self.check_interval = check_interval
+        self.listeners = []
+        self.loaded_at = None
+        self.load_seconds = None
+        self.reloads = 0
+        self._store = None
+        self._stamp = None
+        self._checked = 0.0
+        self._lock = Lock()
+        # held for the whole of a reload, so only one loads at a time
+        self._reload_lock = Lock()
+        self._reloading = None
+
+    def _source_stamp(self) -> tuple:
+        """size and modification time of the csv and snapshot manifest, which change when the dataset does"""
+        stamps = []
+        for path in (self.source_path, os.path.join(self.snapshot_dir, 'manifest.json')):
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _swap(self, store: FellStore, stamp: tuple):
+        with self._lock:
+            previous, self._store, self._stamp = self._store, store, stamp
+            self.loaded_at = time.time()
+        for listener in self.listeners:
+            listener(previous, store)
+
+    def current(self) -> FellStore:
+        """returns the current store, loading it on first use and starting a reload if the files have changed"""
+        store = self._store
+        if store is None:
+            with self._lock:
+                if self._store is None:
+                    stamp = self._source_stamp()
+                    started = time.perf_counter()
+                    self._store, self._stamp = load_fells(self.source_path, self.snapshot_dir), stamp
+                    self.load_seconds = time.perf_counter() - started
+                    self.loaded_at = time.time()
+                return self._store
+        if self.check_interval is not None and time.monotonic() - self._checked >= self.check_interval:
+            self._checked = time.monotonic()
+            if self._source_stamp() != self._stamp:
+                self.reload(wait=False)
+        return store
+
+    def reload(self, wait: bool = True) -> FellStore:
+        """loads the dataset and its indexes, then swaps it in, in the background unless wait is set
+
+        reloads run one at a time, a second waiting for the first to finish. Returns the new store when waiting, otherwise the store still current while it loads
+        """
+        if not wait:
+            with self._lock:
+                if self._reloading is None or not self._reloading.is_alive():
+                    self._reloading = Thread(target=self.reload, name='dataset-reload', daemon=True)
+                    self._reloading.start()
+            return self._store
+        with self._reload_lock:
+            stamp = self._source_stamp()
+            started = time.perf_counter()
+            store = load_fells(self.source_path, self.snapshot_dir).warm()
+            self.load_seconds = time.perf_counter() - started
+            self._swap(store, stamp)
+            self.reloads += 1
+            return store
+
+    def unload(self):
+        """drops the current store, to be loaded again when next used (requests holding it finish on it)"""
+        with self._lock:
+            self._store = self._stamp = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._store is not None
+
+    def wait(self, timeout: float = None):
+        """blocks until any background reload has finished"""
+        reloading = self._reloading
+        if reloading is not None:
+            reloading.join(timeout)
@@ -0,0 +1,111 @@
+import csv
+from io import BytesIO, StringIO
+import json
+from typing import Iterator, List
+import zlib
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    # optional, responses are only gzip compressed without it
+    brotli = None
+
+from src.store import FellView
+
+
+JSON = 'application/json'
+CSV = 'text/csv'
+GEOJSON = 'application/geo+json'
+NPZ = 'application/x-npz'
+# fells per chunk of an encoded response
+CHUNK_ROWS = 256
+
+
+def encode_json(view: FellView, fields: List[str] = None) -> Iterator[bytes]:
+    """a json list of the fells, as records"""
+    yield b'['
+    separator = b''
+    for chunk in view.chunks(CHUNK_ROWS):
+        for record in chunk.records(fields):
+            yield separator + json.dumps(record).encode('utf-8')
+            separator = b', '
+    yield b']'
+
+
+def encode_csv(view: FellView, fields: List[str] = None) -> Iterator[bytes]:
+    """csv with a header row of the column names"""
+    header = list(view.columns(fields))
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(header)
+    for chunk in view.chunks(CHUNK_ROWS):
+        columns = chunk.columns(fields)
+        writer.writerows(zip(*(column.tolist() for column in columns.values())))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if not len(view):
+        yield buffer.getvalue().encode('utf-8')
+
+
+def encode_geojson(view: FellView, fields: List[str] = None) -> Iterator[bytes]:
+    """a GeoJSON FeatureCollection with a Point for each fell and its (selected) columns as properties"""
+    yield b'{"type": "FeatureCollection", "features": ['
+    separator = b''
+    for chunk in view.chunks(CHUNK_ROWS):
+        points = zip(chunk.store.longitudes[chunk.positions].tolist(), chunk.store.latitudes[chunk.positions].tolist())
+        for point, record in zip(points, chunk.records(fields)):
+            feature = {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': list(point)}, 'properties': record}
+            yield separator + json.dumps(feature).encode('utf-8')
+            separator = b', '
+    yield b']}'
+
+
+def encode_npz(view: FellView, fields: List[str] = None) -> Iterator[bytes]:
+    """a NumPy .npz archive of one typed array per column, read back with numpy.load"""
+    buffer = BytesIO()
+    np.savez(buffer, **view.columns(fields))
+    yield buffer.getvalue()
+
+
+ENCODERS = {JSON: encode_json, CSV: encode_csv, GEOJSON: encode_geojson, NPZ: encode_npz}
+# encodings that are built a chunk at a time, so can be streamed
+STREAMABLE = (JSON, CSV, GEOJSON)
+CODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+class BrotliCompressor:
+    """brotli.Compressor with the compress/flush methods of a zlib compressor"""
+
+    def __init__(self, quality: int = 5):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.finish()
+
+
+def compressor(coding: str):
+    """a streaming compressor for the content coding, with compress and flush methods"""
+    if coding == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if coding == 'br':
+        return BrotliCompressor()
+    raise ValueError(f'Unknown content coding: {coding}')
+
+
+def compress(chunks: Iterator[bytes], coding: str) -> Iterator[bytes]:
+    """compresses a stream of chunks with the content coding, passing them through if it is None"""
+    if coding is None:
+        yield from chunks
+        return
+    stream = compressor(coding)
+    for chunk in chunks:
+        compressed = stream.compress(chunk)
+        if compressed:
+            yield compressed
+    yield stream.flush()
@@ -0,0 +1,200 @@
+from functools import lru_cache
+import re
+from typing import List, Tuple
+
+import numpy as np
+from OSGridConverter.base import OSGridError
+
+
+# Airy 1830 (OSGB36) and WGS84 ellipsoids as (a, b, f)
+AIRY_1830 = (6377563.396, 6356256.909, 1 / 299.3249646)
+WGS84 = (6378137, 6356752.31425, 1 / 298.257223563)
+
+# OS national grid true origin and scale factor
+F0 = 0.9996012717
+PHI0 = np.radians(49)
+LAMBDA0 = np.radians(-2)
+N0 = -100000
+E0 = 400000
+
+# WGS84 -> OSGB36 Helmert transform: translation (m), rotation (arc seconds) and scale (ppm)
+HELMERT_TRANSLATION = np.array([-446.448, 125.157, -542.060])
+HELMERT_ROTATION = np.radians(np.array([-0.1502, -0.2470, -0.8421]) / 3600)
+HELMERT_SCALE = 20.4894 / 1e6
+
+ALPHABET = 'ABCDEFGHJKLMNOPQRSTUVWXYZ'
+GRID_PATTERN = re.compile(r'^([A-Z]{2})\s*([0-9]+)(\s*)([0-9]+)$')
+
+
+def _helmert_matrix(rotation: np.ndarray, scale: float) -> np.ndarray:
+    rx, ry, rz = rotation
+    return np.array([[scale, -rz, ry], [rz, scale, -rx], [-ry, rx, scale]])
+
+
+WGS84_TO_OSGB36 = _helmert_matrix(HELMERT_ROTATION, 1 + HELMERT_SCALE)
+OSGB36_TO_WGS84 = (
+    (1 + HELMERT_SCALE) * _helmert_matrix(-HELMERT_ROTATION, 1 + HELMERT_SCALE) + np.outer(HELMERT_ROTATION, HELMERT_ROTATION)
+) / ((1 + HELMERT_SCALE) * (HELMERT_ROTATION @ HELMERT_ROTATION + (1 + HELMERT_SCALE)**2))
+
+
+def _meridional_arc(phi: np.ndarray) -> np.ndarray:
+    a, b, _ = AIRY_1830
+    n = (a - b) / (a + b)
+    coefficients = [1 + n + 5 * (n**2 + n**3) / 4, 3 * (n + n**2) + 21 * n**3 / 8, 15 * (n**2 + n**3) / 8, 35 * n**3 / 24]
+    difference, total = phi - PHI0, phi + PHI0
+    return b * F0 * (coefficients[0] * difference
+                     - coefficients[1] * np.sin(difference) * np.cos(total)
+                     + coefficients[2] * np.sin(2 * difference) * np.cos(2 * total)
+                     - coefficients[3] * np.sin(3 * difference) * np.cos(3 * total))
+
+
+def _projection_terms(phi: np.ndarray) -> dict:
+    """transverse Mercator series terms at latitude phi, following OSGridConverter so the results agree with it"""
+    a, b, f = AIRY_1830
+    e2 = 2 * f - f * f
+    n = (a - b) / (a + b)
+    c, s, t = np.cos(phi), np.sin(phi), np.tan(phi)
+    v = 1 - e2 * s**2
+    nu = a * F0 / np.sqrt(v)
+    rho = a * F0 * (1 - e2) * v**-1.5
+    eta1 = nu / rho
+    eta2 = eta1 - 1
+    return {
+        'I': _meridional_arc(phi) + N0,
+        'II': nu * c * s / 2,
+        'III': nu * c**3 * s * (5 - t**2 + 9 * n**2) / 24,
+        'IIIA': nu * c**5 * s * (61 - 58 * t**2 + t**4) / 720,
+        'IV': nu * c,
+        'V': nu * c**3 * (eta1 - t**2) / 6,
+        'VI': nu * c**5 * (5 - 18 * t**2 + t**4 + 14 * eta2 - 58 * t**2 * eta2) / 120,
+        'VII': t / (2 * rho * nu),
+        'VIII': t / (24 * rho * nu**3) * (5 + 3 * t**2 + eta2 - 9 * t**2 * eta2),
+        'IX': t / (720 * rho * nu**5) * (61 + 90 * t**2 + 45 * t**4),
+        'X': 1 / (c * nu),
+        'XI': 1 / (c * 6 * nu**3 * (eta1 + 2 * t**2)),
+        'XII': 1 / (c * 120 * nu**5 * (5 + 28 * t**2 + 24 * t**4)),
+        'XIIA': 1 / (c * 5040 * nu**7 * (61 + 662 * t**2 + 1320 * t**4 + 720 * t**6)),
+    }
+
+
+def _to_cartesian(phi: np.ndarray, lam: np.ndarray, ellipsoid: tuple) -> np.ndarray:
+    a, _, f = ellipsoid
+    e2 = 2 * f - f * f
+    nu = a / np.sqrt(1 - e2 * np.sin(phi)**2)
+    return np.stack((nu * np.cos(phi) * np.cos(lam), nu * np.cos(phi) * np.sin(lam), nu * (1 - e2) * np.sin(phi)))
+
+
+def _from_cartesian(xyz: np.ndarray, ellipsoid: tuple) -> Tuple[np.ndarray, np.ndarray]:
+    a, b, f = ellipsoid
+    e1 = 2 * f - f * f
+    e2 = e1 / (1 - e1)
+    x, y, z = xyz
+    p = np.sqrt(x * x + y * y)
+    t = (1 + e2 * b / (p * p + z * z)) * b * z / (a * p)
+    s = t / np.sqrt(1 + t * t)
+    c = s / t
+    return np.arctan2(z + e2 * b * s**3, p - e1 * a * c**3), np.arctan2(y, x)
+
+
+def parse_grid_references(grid_references: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """converts OS grid references (e.g. NY215072 or NY 21500 07200) to arrays of easting and northing in metres"""
+    eastings = np.empty(len(grid_references))
+    northings = np.empty(len(grid_references))
+    for i, grid_reference in enumerate(grid_references):
+        if not isinstance(grid_reference, str):
+            raise OSGridError('Invalid grid reference')
+        match = GRID_PATTERN.match(grid_reference.strip().upper())
+        if not match or 'I' in match.group(1):
+            raise OSGridError('Invalid grid reference')
+        letters, first, space, second = match.groups()
+        l1, l2 = (ALPHABET.index(letter) for letter in letters)
+        e100km = ((l1 - 2) % 5) * 5 + (l2 % 5)
+        n100km = 19 - 5 * (l1 // 5) - l2 // 5
+        if not (0 <= e100km <= 6 and 0 <= n100km <= 12):
+            raise OSGridError('Invalid grid reference')
+        if not space:
+            digits = first + second
+            first, second = digits[:len(digits) // 2], digits[len(digits) // 2:]
+        if len(first) != len(second):
+            raise OSGridError('Invalid grid reference')
+        eastings[i] = int((first + '00000')[:5]) + e100km * 100000
+        northings[i] = int((second + '00000')[:5]) + n100km * 100000
+    return eastings, northings
+
+
+def format_grid_references(eastings: np.ndarray, northings: np.ndarray) -> List[str]:
+    """formats arrays of easting and northing as 10 figure OS grid references, e.g. NY 21500 07200"""
+    grid_references = []
+    for easting, northing in zip(np.floor(eastings).astype(int).tolist(), np.floor(northings).astype(int).tolist()):
+        e100k, n100k = easting // 100000, northing // 100000
+        if not (0 <= e100k <= 6 and 0 <= n100k <= 12):
+            raise OSGridError('Position out of range')
+        nf, ef = 19 - n100k, 10 + e100k
+        letters = ALPHABET[nf - nf % 5 + ef // 5] + ALPHABET[(5 * nf) % 25 + ef % 5]
+        grid_references.append(f'{letters} {easting % 100000:05d} {northing % 100000:05d}')
+    return grid_references
+
+
+def grid_square_bounds(square: str) -> Tuple[float, float, float]:
+    """south west corner (easting, northing) and size in metres of an OS grid square, e.g. NY (100km) or NY21 (10km)"""
+    square = re.sub(r'\s+', '', square).upper() if isinstance(square, str) else square
+    if not isinstance(square, str) or len(square) % 2 or len(square) > 12:
+        raise OSGridError('Invalid grid square')
+    # the digits of a square are the start of those of a grid reference, both halves padded with zeros
+    digits = len(square) - 2
+    eastings, northings = parse_grid_references([square + '00' if digits == 0 else square])
+    return float(eastings[0]), float(northings[0]), 10.0**(5 - digits // 2)
+
+
+def grid_to_longlat(eastings: np.ndarray, northings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """converts arrays of OS easting and northing to WGS84 longitude and latitude in degrees"""
+    eastings = np.floor(np.asarray(eastings, dtype=np.float64))
+    delta_n = np.floor(np.asarray(northings, dtype=np.float64)) - N0
+    a, _, _ = AIRY_1830
+    # iterate the latitude until the meridional arc reaches the northing
+    phi = np.full(len(eastings), PHI0)
+    arc = np.zeros(len(eastings))
+    active = np.ones(len(eastings), dtype=bool)
+    while active.any():
+        phi[active] += (delta_n[active] - arc[active]) / (a * F0)
+        arc[active] = _meridional_arc(phi[active])
+        active &= delta_n - arc >= 1e-5
+    terms = _projection_terms(phi)
+    delta_e = eastings - E0
+    phi = phi - terms['VII'] * delta_e**2 + terms['VIII'] * delta_e**4 - terms['IX'] * delta_e**6
+    lam = LAMBDA0 + terms['X'] * delta_e - terms['XI'] * delta_e**3 + terms['XII'] * delta_e**5 - terms['XIIA'] * delta_e**7
+    # OSGB36 -> WGS84 datum shift through cartesian coordinates
+    xyz = OSGB36_TO_WGS84 @ (_to_cartesian(phi, lam, AIRY_1830) - HELMERT_TRANSLATION[:, None])
+    phi, lam = _from_cartesian(xyz, WGS84)
+    return np.degrees(lam), np.degrees(phi)
+
+
+def longlat_to_grid(longitudes: np.ndarray, latitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """converts arrays of WGS84 longitude and latitude in degrees to OS easting and northing in metres"""
+    phi = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lam = np.radians(np.asarray(longitudes, dtype=np.float64))
+    # WGS84 -> OSGB36 datum shift through cartesian coordinates
+    xyz = HELMERT_TRANSLATION[:, None] + WGS84_TO_OSGB36 @ _to_cartesian(phi, lam, WGS84)
+    phi, lam = _from_cartesian(xyz, AIRY_1830)
+    terms = _projection_terms(phi)
+    delta_l = lam - LAMBDA0
+    northings = terms['I'] + terms['II'] * delta_l**2 + terms['III'] * delta_l**4 + terms['IIIA'] * delta_l**6
+    eastings = E0 + terms['IV'] * delta_l + terms['V'] * delta_l**3 + terms['VI'] * delta_l**5
+    return np.floor(eastings), np.floor(northings)
+
+
+def grid_references_to_longlat(grid_references: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """converts a list of OS grid references to arrays of WGS84 longitude and latitude"""
+    return grid_to_longlat(*parse_grid_references(grid_references))
+
+
+def longlat_to_grid_references(longitudes, latitudes) -> List[str]:
+    """converts arrays of WGS84 longitude and latitude to a list of 10 figure OS grid references"""
+    return format_grid_references(*longlat_to_grid(longitudes, latitudes))
+
+
+@lru_cache(maxsize=4096)
+def grid_reference_to_longlat(grid_reference: str) -> Tuple[float, float]:
+    """memoised conversion of a single OS grid reference to a WGS84 longitude, latitude pair"""
+    longitudes, latitudes = grid_references_to_longlat([grid_reference])
+    return float(longitudes[0]), float(latitudes[0])
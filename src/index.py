@@ -0,0 +1,452 @@
+from bisect import bisect_left
+from collections import defaultdict
+from heapq import heappush, heappop
+from math import sin
+import re
+from typing import List
+
+import numpy as np
+
+from src.data import EARTH_RADIUS_KM
+
+
+# nearest() measures every candidate directly, rather than searching the tree, when there are at most this many
+# (or NEAREST_CANDIDATES_PER_FELL per fell asked for), as one vectorised pass is then faster than visiting the nodes
+BRUTE_FORCE_POINTS = 4096
+NEAREST_CANDIDATES_PER_FELL = 16
+
+def unit_vectors(longitudes, latitudes) -> np.ndarray:
+    """converts arrays of longitude and latitude (in degrees) to points on the unit sphere"""
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack((cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)))
+
+
+def chord_to_km(chord):
+    """converts straight-line chord length on the unit sphere to great-circle distance in km"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+
+def km_to_chord(distance: float) -> float:
+    """converts great-circle distance in km to straight-line chord length on the unit sphere"""
+    angle = min(distance / EARTH_RADIUS_KM, np.pi)
+    return 2 * sin(angle / 2)
+
+
+class SpatialIndex:
+    """kd-tree over fell positions on the unit sphere, giving sub-linear k-nearest and radius queries
+
+    straight-line (chord) distance on the unit sphere increases with great-circle distance, so the
+    tree is searched in three dimensions and the results converted back to km
+    """
+
+    def __init__(self, longitudes, latitudes, leaf_size: int = 16):
+        points = unit_vectors(longitudes, latitudes)
+        self.leaf_size = leaf_size
+        self.size = len(points)
+        # node arrays: [start, end) into the reordered points, children and bounding boxes
+        self.starts, self.ends, self.lefts, self.rights, self.lows, self.highs = [], [], [], [], [], []
+        order = np.arange(self.size)
+        if self.size:
+            self._build(points, order, 0, self.size)
+        self.order = order
+        self.points = points[order]
+        self.lows = np.array(self.lows)
+        self.highs = np.array(self.highs)
+        # the leaves, whose boxes within() checks all at once
+        leaves = np.array([node for node, left in enumerate(self.lefts) if left == -1], dtype=np.int64)
+        self.leaf_starts = np.array(self.starts, dtype=np.int64)[leaves]
+        self.leaf_ends = np.array(self.ends, dtype=np.int64)[leaves]
+        self.leaf_lows = self.lows[leaves]
+        self.leaf_highs = self.highs[leaves]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _build(self, points: np.ndarray, order: np.ndarray, start: int, end: int) -> int:
+        """recursively splits order[start:end] on the widest axis and returns the new node id"""
+        node = len(self.starts)
+        subset = points[order[start:end]]
+        low, high = subset.min(axis=0), subset.max(axis=0)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lefts.append(-1)
+        self.rights.append(-1)
+        self.lows.append(low)
+        self.highs.append(high)
+        if end - start > self.leaf_size:
+            axis = int(np.argmax(high - low))
+            middle = (end - start) // 2
+            partition = np.argpartition(subset[:, axis], middle)
+            order[start:end] = order[start:end][partition]
+            self.lefts[node] = self._build(points, order, start, start + middle)
+            self.rights[node] = self._build(points, order, start + middle, end)
+        return node
+
+    def _bound(self, node: int, query: np.ndarray) -> float:
+        """smallest squared distance from query to the bounding box of node"""
+        gap = np.maximum(np.maximum(self.lows[node] - query, query - self.highs[node]), 0)
+        return float(gap @ gap)
+
+    def _leaf(self, node: int, query: np.ndarray, mask: np.ndarray = None):
+        """positions and squared distances of the points in a leaf, dropping those excluded by mask"""
+        positions = self.order[self.starts[node]:self.ends[node]]
+        difference = self.points[self.starts[node]:self.ends[node]] - query
+        distances = np.einsum('ij,ij->i', difference, difference)
+        if mask is not None:
+            keep = mask[positions]
+            positions, distances = positions[keep], distances[keep]
+        return positions, distances
+
+    def _closest(self, indexes: np.ndarray, query: np.ndarray, k: int):
+        """positions and distances (km) of the k closest of the points at indexes (into the reordered points), measuring every one"""
+        difference = self.points[indexes] - query
+        distances = np.einsum('ij,ij->i', difference, difference)
+        if k < len(distances):
+            keep = np.argpartition(distances, k - 1)[:k]
+            indexes, distances = indexes[keep], distances[keep]
+        positions = self.order[indexes]
+        order = np.lexsort((positions, distances))
+        return positions[order], chord_to_km(np.sqrt(distances[order]))
+
+    def nearest(self, longitude: float, latitude: float, k: int, mask: np.ndarray = None):
+        """returns positions and distances (km) of the k nearest points, closest first
+
+        mask is an optional boolean array over all points restricting which may be returned; subtrees
+        holding none of them are never visited, and when few are left they are all measured instead
+        """
+        query = unit_vectors([longitude], [latitude])[0]
+        best_positions = np.empty(0, dtype=np.int64)
+        best_distances = np.empty(0)
+        if k <= 0 or not self.size:
+            return best_positions, best_distances
+        brute_force = max(BRUTE_FORCE_POINTS, k * NEAREST_CANDIDATES_PER_FELL)
+        counts = None
+        if mask is not None:
+            masked = mask[self.order]
+            # counts[end] - counts[start] is the number of masked points in order[start:end]
+            counts = np.concatenate(([0], np.cumsum(masked)))
+            if counts[-1] <= brute_force:
+                return self._closest(np.flatnonzero(masked), query, k)
+        elif self.size <= brute_force:
+            return self._closest(np.arange(self.size), query, k)
+        heap = [(0.0, 0)]
+        while heap:
+            bound, node = heappop(heap)
+            if len(best_distances) == k and bound > best_distances[-1]:
+                break
+            if self.lefts[node] == -1:
+                positions, distances = self._leaf(node, query, mask)
+                best_positions = np.concatenate((best_positions, positions))
+                best_distances = np.concatenate((best_distances, distances))
+                keep = np.argsort(best_distances, kind='stable')[:k]
+                best_positions, best_distances = best_positions[keep], best_distances[keep]
+            else:
+                for child in (self.lefts[node], self.rights[node]):
+                    if counts is None or counts[self.ends[child]] > counts[self.starts[child]]:
+                        heappush(heap, (self._bound(child, query), child))
+        return best_positions, chord_to_km(np.sqrt(best_distances))
+
+    def within(self, longitude: float, latitude: float, radius_km: float, mask: np.ndarray = None):
+        """returns positions and distances (km) of all points within radius_km, closest first
+
+        the leaves whose boxes reach the radius are found in one vectorised pass, so a wide radius
+        costs no more than measuring every point, and only their points (in mask, if given) are measured
+        """
+        if not self.size or radius_km < 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        query = unit_vectors([longitude], [latitude])[0]
+        limit = km_to_chord(radius_km)**2
+        gaps = np.maximum(np.maximum(self.leaf_lows - query, query - self.leaf_highs), 0)
+        reached = np.einsum('ij,ij->i', gaps, gaps) <= limit
+        # the indexes into the reordered points of every reached leaf, each a contiguous run
+        starts, lengths = self.leaf_starts[reached], self.leaf_ends[reached] - self.leaf_starts[reached]
+        indexes = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        if mask is not None:
+            indexes = indexes[mask[self.order[indexes]]]
+        difference = self.points[indexes] - query
+        distances = np.einsum('ij,ij->i', difference, difference)
+        keep = distances <= limit
+        positions, distances = self.order[indexes[keep]], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return positions[order], chord_to_km(np.sqrt(distances[order]))
+
+
+class PairwiseDistances:
+    """fell to fell distances (km) as a float32 matrix, with each row's other fells ordered closest first
+
+    both arrays can be memory-mapped from a snapshot, so the table is calculated once per dataset version
+    and shared between workers, and the k nearest neighbours of a fell are a slice of its row
+    """
+
+    def __init__(self, distances: np.ndarray, neighbours: np.ndarray):
+        self.distances = distances
+        self.neighbours = neighbours
+
+    def __len__(self) -> int:
+        return len(self.distances)
+
+    @classmethod
+    def from_coordinates(cls, coordinates, chunk_size: int = 1024):
+        """calculates the table from Coordinates, a block of rows at a time to bound the float64 working memory"""
+        size = len(coordinates)
+        distances = np.empty((size, size), dtype=np.float32)
+        neighbours = np.empty((size, max(size - 1, 0)), dtype=np.int16 if size <= 2**15 else np.int32)
+        for start in range(0, size, chunk_size):
+            rows = np.arange(start, min(start + chunk_size, size))
+            block = coordinates.distance_matrix(np.degrees(coordinates.longitude[rows]), np.degrees(coordinates.latitude[rows]))
+            diagonal = (np.arange(len(rows)), rows)
+            block[diagonal] = 0
+            distances[rows] = block
+            # each fell goes last in its own row, so dropping the last column leaves only the others
+            block[diagonal] = np.inf
+            neighbours[rows] = np.argsort(block, axis=1, kind='stable')[:, :size - 1]
+        return cls(distances, neighbours)
+
+    def nearest(self, position: int, limit: int = None):
+        """returns positions and distances (km) of the other fells, closest to the fell at position first"""
+        positions = self.neighbours[position, :limit].astype(np.int64)
+        return positions, self.distances[position, positions]
+
+    def between(self, positions: np.ndarray) -> np.ndarray:
+        """distances (km) between each pair of the fells at positions"""
+        return self.distances[np.ix_(positions, positions)]
+
+
+class NearbyDistances:
+    """the nearest and between lookups of PairwiseDistances, calculated when asked for rather than held as a table
+
+    for datasets too large for a table of every pair, the nearest fells come from the spatial index
+    and the distances between fells from their coordinates
+    """
+
+    def __init__(self, coordinates, spatial_index: SpatialIndex):
+        self.coordinates = coordinates
+        self.spatial_index = spatial_index
+        self.longitudes = np.degrees(coordinates.longitude)
+        self.latitudes = np.degrees(coordinates.latitude)
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    def nearest(self, position: int, limit: int = None):
+        """returns positions and distances (km) of the other fells, closest to the fell at position first"""
+        point = (self.longitudes[position], self.latitudes[position])
+        if limit is None:
+            distances = self.coordinates.distances(*point)
+            distances[position] = np.inf
+            positions = np.argsort(distances, kind='stable')[:len(self) - 1]
+            distances = distances[positions]
+        else:
+            positions, distances = self.spatial_index.nearest(*point, limit + 1)
+            keep = positions != position
+            positions, distances = positions[keep][:limit], distances[keep][:limit]
+        return positions, distances.astype(np.float32)
+
+    def between(self, positions: np.ndarray) -> np.ndarray:
+        """distances (km) between each pair of the fells at positions"""
+        distances = self.coordinates.distance_matrix(self.longitudes[positions], self.latitudes[positions], positions)
+        np.fill_diagonal(distances, 0)
+        return distances.astype(np.float32)
+
+
+class GridIndex:
+    """points bucketed into square cells of cell_size, so a box query only looks at the points in the cells it overlaps
+
+    the positions are sorted by cell, row by row, with the offset of each cell kept, so the cells of
+    one row of the box are a single slice
+    """
+
+    def __init__(self, xs, ys, cell_size: float):
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.cell_size = cell_size
+        columns = np.floor(self.xs / cell_size).astype(np.int64)
+        rows = np.floor(self.ys / cell_size).astype(np.int64)
+        self.first_column = columns.min() if len(columns) else 0
+        self.first_row = rows.min() if len(rows) else 0
+        self.width = int(columns.max() - self.first_column + 1) if len(columns) else 0
+        self.height = int(rows.max() - self.first_row + 1) if len(rows) else 0
+        cells = (rows - self.first_row) * self.width + (columns - self.first_column)
+        self.order = np.argsort(cells, kind='stable')
+        self.offsets = np.searchsorted(cells[self.order], np.arange(self.width * self.height + 1))
+
+    def __len__(self) -> int:
+        return len(self.xs)
+
+    def _slices(self, x_min: float, y_min: float, x_max: float, y_max: float) -> tuple:
+        """start and end offsets in order of the cells the box overlaps, one slice for each row of cells"""
+        first_column = max(int(np.floor(x_min / self.cell_size)) - self.first_column, 0)
+        last_column = min(int(np.floor(x_max / self.cell_size)) - self.first_column, self.width - 1)
+        first_row = max(int(np.floor(y_min / self.cell_size)) - self.first_row, 0)
+        last_row = min(int(np.floor(y_max / self.cell_size)) - self.first_row, self.height - 1)
+        if first_column > last_column or first_row > last_row:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        rows = np.arange(first_row, last_row + 1) * self.width
+        return self.offsets[rows + first_column], self.offsets[rows + last_column + 1]
+
+    def count(self, x_min: float, y_min: float, x_max: float, y_max: float) -> int:
+        """number of points in the cells the box overlaps, an upper bound on those inside it found without looking at any"""
+        starts, ends = self._slices(x_min, y_min, x_max, y_max)
+        return int((ends - starts).sum())
+
+    def inside(self, positions: np.ndarray, x_min: float, y_min: float, x_max: float, y_max: float, closed: bool = True) -> np.ndarray:
+        """boolean mask of which of the points at positions are inside the box"""
+        xs, ys = self.xs[positions], self.ys[positions]
+        if closed:
+            return (xs >= x_min) & (xs <= x_max) & (ys >= y_min) & (ys <= y_max)
+        return (xs >= x_min) & (xs < x_max) & (ys >= y_min) & (ys < y_max)
+
+    def box(self, x_min: float, y_min: float, x_max: float, y_max: float, closed: bool = True) -> np.ndarray:
+        """positions of the points inside the box, in ascending position order
+
+        the box includes its upper edges when closed, otherwise it is half-open (e.g. a grid square)
+        """
+        starts, ends = self._slices(x_min, y_min, x_max, y_max)
+        if not len(starts):
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate([self.order[start:end] for start, end in zip(starts, ends)])
+        return np.sort(candidates[self.inside(candidates, x_min, y_min, x_max, y_max, closed)])
+
+
+class SortedIndex:
+    """positions of a numeric column sorted by value, so range queries are two binary searches"""
+
+    def __init__(self, values):
+        values = np.asarray(values)
+        self.order = np.argsort(values, kind='stable')
+        self.values = values[self.order]
+
+    def _bounds(self, low: float = None, high: float = None, inclusive: bool = False) -> tuple:
+        start = 0 if low is None else np.searchsorted(self.values, low, 'left' if inclusive else 'right')
+        end = len(self.values) if high is None else np.searchsorted(self.values, high, 'right' if inclusive else 'left')
+        return start, max(end, start)
+
+    def count(self, low: float = None, high: float = None, inclusive: bool = False) -> int:
+        """number of values between low and high, from the two binary searches alone"""
+        start, end = self._bounds(low, high, inclusive)
+        return int(end - start)
+
+    def range(self, low: float = None, high: float = None, inclusive: bool = False) -> np.ndarray:
+        """positions with values between low and high (either may be None), in ascending position order
+
+        bounds are strict (above/below) unless inclusive is set (min/max)
+        """
+        start, end = self._bounds(low, high, inclusive)
+        return np.sort(self.order[start:end])
+
+
+MATCH_MODES = ('exact', 'prefix', 'contains', 'fuzzy')
+
+
+def normalise_name(name: str) -> str:
+    """lower case name with each run of non-alphanumeric characters replaced by a single space"""
+    return re.sub(r'[^a-z0-9]+', ' ', name.lower()).strip()
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between two strings"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+class NameIndex:
+    """index over fell names for exact, prefix, substring and typo-tolerant matching
+
+    names are normalised to lower case words; prefixes are found by binary search of a sorted table of
+    every word-start suffix, substrings by intersecting n-gram posting lists (n up to gram) and typos by
+    scoring the names sharing the most n-grams with the query by edit distance. Matches are ranked by
+    exact, name prefix, word prefix, substring then fuzzy, and within each by position (height rank)
+    """
+
+    def __init__(self, names, gram: int = 3, fuzzy_candidates: int = 64):
+        self.names = [normalise_name(name) for name in names]
+        self.gram = gram
+        self.fuzzy_candidates = fuzzy_candidates
+        self.exact = defaultdict(list)
+        suffixes = []
+        postings = defaultdict(set)
+        for position, name in enumerate(self.names):
+            self.exact[name].append(position)
+            starts = [0] + [match.end() for match in re.finditer(' ', name)]
+            suffixes.extend((name[start:], position, start == 0) for start in starts)
+            for n in range(1, gram + 1):
+                for i in range(len(name) - n + 1):
+                    postings[name[i:i + n]].add(position)
+        suffixes.sort()
+        self.suffixes = [suffix for suffix, _, _ in suffixes]
+        self.suffix_positions = [(position, whole) for _, position, whole in suffixes]
+        self.postings = {key: np.array(sorted(positions), dtype=np.int64) for key, positions in postings.items()}
+
+    def _grams(self, text: str) -> List[str]:
+        n = min(self.gram, len(text))
+        return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+    def _exact(self, query: str) -> dict:
+        return {position: (0, 0) for position in self.exact.get(query, [])}
+
+    def _prefix(self, query: str) -> dict:
+        scores = {}
+        lo = bisect_left(self.suffixes, query)
+        hi = bisect_left(self.suffixes, query + '\uffff')
+        for position, whole in self.suffix_positions[lo:hi]:
+            score = (1, 0) if whole else (2, 0)
+            scores[position] = min(score, scores.get(position, score))
+        return scores
+
+    def _contains(self, query: str) -> dict:
+        grams = self._grams(query)
+        if not grams:
+            return {}
+        lists = sorted((self.postings.get(gram, np.empty(0, dtype=np.int64)) for gram in set(grams)), key=len)
+        candidates = lists[0]
+        for postings in lists[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, postings, assume_unique=True)
+        return {position: (3, 0) for position in candidates.tolist() if query in self.names[position]}
+
+    def _fuzzy(self, query: str) -> dict:
+        grams = [gram for gram in set(self._grams(query)) if gram in self.postings]
+        if len(query) < self.gram or not grams:
+            return {}
+        counts = np.bincount(np.concatenate([self.postings[gram] for gram in grams]), minlength=len(self.names))
+        candidates = np.argsort(-counts, kind='stable')[:self.fuzzy_candidates]
+        allowed = max(1, len(query) // 4)
+        width = len(query.split())
+        scores = {}
+        for position in candidates[counts[candidates] > 0].tolist():
+            words = self.names[position].split()
+            windows = [' '.join(words[i:i + width]) for i in range(max(len(words) - width + 1, 1))]
+            distance = min(edit_distance(query, window) for window in windows + [self.names[position]])
+            if distance <= allowed:
+                scores[position] = (4, distance)
+        return scores
+
+    def search(self, queries: List[str], match: str = 'contains', limit: int = None) -> np.ndarray:
+        """returns the positions of names matching any of queries, best ranked first
+
+        match is one of MATCH_MODES, each including the stricter modes before it, e.g. prefix
+        also returns exact matches (ranked first)
+        """
+        methods = [self._exact, self._prefix, self._contains, self._fuzzy]
+        methods = methods[:MATCH_MODES.index(match) + 1]
+        scores = {}
+        for query in queries:
+            query = normalise_name(query)
+            if not query:
+                continue
+            for method in methods:
+                for position, score in method(query).items():
+                    scores[position] = min(score, scores.get(position, score))
+        ranked = sorted(scores, key=lambda position: (scores[position], position))
+        return np.array(ranked[:limit], dtype=np.int64)
+
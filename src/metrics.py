@@ -0,0 +1,113 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+import time
+from typing import List, Tuple
+
+
+# upper bounds (seconds) of the timing histogram buckets, from 50 microseconds to 2.5 seconds
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def format_labels(labels: dict) -> str:
+    """labels in the Prometheus text format, e.g. {endpoint="fells",stage="parse"}"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_metric(name: str, kind: str, description: str, samples: List[Tuple[dict, float]]) -> str:
+    """a gauge or counter with its HELP and TYPE lines in the Prometheus text format"""
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+    lines += [f'{name}{format_labels(labels)} {value!r}' for labels, value in samples]
+    return '\n'.join(lines) + '\n'
+
+
+class Histogram:
+    """counts of observations in each bucket, with their sum, as a Prometheus histogram"""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: dict) -> List[str]:
+        """the cumulative bucket, sum and count lines of the histogram"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{format_labels({**labels, "le": le})} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum!r}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+class Metrics:
+    """histograms of timings by name and labels, shared between requests and rendered in the Prometheus text format"""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.descriptions = {}
+        self.histograms = {}
+        self.lock = Lock()
+
+    def describe(self, name: str, description: str):
+        self.descriptions[name] = description
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def render(self, labels: dict = None) -> str:
+        """the histograms in the Prometheus text format, with labels (e.g. of the process) added to every series"""
+        lines = []
+        with self.lock:
+            names = sorted({name for name, _ in self.histograms})
+            for name in names:
+                lines += [f'# HELP {name} {self.descriptions.get(name, name)}', f'# TYPE {name} histogram']
+                for (histogram_name, series), histogram in sorted(self.histograms.items()):
+                    if histogram_name == name:
+                        lines += histogram.samples(name, {**dict(series), **(labels or {})})
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+
+class StageTimer:
+    """times the stages of one request, for its Server-Timing header and the stage histograms"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # a stage run more than once (e.g. for each query of a batch) is timed in total
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """the stage timings as a Server-Timing header, in milliseconds, ending with the total"""
+        timings = list(self.stages.items()) + [('total', self.elapsed())]
+        return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings)
@@ -0,0 +1,157 @@
+from abc import ABC, abstractmethod
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+
+from src.store import COLUMNS, FellStore
+
+
+class Step(NamedTuple):
+    """how one predicate of a plan was evaluated, for explain=1"""
+    predicate: str
+    estimate: int
+    method: str
+    rows: int
+    ms: float
+
+
+class Predicate(ABC):
+    """a condition on the fells, answered either from an index (index) or by checking given fells (probe)
+
+    estimate is how many fells may match, known from the index without finding them, so a plan can
+    evaluate the most selective predicate first and check only the fells it leaves against the rest
+    """
+    label = ''
+
+    @abstractmethod
+    def estimate(self, store: FellStore) -> int:
+        """how many fells may match, at least as many as do"""
+
+    @abstractmethod
+    def index(self, store: FellStore) -> np.ndarray:
+        """positions of the matching fells, in ascending order"""
+
+    @abstractmethod
+    def probe(self, store: FellStore, positions: np.ndarray) -> np.ndarray:
+        """boolean mask of which of the fells at positions match"""
+
+
+class RangePredicate(Predicate):
+    """values of a numeric column between low and high, strictly unless inclusive, by its SortedIndex"""
+
+    def __init__(self, column: str, low: float = None, high: float = None, inclusive: bool = False):
+        self.column = column
+        self.low = low
+        self.high = high
+        self.inclusive = inclusive
+        low_bound = '' if low is None else f"{low:g} {'<=' if inclusive else '<'} "
+        high_bound = '' if high is None else f" {'<=' if inclusive else '<'} {high:g}"
+        self.label = f'{low_bound}{column}{high_bound}'
+
+    def estimate(self, store: FellStore) -> int:
+        return store.sorted_indexes[self.column].count(self.low, self.high, self.inclusive)
+
+    def index(self, store: FellStore) -> np.ndarray:
+        return store.sorted_indexes[self.column].range(self.low, self.high, self.inclusive)
+
+    def probe(self, store: FellStore, positions: np.ndarray) -> np.ndarray:
+        values = store.columns[COLUMNS.index(self.column)][positions]
+        keep = np.ones(len(positions), dtype=bool)
+        if self.low is not None:
+            keep &= values >= self.low if self.inclusive else values > self.low
+        if self.high is not None:
+            keep &= values <= self.high if self.inclusive else values < self.high
+        return keep
+
+
+class BoxPredicate(Predicate):
+    """longitude and latitude inside a bounding box, by the store's box GridIndex"""
+
+    def __init__(self, bbox: tuple):
+        self.bbox = bbox
+        self.label = 'bbox ' + ','.join(f'{value:g}' for value in bbox)
+
+    def estimate(self, store: FellStore) -> int:
+        return store.box_index.count(*self.bbox)
+
+    def index(self, store: FellStore) -> np.ndarray:
+        return store.box_index.box(*self.bbox)
+
+    def probe(self, store: FellStore, positions: np.ndarray) -> np.ndarray:
+        return store.box_index.inside(positions, *self.bbox)
+
+
+class SquarePredicate(Predicate):
+    """inside any of several OS grid squares, given as (easting, northing, size), by the store's square GridIndex"""
+
+    def __init__(self, squares: List[tuple], names: List[str]):
+        self.boxes = [(easting, northing, easting + size, northing + size) for easting, northing, size in squares]
+        self.label = 'square ' + ','.join(names)
+
+    def estimate(self, store: FellStore) -> int:
+        return sum(store.square_index.count(*box) for box in self.boxes)
+
+    def index(self, store: FellStore) -> np.ndarray:
+        return np.unique(np.concatenate([store.square_index.box(*box, closed=False) for box in self.boxes]))
+
+    def probe(self, store: FellStore, positions: np.ndarray) -> np.ndarray:
+        keep = np.zeros(len(positions), dtype=bool)
+        for box in self.boxes:
+            keep |= store.square_index.inside(positions, *box, closed=False)
+        return keep
+
+
+class NamePredicate(Predicate):
+    """names matching any of names, by the store's NameIndex, whose ranking of the matches orders the results"""
+
+    def __init__(self, names: List[str], match: str):
+        self.names = names
+        self.match = match
+        self.label = f"name {match} {','.join(names)}"
+        self._ranked = {}
+
+    def ranked(self, store: FellStore) -> np.ndarray:
+        """positions of the matching fells, best match first, searched once per store"""
+        if store.version not in self._ranked:
+            self._ranked[store.version] = store.search(self.names, self.match).positions
+        return self._ranked[store.version]
+
+    def estimate(self, store: FellStore) -> int:
+        # the search is needed for the order of the results anyway, so its count is exact
+        return len(self.ranked(store))
+
+    def index(self, store: FellStore) -> np.ndarray:
+        return np.sort(self.ranked(store))
+
+    def probe(self, store: FellStore, positions: np.ndarray) -> np.ndarray:
+        return np.isin(positions, self.ranked(store))
+
+
+def select(store: FellStore, predicates: List[Predicate]) -> tuple:
+    """positions (ascending) of the fells matching every predicate, with the Step taken for each
+
+    predicates are evaluated in order of their estimates. The first is found from its index and each
+    later one either intersected from its index or probed on the fells still left, whichever touches
+    fewer fells, so the work after the first follows the size of the result. Once nothing is left
+    the rest are skipped. Returns None for the positions if there are no predicates
+    """
+    estimates = [predicate.estimate(store) for predicate in predicates]
+    positions = None
+    steps = []
+    for i in sorted(range(len(predicates)), key=lambda i: estimates[i]):
+        predicate = predicates[i]
+        started = time.perf_counter()
+        if positions is not None and not len(positions):
+            method = 'skipped'
+        elif positions is None:
+            method = 'index'
+            positions = predicate.index(store)
+        elif estimates[i] < len(positions):
+            method = 'index'
+            positions = np.intersect1d(positions, predicate.index(store), assume_unique=True)
+        else:
+            method = 'probe'
+            positions = positions[predicate.probe(store, positions)]
+        steps.append(Step(predicate.label, estimates[i], method, len(positions), (time.perf_counter() - started) * 1000))
+    return positions, steps
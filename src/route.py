@@ -0,0 +1,116 @@
+import time
+
+import numpy as np
+
+
+# improvements smaller than this (km) are rounding, not a better route
+TOLERANCE = 1e-9
+
+
+def route_costs(distances: np.ndarray, start_distances: np.ndarray = None, heights: np.ndarray = None,
+                ascent_weight: float = 0.0, return_to_start: bool = False) -> np.ndarray:
+    """cost matrix of a route through fells, the first node being the start and the last the end
+
+    distances (km) are between each pair of fells and start_distances from the start location to each
+    fell (without one the route can start at any fell). Each metre climbed from one fell to the next
+    adds ascent_weight / 100 km. The end node costs nothing to reach unless returning to the start
+    """
+    size = len(distances)
+    costs = np.zeros((size + 2, size + 2))
+    costs[1:-1, 1:-1] = distances
+    if heights is not None and ascent_weight:
+        heights = np.asarray(heights, dtype=np.float64)
+        costs[1:-1, 1:-1] += ascent_weight / 100 * np.maximum(heights[None, :] - heights[:, None], 0)
+    if start_distances is not None:
+        costs[0, 1:-1] = start_distances
+        if return_to_start:
+            costs[1:-1, -1] = start_distances
+    return costs
+
+
+def nearest_neighbour_tour(costs: np.ndarray) -> np.ndarray:
+    """builds a route from the start node by always visiting the cheapest unvisited fell next"""
+    size = len(costs)
+    tour = np.empty(size, dtype=np.int64)
+    tour[0], tour[-1] = 0, size - 1
+    unvisited = np.ones(size, dtype=bool)
+    unvisited[[0, size - 1]] = False
+    current = 0
+    for step in range(1, size - 1):
+        candidates = np.flatnonzero(unvisited)
+        current = candidates[np.argmin(costs[current, candidates])]
+        tour[step] = current
+        unvisited[current] = False
+    return tour
+
+
+def tour_cost(tour: np.ndarray, costs: np.ndarray) -> float:
+    """total cost of following tour"""
+    return float(costs[tour[:-1], tour[1:]].sum())
+
+
+def two_opt(tour: np.ndarray, costs: np.ndarray, deadline: float) -> bool:
+    """reverses sections of the tour while that makes it cheaper, returning whether it was improved
+
+    costs need not be symmetric (e.g. weighted by ascent), so a reversed section is costed in reverse
+    using running totals of the forward and backward cost of each edge along the tour
+    """
+    improved = False
+    last = len(tour) - 2
+    i = 1
+    while i < last and time.perf_counter() < deadline:
+        forward = np.concatenate(([0.0], np.cumsum(costs[tour[:-1], tour[1:]])))
+        backward = np.concatenate(([0.0], np.cumsum(costs[tour[1:], tour[:-1]])))
+        j = np.arange(i + 1, last + 1)
+        a, b, c, d = tour[i - 1], tour[i], tour[j], tour[j + 1]
+        deltas = (costs[a, c] + backward[j] - backward[i] + costs[b, d]
+                  - costs[a, b] - forward[j] + forward[i] - costs[c, d])
+        best = np.argmin(deltas)
+        if deltas[best] < -TOLERANCE:
+            tour[i:j[best] + 1] = tour[i:j[best] + 1][::-1].copy()
+            improved = True
+        else:
+            i += 1
+    return improved
+
+
+def or_opt(tour: np.ndarray, costs: np.ndarray, deadline: float, max_length: int = 3) -> bool:
+    """moves sections of up to max_length fells elsewhere in the tour while that makes it cheaper"""
+    improved = False
+    last = len(tour) - 2
+    for length in range(1, max_length + 1):
+        i = 1
+        while i + length - 1 <= last and time.perf_counter() < deadline:
+            previous, first, end, following = tour[i - 1], tour[i], tour[i + length - 1], tour[i + length]
+            removed = costs[previous, first] + costs[end, following] - costs[previous, following]
+            # insert between k and k + 1, for every edge not touching the section
+            k = np.concatenate((np.arange(0, i - 1), np.arange(i + length, len(tour) - 1)))
+            if not len(k):
+                break
+            inserted = costs[tour[k], first] + costs[end, tour[k + 1]] - costs[tour[k], tour[k + 1]]
+            best = np.argmin(inserted)
+            if inserted[best] - removed < -TOLERANCE:
+                section = tour[i:i + length].copy()
+                rest = np.concatenate((tour[:i], tour[i + length:]))
+                position = k[best] + 1 if k[best] < i else k[best] + 1 - length
+                tour[:] = np.concatenate((rest[:position], section, rest[position:]))
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+def plan_route(costs: np.ndarray, time_budget: float = 0.1) -> np.ndarray:
+    """a good (not necessarily optimal) order to visit every node, from the first to the last
+
+    a nearest neighbour route is improved by 2-opt and Or-opt moves until neither helps or the
+    time_budget (seconds) runs out
+    """
+    deadline = time.perf_counter() + time_budget
+    tour = nearest_neighbour_tour(costs)
+    while time.perf_counter() < deadline:
+        improved = two_opt(tour, costs, deadline)
+        improved = or_opt(tour, costs, deadline) or improved
+        if not improved:
+            break
+    return tour
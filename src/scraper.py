@@ -1,8 +1,15 @@
 from enum import Enum
+import hashlib
+from io import StringIO
+import json
+import os
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
 import pandas as pd
 
 from src.data import Calculator
+from src.snapshot import write_atomically
 
 
 class WainwrightTables(Enum):
@@ -12,27 +19,142 @@ class WainwrightTables(Enum):
 
 
 class Scraper:
-    """class to scrape the Wainwright fells information from a webpage using pandas"""
+    """class to scrape the Wainwright fells information from a webpage using pandas
+
+    the page is read from snapshot_path if given (e.g. a saved copy for running offline), otherwise
+    fetched from the url. When cache_dir is given the fetched page is saved there along with its
+    ETag/Last-Modified, so later fetches are conditional and an unchanged page is not downloaded again
+    """
     url: str = r"https://en.wikipedia.org/wiki/List_of_Wainwrights"
     tables: WainwrightTables = WainwrightTables
-    latitude: list=[]
-    longitude: list=[]
 
-    def scrape_wikipedia(self):
-        """gets raw table data from wikipedia url"""
-        df = pd.read_html(self.url)
+    def __init__(self, snapshot_path: str = None, cache_dir: str = None):
+        self.snapshot_path = snapshot_path
+        self.cache_dir = cache_dir
+        self.modified = True
+        self.latitude = []
+        self.longitude = []
+        self.outlying_latitude = []
+        self.outlying_longitude = []
+
+    def fetch(self) -> str:
+        """returns the page html, setting modified to False if it is unchanged since the last cached fetch"""
+        if self.snapshot_path is not None:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                return f.read()
+        if self.cache_dir is None:
+            with urlopen(Request(self.url, headers={'User-Agent': 'flask-wainwrights'})) as response:
+                return response.read().decode('utf-8')
+
+        html_path = os.path.join(self.cache_dir, 'List_of_Wainwrights.html')
+        validators_path = os.path.join(self.cache_dir, 'List_of_Wainwrights.json')
+        headers = {'User-Agent': 'flask-wainwrights'}
+        if os.path.exists(html_path) and os.path.exists(validators_path):
+            with open(validators_path) as f:
+                validators = json.load(f)
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        try:
+            with urlopen(Request(self.url, headers=headers)) as response:
+                html = response.read().decode('utf-8')
+                validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+            self.modified = False
+            with open(html_path, encoding='utf-8') as f:
+                return f.read()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomically(html_path, html.encode('utf-8'))
+        write_atomically(validators_path, json.dumps(validators).encode('utf-8'))
+        return html
+
+    def scrape_wikipedia(self, html: str = None):
+        """gets raw table data from wikipedia url (or the html provided)"""
+        if html is None:
+            html = self.fetch()
+        df = pd.read_html(StringIO(html))
         self.fells = df[self.tables.fells.value]
         self.outlying_fells = df[self.tables.outlying_fells.value]
 
     def convert_grid_references(self):
-        """converts OS grid reference to longitude & latitude then appends to list"""
-        for grid in self.fells['OS Grid Reference']:
-            long,lat = Calculator.get_longlat(grid)
-            self.latitude.append(long)
-            self.longitude.append(lat)
-    
+        """converts all OS grid references of both tables to longitude & latitude in one batch each"""
+        longitude, latitude = Calculator.get_longlats(self.fells['OS Grid Reference'])
+        self.longitude = longitude.tolist()
+        self.latitude = latitude.tolist()
+        longitude, latitude = Calculator.get_longlats(self.outlying_fells['OS Grid Reference'])
+        self.outlying_longitude = longitude.tolist()
+        self.outlying_latitude = latitude.tolist()
+
     def append_df(self):
-        """appends longitude and latitude to existing pandas dataframe of fells"""
-        self.fells['Latitude'] = self.latitude
+        """appends longitude and latitude to existing pandas dataframes of fells and outlying fells"""
         self.fells['Longitude'] = self.longitude
+        self.fells['Latitude'] = self.latitude
+        if len(self.outlying_longitude) == len(self.outlying_fells):
+            self.outlying_fells['Longitude'] = self.outlying_longitude
+            self.outlying_fells['Latitude'] = self.outlying_latitude
         return self.fells
+
+    def refresh(self, output_path: str, outlying_output_path: str = None) -> dict:
+        """runs the whole pipeline, only writing new versions of the csv files if the data has changed
+
+        each changed table is written to a versions folder next to it, named by a hash of its contents,
+        before atomically replacing the current file. Returns the changes found for each file
+        """
+        html = self.fetch()
+        outputs = {output_path: None}
+        if outlying_output_path is not None:
+            outputs[outlying_output_path] = None
+        if not self.modified and all(os.path.exists(path) for path in outputs):
+            return {path: {'added': [], 'removed': [], 'changed': []} for path in outputs}
+
+        self.scrape_wikipedia(html)
+        self.convert_grid_references()
+        outputs[output_path] = self.append_df()
+        if outlying_output_path is not None:
+            outputs[outlying_output_path] = self.outlying_fells
+
+        changes = {}
+        for path, df in outputs.items():
+            current = pd.read_csv(path, encoding='utf-8') if os.path.exists(path) else None
+            changes[path] = diff_fells(current, df)
+            if current is None or any(changes[path].values()):
+                write_version(path, df.to_csv(index=False).encode('utf-8'))
+        return changes
+
+
+def diff_fells(current: pd.DataFrame, new: pd.DataFrame) -> dict:
+    """names of fells added, removed or changed between the current and new tables"""
+    if current is None:
+        return {'added': new['Name'].tolist(), 'removed': [], 'changed': []}
+    current = current.drop_duplicates('Name').set_index('Name')
+    new = new.drop_duplicates('Name').set_index('Name')
+    added = new.index.difference(current.index, sort=False).tolist()
+    removed = current.index.difference(new.index, sort=False).tolist()
+    common = new.index.intersection(current.index, sort=False)
+    changed = []
+    if list(current.columns) != list(new.columns):
+        changed = common.tolist()
+    elif len(common):
+        before = current.loc[common].astype(str)
+        after = new.loc[common, current.columns].astype(str)
+        # round floats the same way as the csv so unchanged coordinates compare equal
+        for column in ('Longitude', 'Latitude'):
+            if column in current.columns:
+                before[column] = current.loc[common, column].astype(float).round(9).astype(str)
+                after[column] = new.loc[common, column].astype(float).round(9).astype(str)
+        changed = common[(before != after).any(axis=1).to_numpy()].tolist()
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+
+def write_version(path: str, data: bytes) -> str:
+    """saves data as a new version in a versions folder beside path, then atomically replaces path with it"""
+    name, extension = os.path.splitext(os.path.basename(path))
+    versions_dir = os.path.join(os.path.dirname(os.path.abspath(path)), 'versions')
+    os.makedirs(versions_dir, exist_ok=True)
+    version_path = os.path.join(versions_dir, f'{name}-{hashlib.blake2b(data, digest_size=8).hexdigest()}{extension}')
+    write_atomically(version_path, data)
+    write_atomically(path, data)
+    return version_path
@@ -0,0 +1,190 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import List
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from src.api import app, datasets, draining, tracking_sessions
+
+
+# seconds an idle kept-alive connection holds a request thread before it is closed
+KEEP_ALIVE_SECONDS = 5
+# a worker exiting within RESPAWN_MIN_UPTIME seconds of starting is replaced after a delay, doubling from
+# RESPAWN_DELAY for each such exit in a row up to RESPAWN_MAX_DELAY, so one that keeps crashing does not spin
+RESPAWN_MIN_UPTIME = 5.0
+RESPAWN_DELAY = 0.5
+RESPAWN_MAX_DELAY = 30.0
+
+
+class RequestHandler(WSGIRequestHandler):
+    """keeps connections alive between requests, but only for KEEP_ALIVE_SECONDS while idle"""
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_SECONDS
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug server answering requests on a fixed pool of threads, rather than starting a thread for each"""
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int = None):
+        super().__init__(host, port, app, RequestHandler, fd=fd)
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='request')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def preload():
+    """loads the dataset and builds its indexes before any worker is forked, so they share one copy
+
+    the arrays are never written to, so their pages stay shared, and gc.freeze() stops the garbage
+    collector touching (and so copying) the pages of the Python objects made while loading. The folder
+    of the tracking sessions is made now too, so every worker uses the same one
+    """
+    datasets.current().warm()
+    app.config['TRACK_DIR'] = tracking_sessions.directory
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(listener: socket.socket, threads: int, streams: int = None):
+    """answers requests from the shared listening socket until SIGTERM or SIGINT, then finishes those in progress
+
+    tracking streams (each holding a thread while open) are limited to streams, by default half the
+    threads and always fewer than them, so threads are left for other requests, including the positions
+    sent to those streams
+    """
+    app.config['TRACK_MAX_STREAMS'] = threads // 2 if streams is None else max(min(streams, threads - 1), 0)
+    host, port = listener.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, threads, fd=listener.fileno())
+
+    def stop(signum, frame):
+        draining.set()
+        # shutdown() waits for serve_forever() to return, so it cannot be called from the thread running it
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    server.pool.shutdown(wait=True)
+
+
+class PreforkServer:
+    """listens in a parent process that loads the dataset once, then forks workers that share it read-only
+
+    every worker accepts connections from the same socket and answers them on a pool of threads. A
+    worker that dies is replaced (after a growing delay if it keeps dying soon after starting), and on
+    SIGTERM or SIGINT each worker stops accepting connections and finishes its requests in progress,
+    being killed if it takes longer than grace seconds
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 5000, workers: int = None, threads: int = 8, grace: float = 30.0,
+                 streams: int = None):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.streams = streams
+        self.grace = grace
+        # pid of each worker and when it started
+        self.children = {}
+        self.stopping = threading.Event()
+
+    def spawn(self, listener: socket.socket) -> int:
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                run_worker(listener, self.threads, self.streams)
+                status = 0
+            finally:
+                os._exit(status)
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def stop(self, signum, frame):
+        """asks every worker to finish, killing any still running after grace seconds"""
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        for pid in list(self.children):
+            self.signal(pid, signal.SIGTERM)
+        timer = threading.Timer(self.grace, lambda: [self.signal(pid, signal.SIGKILL) for pid in list(self.children)])
+        timer.daemon = True
+        timer.start()
+
+    @staticmethod
+    def signal(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def run(self, log=print) -> int:
+        listener = socket.create_server((self.host, self.port), backlog=1024)
+        listener.set_inheritable(True)
+        preload()
+        listening = f'listening on http://{self.host}:{listener.getsockname()[1]} with {self.workers} workers of {self.threads} threads'
+        if not hasattr(os, 'fork'):
+            # e.g. on Windows, serve from this process
+            log(listening, flush=True)
+            run_worker(listener, self.threads, self.streams)
+            return 0
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn(listener)
+        # only once every worker is running
+        log(listening, flush=True)
+        delay = 0.0
+        while self.children:
+            pid, status = os.wait()
+            started = self.children.pop(pid)
+            if self.stopping.is_set():
+                continue
+            if time.monotonic() - started < RESPAWN_MIN_UPTIME:
+                delay = min(max(delay * 2, RESPAWN_DELAY), RESPAWN_MAX_DELAY)
+            else:
+                delay = 0.0
+            log(f'worker {pid} exited with status {status}, starting another' + (f' in {delay:g}s' if delay else ''), flush=True)
+            # returns early if stopped while waiting
+            if not self.stopping.wait(delay):
+                self.spawn(listener)
+        listener.close()
+        return 0
+
+
+def main(argv: List[str] = None) -> int:
+    """serves the api with preforked workers sharing one copy of the dataset"""
+    parser = argparse.ArgumentParser(prog='python main.py serve', description=main.__doc__)
+    parser.add_argument('--host', default=os.environ.get('WAINWRIGHTS_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('WAINWRIGHTS_PORT', 5000)), help='0 picks a free port')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WAINWRIGHTS_WORKERS', 0)), help='processes (default: one per core)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WAINWRIGHTS_THREADS', 8)), help='request threads per worker')
+    parser.add_argument('--grace', type=float, default=float(os.environ.get('WAINWRIGHTS_GRACE', 30)),
+                        help='seconds to finish requests in progress when shutting down')
+    parser.add_argument('--streams', type=int, default=int(os.environ['WAINWRIGHTS_STREAMS']) if 'WAINWRIGHTS_STREAMS' in os.environ else None,
+                        help='open tracking streams per worker (default: half the threads, always fewer than them)')
+    args = parser.parse_args(argv)
+    return PreforkServer(args.host, args.port, args.workers, args.threads, args.grace, args.streams).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+from io import BytesIO
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from src.index import PairwiseDistances
+from src.store import COLUMNS, STRING_COLUMNS, FellStore, slugify
+
+
+SNAPSHOT_FORMAT = 1
+
+
+def write_atomically(path: str, data: bytes):
+    """writes data to a temporary file in the same folder then renames it over path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def _write_array(path: str, values: np.ndarray):
+    """saves values as a .npy file, written to a new file and renamed so workers with the old one mapped are unaffected"""
+    buffer = BytesIO()
+    np.save(buffer, values)
+    write_atomically(path, buffer.getvalue())
+
+
+def _source_stamp(source_path: str) -> list:
+    """size and modification time of the csv the snapshot was built from, to tell if it is stale"""
+    stat = os.stat(source_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_snapshot(source_path: str, snapshot_dir: str) -> str:
+    """writes the fells in source_path (csv) as a binary snapshot that can be memory-mapped
+
+    numeric columns are saved as typed .npy arrays and the text columns as one utf-8 string table
+    with an array of offsets per column, along with the fell to fell distance table, described by manifest.json
+    """
+    store = FellStore.from_csv(source_path)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    manifest = {'format': SNAPSHOT_FORMAT, 'rows': len(store), 'source': _source_stamp(source_path), 'version': store.version, 'columns': {}, 'pairwise': {}}
+    strings = bytearray()
+    for column, values in zip(COLUMNS, store.columns):
+        filename = slugify(column) + '.npy'
+        if column in STRING_COLUMNS:
+            encoded = [value.encode('utf-8') for value in values.tolist()]
+            offsets = np.cumsum([len(strings)] + [len(value) for value in encoded], dtype=np.int64)
+            strings.extend(b''.join(encoded))
+            values = offsets
+        _write_array(os.path.join(snapshot_dir, filename), values)
+        manifest['columns'][column] = filename
+    # the fell to fell distance table, so workers map it rather than each calculating it (unless too large for a table)
+    if isinstance(store.pairwise, PairwiseDistances):
+        for name, values in (('distances', store.pairwise.distances), ('neighbours', store.pairwise.neighbours)):
+            _write_array(os.path.join(snapshot_dir, name + '.npy'), values)
+            manifest['pairwise'][name] = name + '.npy'
+    write_atomically(os.path.join(snapshot_dir, 'strings.bin'), bytes(strings))
+    write_atomically(os.path.join(snapshot_dir, 'manifest.json'), json.dumps(manifest, indent=2).encode('utf-8'))
+    return snapshot_dir
+
+
+def load_snapshot(snapshot_dir: str, source_path: str = None) -> FellStore:
+    """memory-maps a binary snapshot as a FellStore, or returns None if it is missing or older than source_path"""
+    manifest_path = os.path.join(snapshot_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        return None
+    if source_path is not None and os.path.exists(source_path) and manifest['source'] != _source_stamp(source_path):
+        return None
+    with open(os.path.join(snapshot_dir, 'strings.bin'), 'rb') as f:
+        strings = f.read()
+    columns = []
+    for column in COLUMNS:
+        values = np.load(os.path.join(snapshot_dir, manifest['columns'][column]), mmap_mode='r')
+        if column in STRING_COLUMNS:
+            offsets = values.tolist()
+            values = [strings[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+        columns.append(values)
+    pairwise = None
+    if manifest.get('pairwise'):
+        pairwise = PairwiseDistances(*(np.load(os.path.join(snapshot_dir, manifest['pairwise'][name]), mmap_mode='r')
+                                       for name in ('distances', 'neighbours')))
+    return FellStore(*columns, pairwise=pairwise)
+
+
+def load_fells(source_path: str, snapshot_dir: str) -> FellStore:
+    """loads the fells from the snapshot if it is up to date with the csv, otherwise from the csv
+
+    the store's modified_at is when the csv was last changed
+    """
+    store = load_snapshot(snapshot_dir, source_path)
+    if store is None:
+        store = FellStore.from_csv(source_path)
+    if os.path.exists(source_path):
+        store.modified_at = os.stat(source_path).st_mtime
+    return store
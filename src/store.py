@@ -0,0 +1,361 @@
+import csv
+from functools import cached_property
+import hashlib
+import json
+import re
+from typing import List, NamedTuple
+
+import numpy as np
+
+from src.data import Coordinates
+from src.grid import grid_references_to_longlat, parse_grid_references
+from src.index import GridIndex, NameIndex, NearbyDistances, PairwiseDistances, SortedIndex, SpatialIndex
+
+
+COLUMNS = ['Name', 'Height Rank', 'Height (m)', 'Height (ft)', 'Prom. (ft)', 'OS Grid Reference', 'Longitude', 'Latitude']
+STRING_COLUMNS = ['Name', 'OS Grid Reference']
+# columns read from a hill list's csv, the standard columns and those others are derived from
+SOURCE_COLUMNS = COLUMNS + ['Prom. (m)']
+# columns that can be asked for, Nearest only having values when searching from a location
+FIELDS = COLUMNS + ['Nearest']
+
+# bucket sizes of the bounding box (degrees) and OS grid square (metres) indexes
+BOX_CELL_DEGREES = 0.05
+SQUARE_CELL_METRES = 10000
+# largest dataset given a table of every fell to fell distance (6 bytes a pair), larger ones calculate them when asked for
+PAIRWISE_MAX_FELLS = 5000
+FEET_PER_METRE = 3.28084
+
+
+class RenderedFell(NamedTuple):
+    """json body of a single fell, rendered once, with the response headers that go with it"""
+    body: bytes
+    etag: str
+    headers: list
+
+
+def slugify(name: str) -> str:
+    """lower case name with each run of non-alphanumeric characters replaced by a hyphen, e.g. red-pike-wasdale"""
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+def normalise_grid_reference(grid_reference: str) -> str:
+    """upper case grid reference without whitespace, e.g. NY215072"""
+    return re.sub(r'\s+', '', grid_reference).upper()
+
+
+def render(record: dict) -> RenderedFell:
+    """serialises a fell record to json bytes with its ETag and Content-Length"""
+    body = json.dumps(record).encode('utf-8')
+    etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+    headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(body))), ('ETag', etag)]
+    return RenderedFell(body, etag, headers)
+
+
+def derive_columns(columns: dict) -> dict:
+    """fills in the standard columns a hill list lacks from those it has
+
+    heights and prominences in feet from metres (or metres from feet), longitude/latitude from the
+    grid references and Height Rank from the heights, hills of equal height sharing a rank.
+    Raises ValueError if a column cannot be derived
+    """
+    columns = dict(columns)
+    for metres, feet in (('Height (m)', 'Height (ft)'), ('Prom. (m)', 'Prom. (ft)')):
+        if feet not in columns and metres in columns:
+            columns[feet] = np.round(np.asarray(columns[metres], dtype=np.float64) * FEET_PER_METRE)
+        elif metres not in columns and feet in columns:
+            columns[metres] = np.round(np.asarray(columns[feet], dtype=np.float64) / FEET_PER_METRE)
+    if ('Longitude' not in columns or 'Latitude' not in columns) and 'OS Grid Reference' in columns:
+        columns['Longitude'], columns['Latitude'] = grid_references_to_longlat(list(columns['OS Grid Reference']))
+    if 'Height Rank' not in columns and 'Height (m)' in columns:
+        heights = -np.asarray(columns['Height (m)'], dtype=np.float64)
+        columns['Height Rank'] = np.searchsorted(np.sort(heights), heights, side='left') + 1
+    missing = [column for column in COLUMNS if column not in columns]
+    if missing:
+        # the metric columns any of the missing could have been derived from
+        alternatives = {'Height (ft)': 'Height (m)', 'Prom. (ft)': 'Prom. (m)'}
+        raise ValueError("Missing columns: " + ', '.join(
+            f'{column} (or {alternatives[column]})' if column in alternatives else column for column in missing))
+    return columns
+
+
+def _parse_column(column: str, values: List[str], filepath: str):
+    """the values of a csv column, numbers unless it is a string column, raising ValueError naming the first blank or invalid cell"""
+    for row, value in enumerate(values, start=2):
+        if not value.strip():
+            raise ValueError(f"{filepath}: {column} is blank on line {row}")
+        if column not in STRING_COLUMNS:
+            try:
+                number = float(value)
+            except ValueError:
+                number = None
+            if number is None or not np.isfinite(number):
+                raise ValueError(f"{filepath}: {column} is not a number on line {row}: {value!r}")
+    return values if column in STRING_COLUMNS else np.array(values, dtype=np.float64)
+
+
+def _read_only(values, dtype) -> np.ndarray:
+    """values as an array of dtype that cannot be written to, copying unless it is already read-only (e.g. memory-mapped)"""
+    array = np.asarray(values, dtype=dtype)
+    if array.flags.writeable:
+        array = array.copy()
+        array.flags.writeable = False
+    return array
+
+
+def _read_only_measure(values) -> np.ndarray:
+    """heights or prominences as a read-only array, of int32 when all are whole numbers, otherwise of float64 so none are truncated"""
+    array = np.asarray(values)
+    if array.dtype.kind == 'f' and not np.all(array == np.round(array)):
+        return _read_only(array, np.float64)
+    return _read_only(array, np.int32)
+
+
+class FellStore:
+    """read-only columnar store of the fells dataset, loaded once and shared between requests
+
+    queries never write to the store, they produce a FellView holding their own positions and distances
+    """
+
+    def __init__(self, names, height_rank, height_m, height_ft, prominence_ft, grid_references, longitudes, latitudes,
+                 pairwise: PairwiseDistances = None):
+        self.names = _read_only(names, str)
+        self.height_rank = _read_only(height_rank, np.int32)
+        self.height_m = _read_only_measure(height_m)
+        self.height_ft = _read_only_measure(height_ft)
+        self.prominence_ft = _read_only_measure(prominence_ft)
+        self.grid_references = _read_only(grid_references, str)
+        self.longitudes = _read_only(longitudes, np.float64)
+        self.latitudes = _read_only(latitudes, np.float64)
+        self.columns = [self.names, self.height_rank, self.height_m, self.height_ft, self.prominence_ft,
+                        self.grid_references, self.longitudes, self.latitudes]
+        digest = hashlib.blake2b(digest_size=8)
+        for column in self.columns:
+            digest.update(column.tobytes())
+        self.version = digest.hexdigest()
+        self.coordinates = Coordinates(self.longitudes, self.latitudes)
+        # when the data was last changed (seconds since the epoch), if known
+        self.modified_at = None
+        if pairwise is not None:
+            # e.g. memory-mapped from a snapshot of this version, so it is not calculated again
+            self.pairwise = pairwise
+
+    # indexes and rendered responses are built on first use, see warm()
+    @cached_property
+    def spatial_index(self) -> SpatialIndex:
+        return SpatialIndex(self.longitudes, self.latitudes)
+
+    @cached_property
+    def box_index(self) -> GridIndex:
+        return GridIndex(self.longitudes, self.latitudes, BOX_CELL_DEGREES)
+
+    @cached_property
+    def square_index(self) -> GridIndex:
+        return GridIndex(*parse_grid_references(self.grid_references.tolist()), SQUARE_CELL_METRES)
+
+    @cached_property
+    def pairwise(self) -> PairwiseDistances:
+        if len(self) > PAIRWISE_MAX_FELLS:
+            return NearbyDistances(self.coordinates, self.spatial_index)
+        return PairwiseDistances.from_coordinates(self.coordinates)
+
+    @cached_property
+    def name_index(self) -> NameIndex:
+        return NameIndex(self.names.tolist())
+
+    @cached_property
+    def sorted_indexes(self) -> dict:
+        return {
+            'Height Rank': SortedIndex(self.height_rank),
+            'Height (m)': SortedIndex(self.height_m),
+            'Height (ft)': SortedIndex(self.height_ft),
+            'Prom. (ft)': SortedIndex(self.prominence_ft),
+        }
+
+    @cached_property
+    def rendered(self) -> List[RenderedFell]:
+        # single fell responses never change, so render them once
+        return [render(self.record(position)) for position in range(len(self))]
+
+    @cached_property
+    def slugs(self) -> dict:
+        slugs = {}
+        for position, name in enumerate(self.names.tolist()):
+            slugs.setdefault(slugify(name), position)
+        return slugs
+
+    @cached_property
+    def grid_reference_positions(self) -> dict:
+        positions = {}
+        for position, grid_reference in enumerate(self.grid_references.tolist()):
+            positions.setdefault(normalise_grid_reference(grid_reference), position)
+        return positions
+
+    def warm(self):
+        """builds every index and rendered response now rather than on first use"""
+        for name in ('spatial_index', 'box_index', 'square_index', 'pairwise', 'name_index', 'sorted_indexes', 'rendered', 'slugs', 'grid_reference_positions'):
+            getattr(self, name)
+        return self
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """builds the store from a dataframe with the standard wainwrights columns"""
+        return cls(*(df[column].to_numpy() for column in COLUMNS))
+
+    @classmethod
+    def from_csv(cls, filepath: str):
+        """builds the store from a csv file of a hill list (without needing pandas)
+
+        columns other lists lack, such as the Height Rank of the outlying fells, are derived (see
+        derive_columns), and the hills ordered by rank if it was derived, so positions are in height rank order.
+        Other columns are ignored. Raises ValueError if a column cannot be derived or a cell is blank or not a number
+        """
+        with open(filepath, encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+        columns = {}
+        for column in reader.fieldnames or []:
+            if column in SOURCE_COLUMNS:
+                columns[column] = _parse_column(column, [row[column] or '' for row in rows], filepath)
+        ranked = 'Height Rank' in columns
+        columns = derive_columns(columns)
+        order = np.arange(len(rows)) if ranked else np.argsort(columns['Height Rank'], kind='stable')
+        return cls(*(np.asarray(columns[column])[order] for column in COLUMNS))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def view(self, positions: np.ndarray = None):
+        """returns a view over every fell (or those at positions) in height rank order"""
+        return FellView(self, np.arange(len(self)) if positions is None else positions)
+
+    def distances(self, longitudes, latitudes, positions: np.ndarray = None) -> np.ndarray:
+        """distance (km) from each fell at positions (or every fell) to the closest of the locations"""
+        return self.distance_matrix(longitudes, latitudes, positions).min(axis=0)
+
+    def distance_matrix(self, longitudes, latitudes, positions: np.ndarray = None) -> np.ndarray:
+        """distances (km) from each location (rows) to each fell at positions, or every fell (columns)"""
+        return self.coordinates.distance_matrix(np.atleast_1d(longitudes), np.atleast_1d(latitudes), positions)
+
+    def record(self, position: int) -> dict:
+        """returns a single fell as a dictionary of python values"""
+        return dict(zip(COLUMNS, (column[position].item() for column in self.columns)))
+
+    def find_by_slug(self, slug: str) -> int:
+        """position of the fell with the name slug (or name), otherwise None"""
+        return self.slugs.get(slugify(slug))
+
+    def find_by_grid_reference(self, grid_reference: str) -> int:
+        """position of the fell at the grid reference, otherwise None"""
+        return self.grid_reference_positions.get(normalise_grid_reference(grid_reference))
+
+    def search(self, names: List[str], match: str = 'contains'):
+        """returns a view of the fells whose names match any of names, best matches first"""
+        return FellView(self, self.name_index.search(names, match))
+
+
+class FellView:
+    """immutable query result over a FellStore: the positions of the selected fells and their distances, if any"""
+
+    def __init__(self, store: FellStore, positions: np.ndarray, nearest: np.ndarray = None):
+        self.store = store
+        self.positions = positions
+        self.nearest = nearest
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def filter(self, mask: np.ndarray):
+        """keeps only the fells where the boolean mask (over the whole store) is true"""
+        keep = mask[self.positions]
+        nearest = self.nearest[keep] if self.nearest is not None else None
+        return FellView(self.store, self.positions[keep], nearest)
+
+    def restrict(self, positions: np.ndarray):
+        """keeps only the fells at positions, in the view's existing order"""
+        keep = np.isin(self.positions, positions)
+        nearest = self.nearest[keep] if self.nearest is not None else None
+        return FellView(self.store, self.positions[keep], nearest)
+
+    def head(self, limit: int = None):
+        """keeps only the first limit fells"""
+        if limit is None:
+            return self
+        nearest = self.nearest[:limit] if self.nearest is not None else None
+        return FellView(self.store, self.positions[:limit], nearest)
+
+    def sort_by_distance(self, longitude, latitude, limit: int = None, within_km: float = None):
+        """orders the fells by distance (km) from the location (or the closest of several), recording it as Nearest
+
+        keeping only those within_km and the first limit if given: the same fells, in the same order, as
+        nearest_to, but measuring every fell in the view, so faster when it holds few of the store's
+        """
+        positions = self.positions if limit is None and within_km is None else np.sort(self.positions)
+        nearest = self.store.distances(longitude, latitude, positions)
+        if within_km is not None:
+            keep = nearest <= within_km
+            positions, nearest = positions[keep], nearest[keep]
+        order = np.argsort(nearest, kind='stable')
+        return FellView(self.store, positions[order], nearest[order]).head(limit)
+
+    def sort_by_distances(self, distances: np.ndarray, limit: int = None, within_km: float = None):
+        """orders the fells by precomputed distances (km, one per fell in the store), keeping those within_km and the first limit
+
+        gives the same result as sort_by_distance, or nearest_to when limiting, without calculating the distances again
+        """
+        positions = self.positions if limit is None and within_km is None else np.sort(self.positions)
+        nearest = distances[positions]
+        if within_km is not None:
+            keep = nearest <= within_km
+            positions, nearest = positions[keep], nearest[keep]
+        order = np.argsort(nearest, kind='stable')
+        return FellView(self.store, positions[order], nearest[order]).head(limit)
+
+    def nearest_to(self, longitude, latitude, limit: int = None, within_km: float = None):
+        """uses the spatial index to keep only the nearest (limit) fells and/or those within_km of the location
+
+        with several locations, every fell in the result is among the nearest to one of them, so the
+        index is searched around each and the union ordered by distance to the closest location
+        """
+        mask = None
+        if len(self.positions) != len(self.store):
+            mask = np.zeros(len(self.store), dtype=bool)
+            mask[self.positions] = True
+        candidates = []
+        for point in zip(np.atleast_1d(longitude), np.atleast_1d(latitude)):
+            if within_km is not None:
+                positions, _ = self.store.spatial_index.within(*point, within_km, mask)
+            else:
+                positions, _ = self.store.spatial_index.nearest(*point, limit, mask)
+            candidates.append(positions)
+        positions = np.unique(np.concatenate(candidates))
+        return FellView(self.store, positions).sort_by_distance(longitude, latitude).head(limit)
+
+    def skip(self, offset: int = 0):
+        """drops the first offset fells, e.g. those on earlier pages"""
+        if not offset:
+            return self
+        nearest = self.nearest[offset:] if self.nearest is not None else None
+        return FellView(self.store, self.positions[offset:], nearest)
+
+    def chunks(self, size: int):
+        """splits the view into views of at most size fells, in order"""
+        for start in range(0, len(self), size):
+            yield self.skip(start).head(size)
+
+    def columns(self, fields: List[str] = None) -> dict:
+        """returns the selected fells as arrays by column name, only those in fields (in that order) if given
+
+        Nearest is included when the fells have distances
+        """
+        columns = dict(zip(COLUMNS, (column[self.positions] for column in self.store.columns)))
+        if self.nearest is not None:
+            columns['Nearest'] = self.nearest
+        if fields is None:
+            return columns
+        return {field: columns[field] for field in fields if field in columns}
+
+    def records(self, fields: List[str] = None) -> List[dict]:
+        """returns the selected fells as a list of dictionaries of python values, only with fields if given"""
+        columns = self.columns(fields)
+        return [dict(zip(columns, row)) for row in zip(*(column.tolist() for column in columns.values()))]
@@ -0,0 +1,262 @@
+import atexit
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+from threading import Event, Lock, get_ident
+import time
+
+import numpy as np
+
+from src.data import Calculator
+from src.store import FellStore, FellView
+
+
+# ids from secrets.token_urlsafe(16)
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{22}')
+
+
+class NearestTracker:
+    """the nearest limit fells to a moving location, updated from a neighbourhood of fells kept from earlier moves
+
+    the fells within radius (km) of a centre are kept as candidates. After a move, the new nearest fells are
+    no further than reach, the distance to the furthest of the previous nearest, so while the new location
+    is at least reach inside the neighbourhood only its candidates are searched. Otherwise the neighbourhood
+    is fetched again from the spatial index around the new location, with margin_km to spare for the next moves
+    """
+
+    def __init__(self, store: FellStore, limit: int, margin_km: float = 2.0, precision: int = 3):
+        self.store = store
+        self.limit = limit
+        self.margin_km = margin_km
+        self.precision = precision
+        self.centre = None
+        self.radius = 0.0
+        self.candidates = np.empty(0, dtype=np.int64)
+        self.positions = np.empty(0, dtype=np.int64)
+        self.distances = np.empty(0)
+        # times the neighbourhood was fetched from the spatial index
+        self.rescans = 0
+
+    def nearest(self, longitude: float, latitude: float) -> tuple:
+        """positions and distances (km) of the nearest fells to the location, closest first"""
+        if self.centre is not None and len(self.positions):
+            moved = Calculator.calculate_distance(*self.centre, longitude, latitude)
+            reach = self.store.distances(longitude, latitude, self.positions).max()
+            if moved + reach <= self.radius:
+                distances = self.store.distances(longitude, latitude, self.candidates)
+                order = np.argsort(distances, kind='stable')[:self.limit]
+                return self.candidates[order], distances[order]
+        positions, distances = self.store.spatial_index.nearest(longitude, latitude, self.limit)
+        self.radius = (distances[-1] if len(distances) else 0.0) + self.margin_km
+        self.candidates, _ = self.store.spatial_index.within(longitude, latitude, self.radius)
+        self.centre = (longitude, latitude)
+        self.rescans += 1
+        # the same Haversine distances as the candidates are searched by
+        distances = self.store.distances(longitude, latitude, positions)
+        order = np.argsort(distances, kind='stable')
+        return positions[order], distances[order]
+
+    def update(self, longitude: float, latitude: float) -> dict:
+        """moves to the location, returning the changes to the nearest fells, or None if there are none
+
+        the fells that are new to the nearest as records (with their id), the ids of those no longer
+        nearest, and the id and distance (km, to precision places) of every nearest fell, closest first
+        """
+        positions, distances = self.nearest(longitude, latitude)
+        distances = np.round(distances, self.precision)
+        if np.array_equal(positions, self.positions) and np.array_equal(distances, self.distances):
+            return None
+        previous = set(self.positions.tolist())
+        current = set(positions.tolist())
+        added = [position for position in positions.tolist() if position not in previous]
+        removed = [position for position in self.positions.tolist() if position not in current]
+        self.positions, self.distances = positions, distances
+        records = FellView(self.store, np.array(added, dtype=np.int64)).records()
+        return {
+            'added': [{'id': position, **record} for position, record in zip(added, records)],
+            'removed': removed,
+            'nearest': [[position, distance] for position, distance in zip(positions.tolist(), distances.tolist())],
+        }
+
+
+class TrackingSessions:
+    """the open tracking sessions by id, each a file in directory so every worker process can reach them
+
+    a session's file holds the settings it was opened with and its latest location, and is touched
+    whenever the session is used, so those unused for ttl seconds are closed. Its stream of changes is
+    answered by whichever process it was opened in (see watch), which reads the file for new locations,
+    however they arrived. A process holds at most a given number of open streams (see start_stream), as
+    each occupies one of its request threads. Without a directory, a temporary one is made on first use
+    (to be shared by worker processes it must be used before they are forked)
+    """
+
+    def __init__(self, directory: str = None, ttl: float = 300.0, max_sessions: int = 1000, clock=time.time):
+        self._directory = directory
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        # streams open in this process
+        self.streams = 0
+        self.lock = Lock()
+        # events of the streams watching each session in this process, set when it changes
+        self.watching = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        """the sessions' folder, a temporary one made on first use (and removed when the process exits) if none was given"""
+        if self._directory is None:
+            with self.lock:
+                if self._directory is None:
+                    self._directory = tempfile.mkdtemp(prefix='wainwrights-track-')
+                    atexit.register(shutil.rmtree, self._directory, ignore_errors=True)
+        return self._directory
+
+    def __len__(self) -> int:
+        return len(self._ids())
+
+    def _ids(self) -> list:
+        return [filename[:-len('.json')] for filename in os.listdir(self.directory) if filename.endswith('.json')]
+
+    def _path(self, id: str) -> str:
+        """the session's file, or None if id could not be one (so it cannot name another file)"""
+        return os.path.join(self.directory, id + '.json') if SESSION_ID.fullmatch(id) else None
+
+    def _write(self, path: str, session: dict):
+        """replaces the session's file at once, so it is never read part written, marking it as used now"""
+        temporary = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        now = self.clock()
+        os.utime(temporary, (now, now))
+        os.replace(temporary, path)
+
+    def _read(self, path: str) -> dict:
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def create(self, settings: dict, location: tuple = None) -> str:
+        """opens a session with settings (json), optionally at a location, returning its id, or None if max_sessions are already open"""
+        self.expire()
+        if len(self) >= self.max_sessions:
+            return None
+        id = secrets.token_urlsafe(16)
+        self._write(self._path(id), {'settings': settings, 'location': location})
+        return id
+
+    def get(self, id: str) -> dict:
+        """the settings and latest location of the open session with id, otherwise None"""
+        path = self._path(id)
+        if path is None:
+            return None
+        try:
+            touched = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        if self.clock() - touched > self.ttl:
+            self.close(id)
+            return None
+        return self._read(path)
+
+    def send(self, id: str, longitude: float, latitude: float) -> bool:
+        """makes the location the session's latest, returning whether the session is open"""
+        session = self.get(id)
+        if session is None:
+            return False
+        session['location'] = [longitude, latitude]
+        self._write(self._path(id), session)
+        self.wake(id)
+        return True
+
+    def touch(self, id: str):
+        """marks the session as used now"""
+        now = self.clock()
+        try:
+            os.utime(self._path(id), (now, now))
+        except FileNotFoundError:
+            pass
+
+    def close(self, id: str) -> bool:
+        """closes the session with id, ending its stream, returning whether it was open"""
+        path = self._path(id)
+        if path is None:
+            return False
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        self.wake(id)
+        return True
+
+    def expire(self):
+        """closes the sessions unused for ttl seconds"""
+        now = self.clock()
+        for id in self._ids():
+            try:
+                if now - os.stat(self._path(id)).st_mtime > self.ttl:
+                    self.close(id)
+            except FileNotFoundError:
+                continue
+
+    def start_stream(self, max_streams: int = None) -> bool:
+        """counts a stream opened in this process, unless max_streams are open already"""
+        with self.lock:
+            if max_streams is not None and self.streams >= max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def end_stream(self):
+        with self.lock:
+            self.streams -= 1
+
+    def wake(self, id: str):
+        """wakes the streams watching the session in this process, to check it for a change"""
+        with self.lock:
+            for woken in self.watching.get(id, ()):
+                woken.set()
+
+    def watch(self, id: str, heartbeat: float, poll: float = 1.0, stop: Event = None):
+        """yields each new location of the session, or None after heartbeat seconds without one, until it is closed (or stop is set)
+
+        the file is read whenever the session is changed in this process (see wake), otherwise every poll
+        seconds, which is how long a location sent to another process can take to arrive. Of several
+        locations sent in between only the latest is yielded. The session is touched every heartbeat, so
+        it stays open while it is watched
+        """
+        woken = Event()
+        with self.lock:
+            self.watching.setdefault(id, set()).add(woken)
+        try:
+            latest = None
+            heard = time.monotonic()
+            while stop is None or not stop.is_set():
+                woken.clear()
+                session = self.get(id)
+                if session is None:
+                    return
+                location = session['location']
+                if location is not None and location != latest:
+                    latest = location
+                    heard = time.monotonic()
+                    yield tuple(location)
+                    continue
+                quiet = time.monotonic() - heard
+                if quiet >= heartbeat:
+                    heard = time.monotonic()
+                    self.touch(id)
+                    yield None
+                    continue
+                woken.wait(min(poll, heartbeat - quiet))
+        finally:
+            with self.lock:
+                self.watching[id].discard(woken)
+                if not self.watching[id]:
+                    del self.watching[id]
@@ -1,4 +1,11 @@
+import gzip
 import json
+import os
+import tempfile
+from unittest import mock
+
+from src.api import app, catalogue, draining, metrics, query_cache
+from src.dataset import DatasetManager
 
 from .framework import Framework
 
@@ -71,6 +78,47 @@ class FellTest(Framework):
         retrieved_columns = [col for col in json_data]
         self.check_lists_are_equal(expected_columns, retrieved_columns)
 
+    def test_nearest_not_leaked_after_location_query(self):
+        """ensure a previous location query does not add Nearest to single fells"""
+        self.app.get("/fells/" + self.generate_query(longitude=self.longitude, latitude=self.latitude))
+        r = self.app.get(self.url + self.id)
+        self.assertNotIn('Nearest', json.loads(r.get_data()))
+
+
+class FellLookupTest(Framework):
+    """unittest for the pre-rendered fell/, fell/name/ and fell/gridref/ endpoints"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = "/fell/"
+
+    def test_response_headers_are_precomputed(self):
+        """ensure the ETag and Content-Length headers describe the body"""
+        r = self.app.get(self.url + self.id)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['Content-Type'], 'application/json')
+        self.assertEqual(int(r.headers['Content-Length']), len(r.get_data()))
+        self.assertTrue(r.headers['ETag'].startswith('"'))
+
+    def test_fell_by_name_slug(self):
+        """ensure fells can be found by name slug, whatever the case or spacing"""
+        expected = json.loads(self.app.get(self.url + '0').get_data())
+        for slug in ['scafell-pike', 'Scafell Pike', 'SCAFELL_PIKE']:
+            r = self.app.get(self.url + 'name/' + slug)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(json.loads(r.get_data()), expected)
+
+    def test_fell_by_grid_reference(self):
+        """ensure fells can be found by grid reference"""
+        r = self.app.get(self.url + 'gridref/' + self.grid_reference.lower())
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(json.loads(r.get_data())['OS Grid Reference'], self.grid_reference)
+
+    def test_404_if_name_or_grid_reference_not_found(self):
+        """expect 404 status code for unknown names and grid references"""
+        self.assertEqual(self.app.get(self.url + 'name/not-a-fell').status_code, 404)
+        self.assertEqual(self.app.get(self.url + 'gridref/NY000000').status_code, 404)
+
 
 class FellsTest(Framework):
     """unittest for the fells/ endpoint"""
@@ -227,6 +275,673 @@ class FellsTest(Framework):
         url = self.url + query
         r = self.app.get(url)
         self.assertEqual(r.status_code, 200)
-    
-    
 
+    def test_limit_returns_nearest_fells(self):
+        """checks limit only returns that many fells, nearest first"""
+        query = self.generate_query(longitude=self.longitude, latitude=self.latitude, limit=3)
+        r = self.app.get(self.url + query)
+        self.assertEqual(r.status_code, 200)
+
+        df = self.convert_request_to_df(r)
+        self.assertEqual(len(df), 3)
+        self.assertEqual(df.iloc[0]['Name'], 'Skiddaw')
+        self.assertTrue(df['Nearest'].is_monotonic_increasing)
+
+    def test_within_km_returns_only_fells_in_radius(self):
+        """checks within_km only returns fells inside the radius of the location"""
+        query = self.generate_query(longitude=self.longitude, latitude=self.latitude, within_km=5)
+        r = self.app.get(self.url + query)
+        self.assertEqual(r.status_code, 200)
+
+        df = self.convert_request_to_df(r)
+        self.assertGreater(len(df), 0)
+        self.assertLess(len(df), 214)
+        self.assertTrue((df['Nearest'] <= 5).all())
+
+    def test_limit_combined_with_height_filter(self):
+        """checks limit picks the nearest fells from those matching other filters"""
+        query = self.generate_query(gridref=self.grid_reference, below=800, limit=5)
+        r = self.app.get(self.url + query)
+        self.assertEqual(r.status_code, 200)
+
+        df = self.convert_request_to_df(r)
+        self.assertEqual(len(df), 5)
+        self.assertTrue((df['Height (m)'] < 800).all())
+
+    def test_404_if_limit_is_not_valid_number(self):
+        """returns 404 if limit is not a number"""
+        r = self.app.get(self.url + self.generate_query(limit='hello'))
+        self.assertEqual(r.status_code, 404)
+        for limit in ('inf', 'nan', '2.5'):
+            self.assertEqual(self.app.get(self.url + self.generate_query(limit=limit)).status_code, 404)
+            self.assertEqual(self.app.get(self.url + self.generate_query(offset=limit)).status_code, 404)
+
+    def test_name_match_modes(self):
+        """checks exact, prefix and fuzzy name matching through the match parameter"""
+        r = self.app.get(self.url + self.generate_query(name='scafell', match='exact'))
+        self.assertEqual([fell['Name'] for fell in json.loads(r.get_data())], ['Scafell'])
+
+        r = self.app.get(self.url + self.generate_query(name='skidaw', match='fuzzy'))
+        self.assertEqual(json.loads(r.get_data())[0]['Name'], 'Skiddaw')
+
+    def test_name_is_not_a_regex(self):
+        """checks regex patterns in names do not match every fell"""
+        r = self.app.get(self.url + self.generate_query(name='.*'))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(json.loads(r.get_data()), [])
+
+    def test_404_if_match_is_not_valid(self):
+        """returns 404 if match is not a known mode"""
+        r = self.app.get(self.url + self.generate_query(name=self.fell_name, match='regex'))
+        self.assertEqual(r.status_code, 404)
+
+    def test_404_if_names_too_long_or_too_many(self):
+        """returns 404 for a name longer than FELLS_MAX_NAME_LENGTH or more than FELLS_MAX_NAMES names, before searching"""
+        r = self.app.get(self.url + self.generate_query(name='a' * 4000, match='fuzzy'))
+        self.assertEqual(r.status_code, 404)
+        r = self.app.get(self.url + '?' + '&'.join(f'name=fell{i}' for i in range(21)))
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(self.app.get(self.url + self.generate_query(name='a' * 101)).status_code, 404)
+        self.assertEqual(self.app.get(self.url + self.generate_query(name='a' * 100)).status_code, 200)
+        r = self.app.get(self.url + '?' + '&'.join(f'name=fell{i}' for i in range(20)))
+        self.assertEqual(r.status_code, 200)
+
+    def test_above_and_below_in_feet(self):
+        """checks above and below are compared against Height (ft) when unit=ft"""
+        r = self.app.get(self.url + self.generate_query(above=2000, below=2500, unit='ft'))
+        self.assertEqual(r.status_code, 200)
+
+        df = self.convert_request_to_df(r)
+        self.assertGreater(len(df), 0)
+        self.assertTrue(((df['Height (ft)'] > 2000) & (df['Height (ft)'] < 2500)).all())
+
+    def test_prominence_and_rank_ranges(self):
+        """checks prominence and height rank bounds are inclusive and combine with the height range"""
+        r = self.app.get(self.url + self.generate_query(min_prom=200, max_prom=1000, min_rank=1, max_rank=50, above=850))
+        self.assertEqual(r.status_code, 200)
+
+        df = self.convert_request_to_df(r)
+        self.assertGreater(len(df), 0)
+        self.assertTrue(df['Prom. (ft)'].between(200, 1000).all())
+        self.assertTrue(df['Height Rank'].between(1, 50).all())
+        self.assertTrue((df['Height (m)'] > 850).all())
+        self.assertTrue(df['Height Rank'].is_monotonic_increasing)
+
+    def test_404_if_range_not_finite(self):
+        """returns 404 if a height, prominence or rank bound is inf or nan"""
+        for parameter in ['above', 'below', 'min_prom', 'max_prom', 'min_rank', 'max_rank']:
+            for value in ['nan', 'inf', '-inf']:
+                r = self.app.get(self.url + self.generate_query(**{parameter: value}))
+                self.assertEqual(r.status_code, 404)
+
+    def test_404_if_unit_is_not_valid(self):
+        """returns 404 if unit is not metres or feet"""
+        r = self.app.get(self.url + self.generate_query(above=200, unit='yards'))
+        self.assertEqual(r.status_code, 404)
+
+    def test_multiple_grid_references(self):
+        """checks distances are to the closest of several grid references"""
+        r = self.app.get(self.url + '?gridref=NY342151&gridref=NY215072&limit=2')
+        self.assertEqual(r.status_code, 200)
+
+        df = self.convert_request_to_df(r)
+        self.assertEqual(sorted(df['Name']), ['Helvellyn', 'Scafell Pike'])
+        self.assertTrue((df['Nearest'] < 1e-6).all())
+
+    def test_404_if_grid_reference_is_not_valid(self):
+        """returns 404 if the grid reference cannot be converted"""
+        r = self.app.get(self.url + self.generate_query(gridref='NY12345'))
+        self.assertEqual(r.status_code, 404)
+
+    def test_explain_returns_plan(self):
+        """checks explain=1 returns the steps of the plan, most selective first, instead of the fells"""
+        query = '?above=300&name=pike&match=contains&bbox=-3.3,54.4,-3.0,54.6&gridref=NY215072&limit=3'
+        fells = json.loads(self.app.get(self.url + query).data)
+        r = self.app.get(self.url + query + '&explain=1')
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('no-store', r.headers['Cache-Control'])
+        explained = json.loads(r.data)
+        steps = explained['plan']
+        self.assertEqual(steps[0]['predicate'], 'name contains pike')
+        self.assertEqual(steps[0]['method'], 'index')
+        self.assertEqual([step['estimate'] for step in steps[:-1]], sorted(step['estimate'] for step in steps[:-1]))
+        self.assertTrue(steps[-1]['predicate'].startswith('nearest 3'))
+        self.assertEqual(explained['rows'], len(fells))
+
+    def test_explain_nearest_method(self):
+        """checks the nearest fells are sorted from the few a selective filter leaves, and searched for in the spatial index otherwise"""
+        for query, method in [('?above=900&gridref=NY215072&limit=3', 'sort'), ('?gridref=NY215072&limit=3', 'spatial index'),
+                              ('?name=pike&gridref=NY215072&within_km=10', 'sort'), ('?gridref=NY215072&within_km=10', 'spatial index')]:
+            explained = json.loads(self.app.get(self.url + query + '&explain=1').data)
+            self.assertEqual(explained['plan'][-1]['method'], method)
+            fells = json.loads(self.app.get(self.url + query).data)
+            self.assertEqual(explained['rows'], len(fells))
+            self.assertEqual([fell['Nearest'] for fell in fells], sorted(fell['Nearest'] for fell in fells))
+
+
+
+class FellsBatchTest(Framework):
+    """unittest for the fells/batch endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = "/fells/batch"
+
+    def test_results_match_individual_queries(self):
+        """checks each result of a batch is the same as running its query on its own, in order"""
+        queries = [
+            {'longitude': self.longitude, 'latitude': self.latitude, 'limit': 5},
+            {'gridref': [self.grid_reference, 'NY215072'], 'within_km': 2},
+            {'name': self.fell_name},
+            {'above': 900, 'longitude': -3.0, 'latitude': 54.5},
+            {'min_rank': 10, 'max_rank': 20},
+        ]
+        r = self.app.post(self.url, json=queries)
+        self.assertEqual(r.status_code, 200)
+        results = r.get_json()
+        self.assertEqual(len(results), len(queries))
+        for query, result in zip(queries, results):
+            args = [(key, value) for key, values in query.items() for value in (values if isinstance(values, list) else [values])]
+            expected = self.app.get('/fells/', query_string=args).get_json()
+            self.assertEqual(result, expected)
+
+    def test_queries_wrapped_in_object(self):
+        """checks the queries can also be sent as {"queries": [...]}"""
+        r = self.app.post(self.url, json={'queries': [{'limit': 1}]})
+        self.assertEqual(r.get_json(), [[self.app.get('/fell/0').get_json()]])
+
+    def test_invalid_query_does_not_fail_batch(self):
+        """checks an invalid query gets an error in its place while the others are answered"""
+        r = self.app.post(self.url, json=[{'above': 'high'}, {'gridref': 'NY12345'}, {'square': 'QQ'}, {'limit': 2}])
+        self.assertEqual(r.status_code, 200)
+        invalid_number, invalid_grid_reference, invalid_square, valid = r.get_json()
+        self.assertEqual(invalid_number['status'], 404)
+        self.assertEqual(invalid_grid_reference['status'], 404)
+        self.assertEqual(invalid_square['status'], 404)
+        self.assertEqual(len(valid), 2)
+
+    def test_400_if_body_is_not_a_list(self):
+        """returns 400 if the body is not a list of queries"""
+        self.assertEqual(self.app.post(self.url, json={'name': 'scafell'}).status_code, 400)
+        self.assertEqual(self.app.post(self.url, data='not json').status_code, 400)
+
+    def test_413_if_too_many_queries(self):
+        """returns 413 if the batch has more than FELLS_BATCH_MAX_QUERIES queries"""
+        r = self.app.post(self.url, json=[{}] * 1001)
+        self.assertEqual(r.status_code, 413)
+
+
+class DistancesTest(Framework):
+    """unittest for the fell/<id>/neighbours and distances endpoints"""
+
+    def test_neighbours_closest_first(self):
+        """checks the neighbours of a fell are the other fells closest first, with their distance"""
+        r = self.app.get(f'/fell/{self.id}/neighbours?limit=5')
+        self.assertEqual(r.status_code, 200)
+        df = self.convert_request_to_df(r)
+        self.assertEqual(len(df), 5)
+        self.assertTrue(df['Nearest'].is_monotonic_increasing)
+        self.assertNotIn(self.app.get(f'/fell/{self.id}').get_json()['Name'], df['Name'].tolist())
+
+    def test_neighbours_404_if_fell_does_not_exist(self):
+        """returns 404 if the fell id or limit is not valid"""
+        self.assertEqual(self.app.get('/fell/999/neighbours').status_code, 404)
+        self.assertEqual(self.app.get(f'/fell/{self.id}/neighbours?limit=a').status_code, 404)
+        self.assertEqual(self.app.get(f'/fell/{self.id}/neighbours?limit=inf').status_code, 404)
+
+    def test_distances_between_fells(self):
+        """checks the distances between fells agree with the neighbours endpoint"""
+        neighbour = self.app.get(f'/fell/{self.id}/neighbours?limit=1').get_json()[0]
+        neighbour_id = neighbour['Height Rank'] - 1
+        r = self.app.get(f'/distances?ids={self.id},{neighbour_id}&ids=0')
+        self.assertEqual(r.status_code, 200)
+        body = r.get_json()
+        self.assertEqual(body['ids'], [int(self.id), neighbour_id, 0])
+        self.assertEqual(body['distances'][0][1], neighbour['Nearest'])
+        self.assertEqual(body['distances'][1][0], neighbour['Nearest'])
+
+    def test_distances_404_if_ids_not_valid(self):
+        """returns 404 if no ids are given or any is not a fell"""
+        self.assertEqual(self.app.get('/distances').status_code, 404)
+        self.assertEqual(self.app.get('/distances?ids=1,999').status_code, 404)
+        self.assertEqual(self.app.get('/distances?ids=1,a').status_code, 404)
+        self.assertEqual(self.app.get('/distances?ids=1,inf').status_code, 404)
+
+
+class RouteTest(Framework):
+    """unittest for the route endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = "/route"
+
+    def test_route_through_nearest_fells(self):
+        """checks the route visits the fells matching the query once each, with legs adding up to the total"""
+        r = self.app.get(self.url + f'?gridref={self.grid_reference}&limit=20')
+        self.assertEqual(r.status_code, 200)
+        body = r.get_json()
+        nearest = self.app.get(f'/fells/?gridref={self.grid_reference}&limit=20').get_json()
+        self.assertTrue(self.check_lists_are_equal([f['Name'] for f in body['fells']], [f['Name'] for f in nearest]))
+        self.assertAlmostEqual(sum(f['Leg (km)'] for f in body['fells']), body['distance_km'], places=2)
+
+    def test_route_by_ids_returning_to_start(self):
+        """checks a round trip through the given fells includes the leg back to the start"""
+        r = self.app.get(self.url + f'?ids=0,1,5&return=1&longitude={self.longitude}&latitude={self.latitude}')
+        body = r.get_json()
+        self.assertTrue(body['return_to_start'])
+        self.assertEqual(sorted(f['Height Rank'] for f in body['fells']), [1, 2, 6])
+        self.assertGreater(body['distance_km'], sum(f['Leg (km)'] for f in body['fells']))
+
+    def test_404_if_route_not_valid(self):
+        """returns 404 if returning without a start, for several starts or invalid numbers"""
+        self.assertEqual(self.app.get(self.url + '?ids=0,1&return=1').status_code, 404)
+        self.assertEqual(self.app.get(self.url + '?ids=0,1&gridref=NY215072&gridref=NY369112').status_code, 404)
+        self.assertEqual(self.app.get(self.url + '?ids=0,1&ascent_weight=steep').status_code, 404)
+        for number in ('inf', 'nan'):
+            self.assertEqual(self.app.get(self.url + '?ids=0,1&ascent_weight=' + number).status_code, 404)
+            self.assertEqual(self.app.get(self.url + '?ids=0,1&time_budget=' + number).status_code, 404)
+
+
+class RegionTest(Framework):
+    """unittest for the bbox, square and radius_km arguments of the fells endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = "/fells/"
+        self.all = self.convert_request_to_df(self.app.get(self.url))
+
+    def test_bbox_returns_fells_inside(self):
+        """checks a bounding box returns exactly the fells inside it, in height rank order"""
+        df = self.convert_request_to_df(self.app.get(self.url + '?bbox=-3.25,54.43,-3.1,54.5'))
+        inside = self.all[self.all['Longitude'].between(-3.25, -3.1) & self.all['Latitude'].between(54.43, 54.5)]
+        self.assertEqual(df['Name'].tolist(), inside['Name'].tolist())
+
+    def test_square_returns_fells_in_grid_square(self):
+        """checks a 10km grid square returns the fells whose grid references fall in it, and several squares their union"""
+        df = self.convert_request_to_df(self.app.get(self.url + '?square=NY21'))
+        self.assertGreater(len(df), 0)
+        for grid_reference in df['OS Grid Reference']:
+            digits = grid_reference[2:]
+            self.assertEqual((grid_reference[:2], digits[0], digits[len(digits) // 2]), ('NY', '2', '1'))
+        both = self.convert_request_to_df(self.app.get(self.url + '?square=NY21&square=ny20'))
+        self.assertEqual(len(both), len(df) + len(self.convert_request_to_df(self.app.get(self.url + '?square=NY20'))))
+
+    def test_square_combined_with_height(self):
+        """checks a grid square can be combined with the other filters"""
+        df = self.convert_request_to_df(self.app.get(self.url + '?square=NY&above=800'))
+        self.assertTrue((df['Height (m)'] > 800).all())
+        self.assertTrue(df['OS Grid Reference'].str.startswith('NY').all())
+
+    def test_radius_km_is_within_km(self):
+        """checks radius_km returns the same fells as within_km"""
+        radius = self.app.get(self.url + f'?gridref={self.grid_reference}&radius_km=3').get_json()
+        within = self.app.get(self.url + f'?gridref={self.grid_reference}&within_km=3').get_json()
+        self.assertEqual(radius, within)
+
+    def test_404_if_region_not_valid(self):
+        """returns 404 if the bounding box, grid square, radius or location cannot be read"""
+        for query in ['bbox=1,2,3', 'bbox=a,b,c,d', 'bbox=-3,54.5,-3.1,54.6', 'square=NY2', 'square=NI', 'bbox=nan,nan,nan,nan',
+                      'bbox=-inf,0,0,0', 'gridref=NY215072&radius_km=inf', 'gridref=NY215072&within_km=nan', 'longitude=nan&latitude=54.5']:
+            self.assertEqual(self.app.get(self.url + '?' + query).status_code, 404)
+
+
+class PayloadTest(Framework):
+    """unittest for the fields, pagination, encoding and compression of the fells endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = "/fells/"
+
+    def test_fields_projection(self):
+        """checks only the fields asked for are returned"""
+        r = self.app.get(self.url + '?fields=Name,Height (m)&fields=Nearest&gridref=NY215072&limit=2')
+        self.assertEqual([list(record) for record in r.get_json()], [['Name', 'Height (m)', 'Nearest']] * 2)
+        self.assertEqual(self.app.get(self.url + '?fields=Height').status_code, 404)
+        self.assertEqual(self.app.get(self.url + '?fields=Nearest&limit=2').status_code, 404)
+
+    def test_limit_and_offset_pages(self):
+        """checks limit and offset return consecutive pages of the same ordering, also when nearest first"""
+        for query in ['', f'gridref={self.grid_reference}&']:
+            everything = self.app.get(self.url + '?' + query).get_json()
+            pages = [self.app.get(self.url + f'?{query}limit=50&offset={offset}').get_json() for offset in range(0, 250, 50)]
+            self.assertEqual(sum(pages, []), everything)
+
+    def test_cursor_pages(self):
+        """checks following the next cursor visits every fell once, the last page having no cursor"""
+        names, url, pages = [], self.url + '?limit=100', 0
+        while url:
+            r = self.app.get(url)
+            names += [fell['Name'] for fell in r.get_json()]
+            pages += 1
+            url = r.headers['Link'][1:r.headers['Link'].index('>')] if 'Link' in r.headers else None
+        self.assertEqual(pages, 3)
+        self.assertEqual(names, [fell['Name'] for fell in self.app.get(self.url).get_json()])
+
+    def test_no_next_page_of_limit_zero(self):
+        """checks an empty page of limit=0 has no cursor to a next page, which would be the same page"""
+        r = self.app.get(self.url + '?limit=0&offset=10')
+        self.assertEqual(r.get_json(), [])
+        self.assertNotIn('X-Next-Cursor', r.headers)
+        self.assertNotIn('Link', r.headers)
+
+    def test_404_if_cursor_not_valid(self):
+        """returns 404 for a cursor that cannot be read and 410 for one from another version of the dataset"""
+        self.assertEqual(self.app.get(self.url + '?cursor=not-a-cursor').status_code, 404)
+        self.assertEqual(self.app.get(self.url + '?cursor=eyJvZmZzZXQiOiAzLCAidmVyc2lvbiI6ICJvbGQifQ').status_code, 410)
+
+    def test_encoding_chosen_by_accept(self):
+        """checks csv and GeoJSON are returned when accepted, and json otherwise"""
+        r = self.app.get(self.url + '?limit=2', headers={'Accept': 'text/csv'})
+        self.assertTrue(r.headers['Content-Type'].startswith('text/csv'))
+        self.assertEqual(len(r.data.decode('utf-8').splitlines()), 3)
+        r = self.app.get(self.url + '?limit=2', headers={'Accept': 'application/geo+json'})
+        self.assertEqual(len(r.get_json(force=True)['features']), 2)
+        r = self.app.get(self.url + '?limit=2', headers={'Accept': 'text/html,*/*;q=0.8'})
+        self.assertEqual(r.headers['Content-Type'], 'application/json')
+
+    def test_gzip_when_accepted(self):
+        """checks large responses are gzip compressed when accepted and small ones are not"""
+        r = self.app.get(self.url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(r.data)), self.app.get(self.url).get_json())
+        r = self.app.get(self.url + '?limit=1', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', r.headers)
+
+    def test_large_responses_streamed(self):
+        """checks responses over FELLS_STREAM_ROWS are streamed with the same content"""
+        expected = self.app.get(self.url).get_json()
+        app.config['FELLS_STREAM_ROWS'] = 10
+        try:
+            r = self.app.get(self.url + '?fields=Name', headers={'Accept-Encoding': 'gzip'})
+            self.assertTrue(r.is_streamed)
+            self.assertEqual(json.loads(gzip.decompress(r.data)), [{'Name': fell['Name']} for fell in expected])
+        finally:
+            app.config['FELLS_STREAM_ROWS'] = 1000
+
+
+class ConditionalTest(Framework):
+    """unittest for the ETag, Last-Modified and Cache-Control headers"""
+
+    def test_fell_304_if_none_match(self):
+        """checks a fell is not sent again when the client has its ETag"""
+        r = self.app.get('/fell/' + self.id)
+        self.assertEqual(r.headers['Cache-Control'], 'public, max-age=300, stale-while-revalidate=86400')
+        r = self.app.get('/fell/' + self.id, headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.data, b'')
+        self.assertEqual(self.app.get('/fell/' + self.id, headers={'If-None-Match': '"other"'}).status_code, 200)
+
+    def test_fell_304_if_not_modified_since(self):
+        """checks a fell is not sent again when the dataset has not changed since the client's copy"""
+        r = self.app.get('/fell/' + self.id)
+        self.assertEqual(self.app.get('/fell/' + self.id, headers={'If-Modified-Since': r.headers['Last-Modified']}).status_code, 304)
+        self.assertEqual(self.app.get('/fell/' + self.id, headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}).status_code, 200)
+
+    def test_fells_etag_of_normalised_query(self):
+        """checks equivalent queries share an ETag and a different query or encoding does not"""
+        etag = self.app.get('/fells/?name=pike&name=scafell').headers['ETag']
+        self.assertEqual(self.app.get('/fells/?name=Scafell&name=Pike').headers['ETag'], etag)
+        self.assertNotEqual(self.app.get('/fells/?name=pike').headers['ETag'], etag)
+        self.assertNotEqual(self.app.get('/fells/?name=pike&name=scafell', headers={'Accept': 'text/csv'}).headers['ETag'], etag)
+
+    def test_fells_304_before_query_runs(self):
+        """checks a client with the current result gets 304 without the query being run"""
+        url = '/fells/?gridref=NY215072&limit=3'
+        etag = self.app.get(url).headers['ETag']
+        query_cache.invalidate()
+        misses = query_cache.stats()['misses']
+        r = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(query_cache.stats()['misses'], misses)
+
+    def test_neighbours_and_distances_conditional(self):
+        """checks the neighbours and distances endpoints also answer 304"""
+        for url in [f'/fell/{self.id}/neighbours?limit=3', '/distances?ids=1,2']:
+            etag = self.app.get(url).headers['ETag']
+            self.assertEqual(self.app.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_cache_control_configurable_per_endpoint(self):
+        """checks CACHE_CONTROL overrides the policy of an endpoint"""
+        app.config['CACHE_CONTROL'] = {'fells': 'no-cache'}
+        try:
+            self.assertEqual(self.app.get('/fells/?limit=1').headers['Cache-Control'], 'no-cache')
+            self.assertIn('max-age', self.app.get('/fell/0').headers['Cache-Control'])
+        finally:
+            app.config['CACHE_CONTROL'] = {}
+
+
+class InstrumentationTest(Framework):
+    """unittest for the Server-Timing header and the /metrics endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        app.config['INSTRUMENTATION'] = True
+        metrics.reset()
+
+    def tearDown(self):
+        app.config['INSTRUMENTATION'] = False
+        super().tearDown()
+
+    def test_server_timing_of_stages(self):
+        """checks a fells query reports the time spent in each of its stages, ending with the total"""
+        query_cache.invalidate()
+        r = self.app.get('/fells/?name=pike&gridref=NY215072&limit=3')
+        stages = [timing.split(';')[0] for timing in r.headers['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['parse', 'cache', 'name', 'filter', 'gridref', 'distance', 'encode', 'total'])
+        r = self.app.get('/fell/' + self.id)
+        self.assertTrue(r.headers['Server-Timing'].startswith('validate;dur='))
+
+    def test_no_server_timing_when_off(self):
+        """checks nothing is timed unless INSTRUMENTATION is on"""
+        app.config['INSTRUMENTATION'] = False
+        self.assertNotIn('Server-Timing', self.app.get('/fell/' + self.id).headers)
+        self.assertNotIn('wainwrights_request_duration_seconds', self.app.get('/metrics').get_data(as_text=True))
+
+    def test_metrics_in_prometheus_format(self):
+        """checks /metrics has the timing histograms, cache counters and dataset gauges"""
+        self.app.get('/fell/' + self.id)
+        self.app.get('/fells/?limit=1')
+        r = self.app.get('/metrics')
+        self.assertTrue(r.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = r.get_data(as_text=True)
+        worker = f'worker="{os.getpid()}"'
+        self.assertIn('wainwrights_request_duration_seconds_count{endpoint="fell",' + worker + '} 1', text)
+        self.assertIn('wainwrights_stage_duration_seconds_bucket{endpoint="fells",stage="parse",' + worker + ',le="+Inf"} 1', text)
+        self.assertIn('# TYPE wainwrights_query_cache_hits_total counter', text)
+        self.assertIn('wainwrights_dataset_fells{' + worker + '} 214', text)
+        self.assertIn('wainwrights_dataset_info{version="', text)
+
+
+class ListsTest(Framework):
+    """unittest for the hill lists served under /lists/<list>/"""
+
+    def setUp(self):
+        super().setUp()
+        catalogue.add('outlying-fells-test', 'tests/fixtures/outlying_fells.csv')
+        catalogue.add('blank-height-test', 'tests/fixtures/blank_height.csv')
+
+    def tearDown(self):
+        catalogue.lists.pop('outlying-fells-test', None)
+        catalogue.lists.pop('blank-height-test', None)
+        super().tearDown()
+
+    def test_lists_in_catalogue(self):
+        """checks the catalogue lists the wainwrights and any other lists whose csv exists"""
+        names = [item['name'] for item in json.loads(self.app.get('/lists').data)]
+        self.assertEqual(names[0], 'wainwrights')
+        self.assertIn('outlying-fells-test', names)
+
+    def test_list_fells_and_fell(self):
+        """checks a list's fells are served from its own store, by position in height rank order"""
+        fells = json.loads(self.app.get('/lists/outlying-fells-test/fells').data)
+        self.assertEqual([fell['Name'] for fell in fells], ['Black Combe', "Lord's Seat (Crook)", 'Hampsfell'])
+        fell = json.loads(self.app.get('/lists/outlying-fells-test/fell/2').data)
+        self.assertEqual((fell['Name'], fell['Height Rank']), ('Hampsfell', 3))
+        self.assertEqual(self.app.get('/lists/outlying-fells-test/fell/3').status_code, 404)
+        self.assertEqual(self.app.get('/lists/outlying-fells-test/fell/name/black-combe').status_code, 200)
+
+    def test_wainwrights_list_same_as_unprefixed(self):
+        """checks /lists/wainwrights/ serves the same fells as the unprefixed endpoints"""
+        self.assertEqual(self.app.get('/lists/wainwrights/fell/' + self.id).data, self.app.get('/fell/' + self.id).data)
+        self.assertEqual(self.app.get('/lists/wainwrights/fells?above=900').data, self.app.get('/fells/?above=900').data)
+
+    def test_decimal_heights_kept(self):
+        """checks heights with decimals are served and compared as they are, while whole ones stay whole numbers"""
+        catalogue.add('decimal-height-test', 'tests/fixtures/decimal_height.csv')
+        self.addCleanup(catalogue.lists.pop, 'decimal-height-test', None)
+        fells = json.loads(self.app.get('/lists/decimal-height-test/fells?fields=Name,Height (m)').data)
+        self.assertEqual([fell['Height (m)'] for fell in fells], [701.2, 515.3, 388.4])
+        fells = json.loads(self.app.get('/lists/decimal-height-test/fells?above=515.2&below=515.4&fields=Name').data)
+        self.assertEqual(fells, [{'Name': 'Seat Robert'}])
+        self.assertIsInstance(json.loads(self.app.get('/fell/' + self.id).data)['Height (m)'], int)
+
+    def test_unknown_list_404(self):
+        """checks a list that is not in the catalogue is not found"""
+        r = self.app.get('/lists/birketts/fells')
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(json.loads(r.data)['message'], 'List is not valid')
+
+    def test_list_that_cannot_load(self):
+        """checks a list with a bad csv is 503 when asked for, and left out of queries across every list"""
+        r = self.app.get('/lists/blank-height-test/fells')
+        self.assertEqual(r.status_code, 503)
+        self.assertIn('Height (m) is blank on line 3', json.loads(r.data)['message'])
+        self.assertEqual(self.app.get('/lists/fells?lists=blank-height-test,wainwrights').status_code, 503)
+        r = self.app.get('/lists/fells?below=700&fields=Name')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual({fell['List'] for fell in json.loads(r.data)}, {'wainwrights', 'outlying-fells-test'})
+
+    def test_fells_across_lists(self):
+        """checks a query of several lists merges their fells nearest first, with the list of each"""
+        fells = json.loads(self.app.get('/lists/fells?lists=wainwrights,outlying-fells-test&gridref=SD135854&limit=3&fields=Name,Nearest').data)
+        self.assertEqual(fells[0], {'Name': 'Black Combe', 'Nearest': 0.0, 'List': 'outlying-fells-test'})
+        self.assertEqual([fell['List'] for fell in fells[1:]], ['wainwrights', 'wainwrights'])
+        self.assertTrue(fells[1]['Nearest'] <= fells[2]['Nearest'])
+        fells = json.loads(self.app.get('/lists/fells?lists=outlying-fells-test,wainwrights&below=700&limit=2&offset=1').data)
+        self.assertEqual(len(fells), 2)
+        self.assertTrue(fells[0]['Height (m)'] >= fells[1]['Height (m)'])
+
+
+class HealthTest(Framework):
+    """unittest for the liveness and readiness endpoints"""
+
+    def test_live(self):
+        """checks the liveness endpoint always answers"""
+        self.assertEqual(self.app.get('/health/live').status_code, 200)
+
+    def test_ready_once_loaded_until_draining(self):
+        """checks readiness is reported with the dataset loaded, and not while shutting down"""
+        self.app.get('/fell/' + self.id)
+        r = self.app.get('/health/ready')
+        self.assertEqual((r.status_code, json.loads(r.data)['status']), (200, 'ready'))
+        draining.set()
+        try:
+            r = self.app.get('/health/ready')
+            self.assertEqual((r.status_code, json.loads(r.data)['status']), (503, 'draining'))
+        finally:
+            draining.clear()
+
+    def test_not_ready_without_dataset(self):
+        """checks readiness is refused, and liveness and the version header never load a dataset, until one loads"""
+        with tempfile.TemporaryDirectory() as directory:
+            unloaded = DatasetManager(os.path.join(directory, 'missing.csv'), directory)
+            with mock.patch('src.api.datasets', unloaded):
+                r = self.app.get('/health/live')
+                self.assertEqual(r.status_code, 200)
+                self.assertNotIn('X-Dataset-Version', r.headers)
+                r = self.app.get('/health/ready')
+                self.assertEqual((r.status_code, json.loads(r.data)['status']), (503, 'loading'))
+                self.assertFalse(unloaded.loaded)
+
+    def test_not_ready_after_failed_load(self):
+        """checks readiness is still refused once loading the dataset has failed"""
+        with tempfile.TemporaryDirectory() as directory:
+            unloaded = DatasetManager(os.path.join(directory, 'missing.csv'), directory)
+            with mock.patch('src.api.datasets', unloaded):
+                with self.assertRaises(OSError):
+                    unloaded.current()
+                self.assertEqual(self.app.get('/health/live').status_code, 200)
+                r = self.app.get('/health/ready')
+                self.assertEqual((r.status_code, json.loads(r.data)['status']), (503, 'loading'))
+
+
+class TrackTest(Framework):
+    """unittest for the live tracking sessions and their event streams"""
+
+    def open_session(self, query: str = '?limit=3&gridref=NY215072') -> str:
+        r = self.app.post('/track' + query)
+        self.assertEqual(r.status_code, 201)
+        return json.loads(r.data)['id']
+
+    def test_stream_of_changes(self):
+        """checks the stream sends the nearest fells, then only changes, until the session is closed"""
+        id = self.open_session()
+        r = self.app.get(f'/track/{id}/events', buffered=False)
+        self.assertEqual(r.mimetype, 'text/event-stream')
+        stream = iter(r.response)
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+        event = next(stream).decode('utf-8').split('\n')
+        self.assertEqual(event[:2], ['id: 1', 'event: nearest'])
+        data = json.loads(event[2][len('data: '):])
+        self.assertEqual(data['added'][0]['Name'], 'Scafell Pike')
+        self.assertEqual(data['nearest'][0], [data['added'][0]['id'], 0.0])
+        self.assertEqual(self.app.post(f'/track/{id}/position?gridref=NY342151').status_code, 202)
+        event = next(stream).decode('utf-8').split('\n')
+        self.assertEqual(event[0], 'id: 2')
+        self.assertIn('Helvellyn', [fell['Name'] for fell in json.loads(event[2][len('data: '):])['added']])
+        self.assertEqual(self.app.delete(f'/track/{id}').status_code, 204)
+        self.assertEqual(next(stream), b'event: closed\ndata: {}\n\n')
+        r.close()
+
+    def test_unknown_session_404(self):
+        """checks closed or made up sessions are not found"""
+        id = self.open_session()
+        self.app.delete(f'/track/{id}')
+        self.assertEqual(self.app.post(f'/track/{id}/position?gridref=NY342151').status_code, 404)
+        self.assertEqual(self.app.get('/track/unknown/events').status_code, 404)
+        self.assertEqual(self.app.delete('/track/unknown').status_code, 404)
+
+    def test_invalid_positions(self):
+        """checks a position must be a single valid location"""
+        id = self.open_session('')
+        self.assertEqual(self.app.post(f'/track/{id}/position').status_code, 404)
+        self.assertEqual(self.app.post('/track?limit=inf').status_code, 404)
+        self.assertEqual(self.app.post(f'/track/{id}/position?gridref=NY215072&gridref=NY342151').status_code, 404)
+        self.assertEqual(self.app.post(f'/track/{id}/position?gridref=XX').status_code, 404)
+        self.assertEqual(self.app.post('/track?limit=1000').status_code, 413)
+        self.app.delete(f'/track/{id}')
+
+    def test_streams_limited(self):
+        """checks streams beyond TRACK_MAX_STREAMS are refused until one closes"""
+        app.config['TRACK_MAX_STREAMS'] = 1
+        try:
+            first, second = self.open_session(), self.open_session()
+            r = self.app.get(f'/track/{first}/events', buffered=False)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(self.app.get(f'/track/{second}/events').status_code, 503)
+            r.close()
+            r = self.app.get(f'/track/{second}/events', buffered=False)
+            self.assertEqual(r.status_code, 200)
+            r.close()
+        finally:
+            app.config['TRACK_MAX_STREAMS'] = None
+            for id in (first, second):
+                self.app.delete(f'/track/{id}')
+
+    def test_list_session(self):
+        """checks a session opened under a list tracks that list's fells from the usual urls"""
+        catalogue.add('outlying-fells-test', 'tests/fixtures/outlying_fells.csv')
+        try:
+            r = self.app.post('/lists/outlying-fells-test/track?limit=1&gridref=SD135854')
+            self.assertEqual(r.status_code, 201)
+            body = json.loads(r.data)
+            self.assertTrue(body['events'].endswith(f"/track/{body['id']}/events"))
+            r = self.app.get(body['events'], buffered=False)
+            stream = iter(r.response)
+            next(stream)
+            event = json.loads(next(stream).decode('utf-8').split('\n')[2][len('data: '):])
+            self.assertEqual(event['added'][0]['Name'], 'Black Combe')
+            r.close()
+            self.app.delete(f"/track/{body['id']}")
+        finally:
+            catalogue.lists.pop('outlying-fells-test', None)
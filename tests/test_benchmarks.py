@@ -0,0 +1,71 @@
+import numpy as np
+
+from benchmarks.datasets import LATITUDES, LONGITUDES, synthetic_fells
+from benchmarks.suite import compare, measure, run_suite, serving
+from src import api
+from src.grid import parse_grid_references
+
+from .framework import Framework
+
+
+class TestSyntheticFells(Framework):
+    """unittest for the synthetic datasets the benchmarks run on"""
+
+    def test_fells_within_lake_district(self):
+        """checks synthetic fells are placed within the bounds, in height rank order, with valid grid references"""
+        store = synthetic_fells(500)
+        self.assertEqual(len(store), 500)
+        self.assertTrue(((store.longitudes >= LONGITUDES[0]) & (store.longitudes <= LONGITUDES[1])).all())
+        self.assertTrue(((store.latitudes >= LATITUDES[0]) & (store.latitudes <= LATITUDES[1])).all())
+        self.assertTrue((np.diff(store.height_m) <= 0).all())
+        self.assertEqual(store.height_rank.tolist(), list(range(1, 501)))
+        self.assertEqual(len(parse_grid_references(store.grid_references.tolist())[0]), 500)
+
+    def test_same_seed_same_fells(self):
+        """checks a seed always generates the same dataset"""
+        self.assertEqual(synthetic_fells(100, seed=3).version, synthetic_fells(100, seed=3).version)
+        self.assertNotEqual(synthetic_fells(100, seed=3).version, synthetic_fells(100, seed=4).version)
+
+
+class TestBenchmarkSuite(Framework):
+    """unittest for measuring, running and comparing the benchmarks"""
+
+    def test_measure_reports_latency_and_memory(self):
+        """checks measure reports percentiles, throughput and peak memory"""
+        result = measure(lambda: np.ones(100000), budget=0.01)
+        self.assertGreaterEqual(result['runs'], 5)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertGreater(result['ops_per_s'], 0)
+        self.assertGreater(result['peak_kib'], 700)
+
+    def test_run_suite_on_synthetic_dataset(self):
+        """checks the endpoint benchmarks run against a synthetic dataset and the api is restored afterwards"""
+        datasets = api.datasets
+        results = run_suite(['1000'], only='endpoint.fells_*', budget=0.01, log=lambda line: None)
+        self.assertEqual(sorted(results['results']), ['1000/endpoint.fells_bbox', '1000/endpoint.fells_height',
+                                                      '1000/endpoint.fells_name', '1000/endpoint.fells_nearest'])
+        self.assertEqual(results['results']['1000/endpoint.fells_height']['fells'], 1000)
+        self.assertIs(api.datasets, datasets)
+        self.assertGreater(api.query_cache.max_entries, 0)
+
+    def test_serving_answers_from_store(self):
+        """checks requests are answered from the store being benchmarked"""
+        with serving(synthetic_fells(50)) as client:
+            self.assertEqual(len(client.get('/fells/').get_json()), 50)
+
+    def test_serving_answers_without_a_store(self):
+        """checks requests that need no dataset, e.g. health checks and metrics, are answered while serving a store"""
+        with serving(synthetic_fells(50)) as client:
+            self.assertEqual(client.get('/health/live').status_code, 200)
+            self.assertEqual(client.get('/health/ready').status_code, 200)
+            self.assertEqual(client.get('/metrics').status_code, 200)
+
+    def test_compare_finds_regressions(self):
+        """checks only changes beyond the threshold and the noise floor count as regressions"""
+        baseline = {'results': {'a': {'p50_ms': 10.0, 'peak_kib': 1000.0}, 'b': {'p50_ms': 0.01, 'peak_kib': 1.0}}}
+        results = {'results': {'a': {'p50_ms': 13.0, 'peak_kib': 1100.0}, 'b': {'p50_ms': 0.03, 'peak_kib': 2.0},
+                               'c': {'p50_ms': 100.0, 'peak_kib': 1.0}}}
+        regressions = compare(results, baseline, threshold=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('a p50_ms'))
+        self.assertEqual(compare(results, baseline, threshold=0.5), [])
@@ -0,0 +1,95 @@
+from src.api import query_cache
+from src.cache import QueryCache
+
+from .framework import Framework
+
+
+class TestQueryCache(Framework):
+    """unittest for the bounded query cache"""
+
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+        self.cache = QueryCache(max_entries=3, max_bytes=10, ttl=60, clock=lambda: self.now)
+
+    def test_hits_and_misses_counted(self):
+        """checks lookups are counted as hits or misses"""
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', b'1')
+        self.assertEqual(self.cache.get('a'), b'1')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_least_recently_used_evicted(self):
+        """checks the least recently used entry is evicted once max_entries is exceeded"""
+        for key in 'abc':
+            self.cache.set(key, b'1')
+        self.cache.get('a')
+        self.cache.set('d', b'1')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), b'1')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_size_in_bytes_bounded(self):
+        """checks entries are evicted to keep within max_bytes and oversized values are not stored"""
+        self.cache.set('a', b'123456')
+        self.cache.set('b', b'123456')
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.stats()['bytes'], 6)
+        self.cache.set('c', b'12345678901')
+        self.assertIsNone(self.cache.get('c'))
+
+    def test_values_counted_by_given_size(self):
+        """checks values that are not bytes are counted as the size given"""
+        self.cache.set('a', (b'123456', 'gzip'), 6)
+        self.assertEqual(self.cache.get('a'), (b'123456', 'gzip'))
+        self.assertEqual(self.cache.stats()['bytes'], 6)
+
+    def test_entries_expire(self):
+        """checks entries older than the ttl are not returned"""
+        self.cache.set('a', b'1')
+        self.now = 61
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_invalidate_drops_everything(self):
+        """checks invalidate empties the cache"""
+        self.cache.set('a', b'1')
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['bytes'], 0)
+
+
+class TestFellsQueryCache(Framework):
+    """unittest for the caching of fells/ responses"""
+
+    def setUp(self):
+        super().setUp()
+        query_cache.invalidate()
+
+    def test_equivalent_queries_share_cache_entry(self):
+        """checks parameter order, case and repeated names map to the same cached result"""
+        first = self.app.get('/fells/?name=Scafell&name=skiddaw&above=500')
+        hits = query_cache.stats()['hits']
+        second = self.app.get('/fells/?above=500.0&name=SKIDDAW&name=scafell&name=scafell')
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertEqual(query_cache.stats()['hits'], hits + 1)
+        self.assertEqual(len(query_cache), 1)
+
+    def test_coordinates_rounded_for_cache_key(self):
+        """checks locations that differ beyond the configured precision share a cached result"""
+        self.app.get(self.url_for_location('-3.14850691', '54.65065093'))
+        hits = query_cache.stats()['hits']
+        self.app.get(self.url_for_location('-3.14850692', '54.65065094'))
+        self.assertEqual(query_cache.stats()['hits'], hits + 1)
+
+    def test_cache_stats_endpoint(self):
+        """checks the cache counters are served as json"""
+        r = self.app.get('/stats/cache')
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('evictions', r.get_json())
+
+    def url_for_location(self, longitude: str, latitude: str) -> str:
+        """generates a fells url searching from longitude and latitude"""
+        return '/fells/' + self.generate_query(longitude=longitude, latitude=latitude)
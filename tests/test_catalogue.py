@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+
+from src.catalogue import Catalogue
+
+from .framework import Framework
+
+
+class TestCatalogue(Framework):
+    """unittest for the catalogue of hill lists"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.lists_dir = os.path.join(self.directory, 'lists')
+        os.makedirs(self.lists_dir)
+        shutil.copy('tests/fixtures/outlying_fells.csv', os.path.join(self.lists_dir, 'Outlying Fells.csv'))
+        shutil.copy('wainwrights.csv', os.path.join(self.lists_dir, 'wainwrights.csv'))
+        self.catalogue = Catalogue(self.lists_dir, os.path.join(self.directory, 'snapshot'), check_interval=None, max_loaded=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lists_found_in_directory(self):
+        """checks each csv in the lists folder is a list named by its slug, and missing files are not"""
+        self.catalogue.add('missing', os.path.join(self.directory, 'missing.csv'))
+        self.assertEqual(self.catalogue.names(), ['outlying-fells', 'wainwrights'])
+        self.assertIsNone(self.catalogue.current('missing'))
+        self.assertIsNone(self.catalogue.current('birketts'))
+
+    def test_lists_loaded_lazily(self):
+        """checks a list is only loaded when first used"""
+        self.catalogue.scan()
+        self.assertFalse(any(manager.loaded for manager in self.catalogue.lists.values()))
+        self.assertEqual(len(self.catalogue.current('outlying-fells')), 3)
+        self.assertTrue(self.catalogue.lists['outlying-fells'].loaded)
+        self.assertFalse(self.catalogue.lists['wainwrights'].loaded)
+
+    def test_least_recently_used_unloaded(self):
+        """checks lists beyond max_loaded are unloaded, unless pinned, and load again when used"""
+        store = self.catalogue.current('outlying-fells')
+        self.catalogue.current('wainwrights')
+        self.assertFalse(self.catalogue.lists['outlying-fells'].loaded)
+        self.assertEqual(self.catalogue.current('outlying-fells').version, store.version)
+        self.assertFalse(self.catalogue.lists['wainwrights'].loaded)
+        self.catalogue.pinned.add('wainwrights')
+        self.catalogue.current('wainwrights')
+        self.catalogue.current('outlying-fells')
+        self.assertTrue(self.catalogue.lists['wainwrights'].loaded)
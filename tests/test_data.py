@@ -1,7 +1,8 @@
+import numpy as np
 import pandas as pd
 from OSGridConverter.base import OSGridError
 
-from src.data import Calculator
+from src.data import Calculator, Coordinates
 
 from .framework import Framework
 
@@ -60,4 +61,29 @@ class TestCalculator(Framework):
         nearest_fell = df.iloc[0]['Name']
         self.assertEqual(nearest_fell, 'Skiddaw')
 
-        
\ No newline at end of file
+        
+
+    def test_vectorized_distances_match_calculate_distance(self):
+        """checks the vectorized distances agree with calculate_distance for every fell"""
+        lon1 = float(self.longitude)
+        lat1 = float(self.latitude)
+        distances = Calculator.calculate_distances(self.df['Longitude'], self.df['Latitude'], lon1, lat1)
+        expected = [Calculator.calculate_distance(lon, lat, lon1, lat1) for lon, lat in zip(self.df['Longitude'], self.df['Latitude'])]
+        np.testing.assert_allclose(distances, expected, rtol=1e-9, atol=1e-9)
+
+    def test_nearest_fells_calculated_with_precomputed_coordinates(self):
+        """checks precomputed coordinates give the same ordering on a filtered slice of the dataframe"""
+        coordinates = Coordinates(self.df['Longitude'], self.df['Latitude'])
+        subset = self.df[self.df['Height (m)'] > 800].copy()
+        df = Calculator.calculate_nearest_fells(subset, float(self.longitude), float(self.latitude), coordinates)
+        self.assertEqual(df.iloc[0]['Name'], 'Skiddaw')
+        self.assertEqual(len(df), len(subset))
+
+    def test_distance_matrix_rows_match_distances(self):
+        """checks each row of the distance matrix is the distance from that location to every fell"""
+        coordinates = Coordinates(self.df['Longitude'], self.df['Latitude'])
+        longitudes, latitudes = self.df['Longitude'][:5].to_numpy(), self.df['Latitude'][:5].to_numpy()
+        matrix = coordinates.distance_matrix(longitudes, latitudes)
+        self.assertEqual(matrix.shape, (5, len(self.df)))
+        for row, longitude, latitude in zip(matrix, longitudes, latitudes):
+            self.assertTrue(np.array_equal(row, coordinates.distances(longitude, latitude)))
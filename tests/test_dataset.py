@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+from threading import Thread
+
+from src.api import app, datasets, query_cache
+from src import dataset
+from src.dataset import DatasetManager
+
+from .framework import Framework
+
+
+EXTRA_FELL = 'Extra Fell,215,100,328,10,NY215072,-3.2,54.4\n'
+
+
+class TestDatasetManager(Framework):
+    """unittest for loading and hot reloading the dataset"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.csv = os.path.join(self.directory, 'wainwrights.csv')
+        shutil.copy('wainwrights.csv', self.csv)
+        self.manager = DatasetManager(self.csv, os.path.join(self.directory, 'snapshot'), check_interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add_fell(self):
+        """appends a fell to the csv, making sure its modification time changes"""
+        stat = os.stat(self.csv)
+        with open(self.csv, 'a', encoding='utf-8') as f:
+            f.write(EXTRA_FELL)
+        os.utime(self.csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_loaded_on_first_use(self):
+        """checks nothing is loaded until the store is first asked for"""
+        self.assertIsNone(self.manager.loaded_at)
+        self.assertEqual(len(self.manager.current()), 214)
+
+    def test_reload_swaps_version(self):
+        """checks a reload makes the new dataset current while old references keep the old one"""
+        old = self.manager.current()
+        self.add_fell()
+        new = self.manager.reload()
+        self.assertNotEqual(old.version, new.version)
+        self.assertIs(self.manager.current(), new)
+        self.assertEqual((len(old), len(new)), (214, 215))
+
+    def test_changed_file_reloaded_in_background(self):
+        """checks a change to the csv is picked up without an explicit reload"""
+        old = self.manager.current()
+        self.add_fell()
+        self.assertIs(self.manager.current(), old)
+        self.manager.wait(10)
+        self.assertEqual(len(self.manager.current()), 215)
+
+    def test_listeners_told_of_swap(self):
+        """checks listeners receive the previous and new stores"""
+        swaps = []
+        self.manager.listeners.append(lambda previous, store: swaps.append((previous, store)))
+        old = self.manager.current()
+        new = self.manager.reload()
+        self.assertEqual(swaps, [(old, new)])
+
+    def test_reloads_run_one_at_a_time(self):
+        """checks reloads started together load one after the other"""
+        loading = []
+        overlapped = []
+        load = dataset.load_fells
+        def tracked_load(*args):
+            overlapped.append(bool(loading))
+            loading.append(True)
+            try:
+                return load(*args)
+            finally:
+                loading.pop()
+        dataset.load_fells = tracked_load
+        try:
+            threads = [Thread(target=self.manager.reload) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            dataset.load_fells = load
+        self.assertEqual((overlapped, self.manager.reloads), ([False] * 3, 3))
+
+
+class TestReloadEndpoint(Framework):
+    """unittest for the dataset version header and the admin reload endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        app.config['ADMIN_TOKEN'] = 'secret'
+
+    def tearDown(self):
+        app.config['ADMIN_TOKEN'] = None
+
+    def test_responses_carry_dataset_version(self):
+        """checks every response has the version of the dataset that answered it"""
+        version = datasets.current().version
+        for url in ['/fell/0', '/fells/', '/fell/999']:
+            self.assertEqual(self.app.get(url).headers['X-Dataset-Version'], version)
+
+    def test_admin_reload(self):
+        """checks the admin endpoint reloads the dataset and empties the query cache"""
+        self.app.get('/fells/')
+        r = self.app.post('/admin/reload', headers={'X-Admin-Token': 'secret'})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_json()['version'], datasets.current().version)
+        self.assertEqual(len(query_cache), 0)
+
+    def test_admin_reload_requires_token(self):
+        """checks the token must be sent, and reloading is disabled when none is set"""
+        self.assertEqual(self.app.post('/admin/reload').status_code, 403)
+        self.assertEqual(self.app.post('/admin/reload', headers={'X-Admin-Token': 'wrong'}).status_code, 403)
+        app.config['ADMIN_TOKEN'] = None
+        self.assertEqual(self.app.post('/admin/reload').status_code, 403)
+        self.assertEqual(self.app.post('/admin/reload', headers={'X-Admin-Token': ''}).status_code, 403)
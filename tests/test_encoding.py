@@ -0,0 +1,61 @@
+import csv
+import gzip
+from io import BytesIO, StringIO
+import json
+
+import numpy as np
+
+from src.encoding import CHUNK_ROWS, compress, encode_csv, encode_geojson, encode_json, encode_npz
+from src.store import COLUMNS, FellStore
+
+from .framework import Framework
+
+
+class TestEncoding(Framework):
+    """unittest for the response encoders and compression"""
+
+    def setUp(self):
+        super().setUp()
+        self.store = FellStore.from_csv('wainwrights.csv')
+        self.view = self.store.view().sort_by_distance(float(self.longitude), float(self.latitude))
+
+    def test_json_matches_records(self):
+        """checks the chunked json is the same as dumping every record at once"""
+        self.assertGreater(len(self.view), CHUNK_ROWS // 2)
+        body = b''.join(encode_json(self.view))
+        self.assertEqual(body, json.dumps(self.view.records()).encode('utf-8'))
+        self.assertEqual(b''.join(encode_json(self.view.head(0))), b'[]')
+
+    def test_fields_projected_in_order(self):
+        """checks only the fields asked for are encoded, in the order asked"""
+        records = json.loads(b''.join(encode_json(self.view.head(2), ['Nearest', 'Name'])))
+        self.assertEqual([list(record) for record in records], [['Nearest', 'Name']] * 2)
+
+    def test_csv_has_header_and_rows(self):
+        """checks the csv has a header of the columns and a row per fell"""
+        rows = list(csv.reader(StringIO(b''.join(encode_csv(self.view)).decode('utf-8'))))
+        self.assertEqual(rows[0], COLUMNS + ['Nearest'])
+        self.assertEqual(len(rows), len(self.view) + 1)
+        self.assertEqual(rows[1][0], 'Skiddaw')
+        self.assertEqual(b''.join(encode_csv(self.view.head(0), ['Name'])), b'Name\n')
+
+    def test_geojson_points(self):
+        """checks each fell is a GeoJSON point at its longitude and latitude"""
+        collection = json.loads(b''.join(encode_geojson(self.view.head(3), ['Name'])))
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        feature = collection['features'][0]
+        self.assertEqual(feature['properties'], {'Name': 'Skiddaw'})
+        self.assertEqual(feature['geometry']['coordinates'], [self.store.longitudes[self.view.positions[0]], self.store.latitudes[self.view.positions[0]]])
+
+    def test_npz_columns_are_typed(self):
+        """checks the .npz archive holds a typed array per column"""
+        archive = np.load(BytesIO(b''.join(encode_npz(self.view, ['Name', 'Height (m)', 'Nearest']))))
+        self.assertEqual(archive['Name'][0], 'Skiddaw')
+        self.assertEqual(archive['Height (m)'].dtype, np.int32)
+        self.assertTrue(np.array_equal(archive['Nearest'], self.view.nearest))
+
+    def test_streaming_gzip_round_trip(self):
+        """checks compressing chunk by chunk gives a valid gzip stream of the whole body"""
+        chunks = list(encode_json(self.view))
+        self.assertEqual(gzip.decompress(b''.join(compress(iter(chunks), 'gzip'))), b''.join(chunks))
+        self.assertEqual(list(compress(iter(chunks), None)), chunks)
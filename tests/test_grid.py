@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from OSGridConverter import grid2latlong, latlong2grid
+from OSGridConverter.base import OSGridError
+
+from src.data import Calculator
+from src.grid import grid_square_bounds, parse_grid_references, grid_reference_to_longlat
+
+from .framework import Framework
+
+
+class TestBatchGridConversion(Framework):
+    """unittest for converting many grid references at once"""
+
+    def setUp(self):
+        super().setUp()
+        self.df = pd.read_csv('wainwrights.csv')
+        generator = np.random.default_rng(0)
+        self.longitudes = generator.uniform(-5.5, 1.5, 200)
+        self.latitudes = generator.uniform(50.5, 58.5, 200)
+
+    def test_grid_references_match_osgridconverter(self):
+        """checks batch grid reference -> longitude/latitude agrees with OSGridConverter for every fell"""
+        longitudes, latitudes = Calculator.get_longlats(self.df['OS Grid Reference'])
+        expected = [grid2latlong(grid_reference) for grid_reference in self.df['OS Grid Reference']]
+        np.testing.assert_allclose(longitudes, [point.longitude for point in expected], atol=1e-9)
+        np.testing.assert_allclose(latitudes, [point.latitude for point in expected], atol=1e-9)
+
+    def test_longlat_to_grid_matches_osgridconverter(self):
+        """checks batch longitude/latitude -> grid reference agrees with OSGridConverter across Great Britain"""
+        expected = [str(latlong2grid(latitude, longitude)) for longitude, latitude in zip(self.longitudes, self.latitudes)]
+        self.assertEqual(Calculator.convert_longlats_to_grid(self.longitudes, self.latitudes), expected)
+
+    def test_invalid_grid_references_raise(self):
+        """checks invalid grid references raise OSGridError"""
+        for grid_reference in ['2', 123, 'NY12345', 'II123456', 'ZZ123456']:
+            self.assertRaises(OSGridError, parse_grid_references, [grid_reference])
+
+    def test_spaced_and_short_grid_references(self):
+        """checks spaced and shorter grid references are parsed as OSGridConverter does"""
+        eastings, northings = parse_grid_references(['NY 21500 07200', 'NY215072', 'ny2107'])
+        self.assertEqual(eastings.tolist(), [321500, 321500, 321000])
+        self.assertEqual(northings.tolist(), [507200, 507200, 507000])
+
+    def test_single_conversions_memoised(self):
+        """checks repeated grid references are served from the memo cache"""
+        grid_reference_to_longlat.cache_clear()
+        Calculator.get_longlat(self.grid_reference)
+        Calculator.get_longlat(self.grid_reference)
+        self.assertEqual(grid_reference_to_longlat.cache_info().hits, 1)
+
+    def test_grid_square_bounds(self):
+        """checks 100km, 10km and 1km grid squares give their south west corner and size"""
+        self.assertEqual(grid_square_bounds('NY'), (300000, 500000, 100000))
+        self.assertEqual(grid_square_bounds('ny21'), (320000, 510000, 10000))
+        self.assertEqual(grid_square_bounds('NY 2107'), (321000, 507000, 1000))
+        for square in ['N', 'NY2', 'NI', '12', None]:
+            self.assertRaises(OSGridError, grid_square_bounds, square)
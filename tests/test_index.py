@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+from src.data import Calculator, Coordinates
+from src.index import GridIndex, NameIndex, NearbyDistances, PairwiseDistances, SortedIndex, SpatialIndex, edit_distance
+
+from .framework import Framework
+
+
+class TestSpatialIndex(Framework):
+    """unittest for the nearest and within searches of the spatial index"""
+
+    def setUp(self):
+        super().setUp()
+        self.df = pd.read_csv('wainwrights.csv')
+        self.index = SpatialIndex(self.df['Longitude'], self.df['Latitude'], leaf_size=8)
+        self.distances = Calculator.calculate_distances(self.df['Longitude'], self.df['Latitude'], float(self.longitude), float(self.latitude))
+
+    def test_nearest_matches_full_sort(self):
+        """checks the k nearest from the index match sorting every distance"""
+        positions, distances = self.index.nearest(float(self.longitude), float(self.latitude), 10)
+        expected = np.argsort(self.distances, kind='stable')[:10]
+        self.assertEqual(positions.tolist(), expected.tolist())
+        np.testing.assert_allclose(distances, self.distances[expected], atol=1e-6)
+        self.assertEqual(self.df.iloc[positions[0]]['Name'], 'Skiddaw')
+
+    def test_nearest_respects_mask(self):
+        """checks masked out fells are never returned as nearest"""
+        mask = (self.df['Height (m)'] < 700).to_numpy()
+        positions, _ = self.index.nearest(float(self.longitude), float(self.latitude), 5, mask)
+        self.assertEqual(len(positions), 5)
+        self.assertTrue(mask[positions].all())
+
+    def test_within_matches_brute_force(self):
+        """checks the radius query returns exactly the fells within the radius, closest first"""
+        positions, distances = self.index.within(float(self.longitude), float(self.latitude), 8)
+        expected = np.flatnonzero(self.distances <= 8)
+        self.assertEqual(sorted(positions.tolist()), sorted(expected.tolist()))
+        self.assertTrue(np.all(np.diff(distances) >= 0))
+
+    def test_empty_results(self):
+        """checks zero k or a negative radius return no fells"""
+        self.assertEqual(len(self.index.nearest(float(self.longitude), float(self.latitude), 0)[0]), 0)
+        self.assertEqual(len(self.index.within(float(self.longitude), float(self.latitude), -1)[0]), 0)
+
+    def test_large_synthetic_dataset(self):
+        """checks the index agrees with brute force on a larger random dataset"""
+        generator = np.random.default_rng(0)
+        longitudes = generator.uniform(-3.5, -2.6, 20000)
+        latitudes = generator.uniform(54.1, 54.8, 20000)
+        index = SpatialIndex(longitudes, latitudes)
+        distances = Calculator.calculate_distances(longitudes, latitudes, -3.0, 54.5)
+        positions, _ = index.nearest(-3.0, 54.5, 25)
+        self.assertEqual(positions.tolist(), np.argsort(distances, kind='stable')[:25].tolist())
+
+    def test_large_synthetic_dataset_with_mask(self):
+        """checks masked searches agree with brute force, whether the mask keeps few fells (measured directly) or many (searched in the tree)"""
+        generator = np.random.default_rng(1)
+        longitudes = generator.uniform(-3.5, -2.6, 20000)
+        latitudes = generator.uniform(54.1, 54.8, 20000)
+        index = SpatialIndex(longitudes, latitudes)
+        distances = Calculator.calculate_distances(longitudes, latitudes, -3.0, 54.5)
+        for share in (0.01, 0.5):
+            mask = generator.random(20000) < share
+            masked = np.flatnonzero(mask)
+            positions, _ = index.nearest(-3.0, 54.5, 25, mask)
+            self.assertEqual(positions.tolist(), masked[np.argsort(distances[masked], kind='stable')[:25]].tolist())
+            for radius in (5, 100):
+                positions, found = index.within(-3.0, 54.5, radius, mask)
+                self.assertEqual(sorted(positions.tolist()), masked[distances[masked] <= radius].tolist())
+                self.assertTrue(np.all(np.diff(found) >= 0))
+
+
+class TestPairwiseDistances(Framework):
+    """unittest for the fell to fell distance tables"""
+
+    def setUp(self):
+        super().setUp()
+        self.df = pd.read_csv('wainwrights.csv')
+        self.coordinates = Coordinates(self.df['Longitude'], self.df['Latitude'])
+        self.pairwise = PairwiseDistances.from_coordinates(self.coordinates, chunk_size=50)
+
+    def test_distances_match_calculate_distance(self):
+        """checks the float32 table agrees with calculate_distance to within a metre"""
+        self.assertEqual(self.pairwise.distances.dtype, np.float32)
+        self.assertEqual(self.pairwise.distances.shape, (len(self.df), len(self.df)))
+        for i, j in [(0, 1), (4, 200), (213, 7)]:
+            expected = Calculator.calculate_distance(self.df['Longitude'][i], self.df['Latitude'][i], self.df['Longitude'][j], self.df['Latitude'][j])
+            self.assertAlmostEqual(float(self.pairwise.distances[i, j]), expected, places=3)
+
+    def test_nearest_matches_full_sort(self):
+        """checks a fell's neighbours are the other fells in order of distance"""
+        positions, distances = self.pairwise.nearest(4, 10)
+        row = self.coordinates.distances(self.df['Longitude'][4], self.df['Latitude'][4])
+        row[4] = np.inf
+        self.assertEqual(positions.tolist(), np.argsort(row, kind='stable')[:10].tolist())
+        self.assertNotIn(4, self.pairwise.nearest(4)[0].tolist())
+        self.assertTrue((np.diff(distances) >= 0).all())
+
+    def test_between_is_symmetric(self):
+        """checks the distances between a set of fells form a symmetric matrix with a zero diagonal"""
+        matrix = self.pairwise.between(np.array([3, 0, 9]))
+        self.assertTrue(np.array_equal(matrix, matrix.T))
+        self.assertTrue((np.diag(matrix) == 0).all())
+
+    def test_nearby_distances_match_table(self):
+        """checks distances calculated when asked for agree with the table"""
+        nearby = NearbyDistances(self.coordinates, SpatialIndex(self.df['Longitude'], self.df['Latitude']))
+        for limit in (10, None):
+            positions, distances = nearby.nearest(4, limit)
+            expected_positions, expected_distances = self.pairwise.nearest(4, limit)
+            self.assertEqual(positions.tolist(), expected_positions.tolist())
+            self.assertTrue(np.allclose(distances, expected_distances, atol=1e-3))
+        positions = np.array([3, 0, 9])
+        self.assertTrue(np.allclose(nearby.between(positions), self.pairwise.between(positions), atol=1e-3))
+
+
+class TestGridIndex(Framework):
+    """unittest for the bucketed bounding box and grid square index"""
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        self.xs = rng.uniform(-3.5, -2.6, 500)
+        self.ys = rng.uniform(54.2, 54.8, 500)
+        self.index = GridIndex(self.xs, self.ys, 0.05)
+
+    def test_box_matches_full_scan(self):
+        """checks the points found from the buckets are exactly those inside the box"""
+        for box in [(-3.2, 54.4, -3.1, 54.5), (-3.5, 54.2, -2.6, 54.8), (-3.13, 54.41, -3.12, 54.42)]:
+            expected = np.flatnonzero((self.xs >= box[0]) & (self.xs <= box[2]) & (self.ys >= box[1]) & (self.ys <= box[3]))
+            self.assertEqual(self.index.box(*box).tolist(), expected.tolist())
+
+    def test_half_open_box_excludes_upper_edges(self):
+        """checks points on the upper edges are only included when the box is closed"""
+        index = GridIndex([0.0, 10.0, 5.0], [0.0, 5.0, 10.0], 5.0)
+        self.assertEqual(index.box(0, 0, 10, 10).tolist(), [0, 1, 2])
+        self.assertEqual(index.box(0, 0, 10, 10, closed=False).tolist(), [0])
+
+    def test_box_outside_points_is_empty(self):
+        """checks a box away from every point finds nothing"""
+        self.assertEqual(len(self.index.box(0, 0, 1, 1)), 0)
+
+    def test_count_is_upper_bound(self):
+        """checks the count from the buckets is never less than the points inside the box"""
+        for box in [(-3.2, 54.4, -3.1, 54.5), (-3.5, 54.2, -2.6, 54.8), (-3.13, 54.41, -3.12, 54.42)]:
+            self.assertGreaterEqual(self.index.count(*box), len(self.index.box(*box)))
+        self.assertEqual(self.index.count(0, 0, 1, 1), 0)
+
+    def test_inside_checks_given_points(self):
+        """checks inside marks which of the given points are in the box"""
+        box = (-3.2, 54.4, -3.1, 54.5)
+        positions = np.arange(0, 500, 3)
+        expected = np.isin(positions, self.index.box(*box))
+        self.assertEqual(self.index.inside(positions, *box).tolist(), expected.tolist())
+
+
+class TestNameIndex(Framework):
+    """unittest for the name search modes"""
+
+    def setUp(self):
+        super().setUp()
+        self.names = ['Scafell Pike', 'Scafell', 'Helvellyn', 'Skiddaw', 'Red Pike (Wasdale)', 'Skiddaw Little Man', 'Pike o\' Blisco']
+        self.index = NameIndex(self.names)
+
+    def search(self, query: str, match: str) -> list:
+        """returns the names matching query"""
+        return [self.names[position] for position in self.index.search([query], match)]
+
+    def test_exact_match(self):
+        """checks exact matching ignores case and punctuation only"""
+        self.assertEqual(self.search('scafell', 'exact'), ['Scafell'])
+        self.assertEqual(self.search('RED PIKE wasdale', 'exact'), ['Red Pike (Wasdale)'])
+
+    def test_prefix_match_ranks_whole_name_first(self):
+        """checks names starting with the prefix rank above names with a later word starting with it"""
+        self.assertEqual(self.search('pike', 'prefix'), ["Pike o' Blisco", 'Scafell Pike', 'Red Pike (Wasdale)'])
+
+    def test_contains_match_ranks_exact_first(self):
+        """checks substring matching returns exact matches first then in height order"""
+        self.assertEqual(self.search('scafell', 'contains'), ['Scafell', 'Scafell Pike'])
+        self.assertEqual(self.search('dal', 'contains'), ['Red Pike (Wasdale)'])
+
+    def test_fuzzy_match_tolerates_typos(self):
+        """checks misspelt names are still found"""
+        self.assertEqual(self.search('skidaw', 'fuzzy')[0], 'Skiddaw')
+        self.assertEqual(self.search('helvelin', 'fuzzy'), ['Helvellyn'])
+        self.assertEqual(self.search('helvelin', 'contains'), [])
+
+    def test_regex_is_not_interpreted(self):
+        """checks regex syntax is treated as plain text"""
+        self.assertEqual(self.search('.*', 'contains'), [])
+        self.assertEqual(self.search('.*', 'fuzzy'), [])
+
+    def test_results_limited(self):
+        """checks the number of results can be limited"""
+        self.assertEqual(len(self.index.search(['s'], 'contains', limit=2)), 2)
+
+    def test_edit_distance(self):
+        """checks the Levenshtein distance of some known pairs"""
+        self.assertEqual(edit_distance('skiddaw', 'skidaw'), 1)
+        self.assertEqual(edit_distance('kitten', 'sitting'), 3)
+        self.assertEqual(edit_distance('', 'abc'), 3)
+
+
+class TestSortedIndex(Framework):
+    """unittest for the numeric range index"""
+
+    def setUp(self):
+        super().setUp()
+        self.values = np.array([500, 300, 900, 300, 700])
+        self.index = SortedIndex(self.values)
+
+    def test_strict_and_inclusive_ranges(self):
+        """checks bounds are strict by default and inclusive when asked"""
+        self.assertEqual(self.index.range(300, 700).tolist(), [0])
+        self.assertEqual(self.index.range(300, 700, inclusive=True).tolist(), [0, 1, 3, 4])
+
+    def test_open_ended_ranges(self):
+        """checks either bound can be left out"""
+        self.assertEqual(self.index.range(low=600).tolist(), [2, 4])
+        self.assertEqual(self.index.range(high=500).tolist(), [1, 3])
+        self.assertEqual(self.index.range().tolist(), [0, 1, 2, 3, 4])
+
+    def test_count_matches_range(self):
+        """checks the count of a range is the number of positions in it"""
+        for low, high, inclusive in [(300, 700, False), (300, 700, True), (600, None, False), (None, None, False)]:
+            self.assertEqual(self.index.count(low, high, inclusive), len(self.index.range(low, high, inclusive)))
+
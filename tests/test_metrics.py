@@ -0,0 +1,53 @@
+import time
+
+from src.metrics import Histogram, Metrics, StageTimer, format_metric
+
+from .framework import Framework
+
+
+class TestMetrics(Framework):
+    """unittest for the timing histograms and the Prometheus text format"""
+
+    def test_histogram_buckets_cumulative(self):
+        """checks each bucket counts the observations up to its bound"""
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        lines = histogram.samples('t', {'endpoint': 'fell'})
+        self.assertEqual(lines, [
+            't_bucket{endpoint="fell",le="0.1"} 2',
+            't_bucket{endpoint="fell",le="1.0"} 3',
+            't_bucket{endpoint="fell",le="+Inf"} 4',
+            't_sum{endpoint="fell"} 2.65',
+            't_count{endpoint="fell"} 4',
+        ])
+
+    def test_metrics_render_by_labels(self):
+        """checks histograms are rendered once per name, with a series per set of labels"""
+        metrics = Metrics((1.0,))
+        metrics.describe('t', 'timings')
+        metrics.observe('t', 0.5, endpoint='a')
+        metrics.observe('t', 0.5, endpoint='b')
+        text = metrics.render()
+        self.assertEqual(text.count('# TYPE t histogram'), 1)
+        self.assertIn('# HELP t timings', text)
+        self.assertIn('t_count{endpoint="a"} 1', text)
+        self.assertIn('t_count{endpoint="b"} 1', text)
+        self.assertIn('t_count{endpoint="a",worker="1"} 1', metrics.render({'worker': '1'}))
+        metrics.reset()
+        self.assertEqual(metrics.render(), '')
+
+    def test_format_metric_escapes_labels(self):
+        """checks label values are escaped"""
+        text = format_metric('v', 'gauge', 'version', [({'version': 'a"b'}, 1)])
+        self.assertEqual(text, '# HELP v version\n# TYPE v gauge\nv{version="a\\"b"} 1\n')
+
+    def test_stage_timer_sums_repeated_stages(self):
+        """checks a stage run twice is timed in total and the header ends with the total"""
+        timer = StageTimer()
+        for _ in range(2):
+            with timer.stage('parse'):
+                time.sleep(0.001)
+        self.assertGreaterEqual(timer.stages['parse'], 0.002)
+        self.assertEqual(list(timer.stages), ['parse'])
+        self.assertRegex(timer.server_timing(), r'^parse;dur=\d+\.\d{3}, total;dur=\d+\.\d{3}$')
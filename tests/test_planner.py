@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from src.grid import grid_square_bounds
+from src.planner import BoxPredicate, NamePredicate, Predicate, RangePredicate, SquarePredicate, select
+from src.store import COLUMNS, FellStore
+
+from .framework import Framework
+
+
+class TestPlanner(Framework):
+    """unittest for planning the filters of a query most selective first"""
+
+    def setUp(self):
+        super().setUp()
+        self.df = pd.read_csv('wainwrights.csv')
+        self.store = FellStore.from_dataframe(self.df)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.store.columns[COLUMNS.index(name)]
+
+    def test_matches_full_scan(self):
+        """checks the fells selected match filtering every fell by each predicate"""
+        heights = self.column('Height (m)')
+        longitudes, latitudes = self.column('Longitude'), self.column('Latitude')
+        cases = [
+            ([RangePredicate('Height (m)', 600, 900)], (heights > 600) & (heights < 900)),
+            ([RangePredicate('Height (m)', 600, 900, inclusive=True), BoxPredicate((-3.3, 54.4, -3.0, 54.6))],
+             (heights >= 600) & (heights <= 900) & (longitudes >= -3.3) & (longitudes <= -3.0) & (latitudes >= 54.4) & (latitudes <= 54.6)),
+            ([BoxPredicate((-3.3, 54.4, -3.0, 54.6)), RangePredicate('Height (m)', low=300)],
+             (heights > 300) & (longitudes >= -3.3) & (longitudes <= -3.0) & (latitudes >= 54.4) & (latitudes <= 54.6)),
+        ]
+        for predicates, expected in cases:
+            positions, steps = select(self.store, predicates)
+            self.assertEqual(positions.tolist(), np.flatnonzero(expected).tolist())
+            self.assertEqual(steps[-1].rows, len(positions))
+
+    def test_square_matches_grid_references(self):
+        """checks fells in grid squares are those whose six figure grid references fall in them"""
+        positions, _ = select(self.store, [SquarePredicate([grid_square_bounds('NY21'), grid_square_bounds('NY32')], ['NY21', 'NY32'])])
+        expected = [position for position, reference in enumerate(self.store.grid_references)
+                    if reference[:2] == 'NY' and (reference[2], reference[5]) in {('2', '1'), ('3', '2')}]
+        self.assertGreater(len(positions), 0)
+        self.assertEqual(positions.tolist(), expected)
+
+    def test_most_selective_first(self):
+        """checks predicates run in order of their estimates, the first from its index"""
+        height = RangePredicate('Height (m)', low=300)
+        name = NamePredicate(['pike'], 'contains')
+        positions, steps = select(self.store, [height, name])
+        self.assertEqual([step.predicate for step in steps], [name.label, height.label])
+        self.assertEqual([step.method for step in steps], ['index', 'probe'])
+        self.assertEqual(sorted(steps, key=lambda step: step.estimate), steps)
+        self.assertEqual(positions.tolist(), sorted(name.ranked(self.store).tolist()))
+
+    def test_smaller_index_intersected(self):
+        """checks a later predicate estimated to match fewer fells than are left is intersected from its index"""
+        everything = RangePredicate('Height (m)')
+        high = RangePredicate('Height (m)', low=900)
+        _, steps = select(self.store, [RangePredicate('Height (m)', low=100), high, everything])
+        self.assertEqual(steps[0].predicate, high.label)
+        self.assertEqual([step.method for step in steps], ['index', 'probe', 'probe'])
+        _, steps = select(self.store, [high, NamePredicate(['scafell'], 'contains')])
+        self.assertEqual([step.method for step in steps], ['index', 'probe'])
+
+    def test_skips_once_empty(self):
+        """checks predicates after nothing is left are skipped"""
+        positions, steps = select(self.store, [RangePredicate('Height (m)', low=2000), BoxPredicate((-3.3, 54.4, -3.0, 54.6))])
+        self.assertEqual(len(positions), 0)
+        self.assertEqual([step.method for step in steps], ['index', 'skipped'])
+
+    def test_no_predicates(self):
+        """checks no predicates select nothing to restrict by"""
+        self.assertEqual(select(self.store, []), (None, []))
+
+    def test_predicate_is_abstract(self):
+        """checks a predicate must say how it is estimated, indexed and probed"""
+        with self.assertRaises(TypeError):
+            Predicate()
@@ -0,0 +1,55 @@
+from itertools import permutations
+
+import numpy as np
+
+from src.route import nearest_neighbour_tour, or_opt, plan_route, route_costs, tour_cost, two_opt
+
+from .framework import Framework
+
+
+class TestRoute(Framework):
+    """unittest for planning a route between fells"""
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        self.points = rng.random((8, 2)) * 10
+        self.start = np.array([5.0, 5.0])
+        self.distances = np.linalg.norm(self.points[:, None] - self.points[None], axis=2)
+        self.start_distances = np.linalg.norm(self.points - self.start, axis=1)
+        self.heights = rng.random(8) * 900
+
+    def best_cost(self, costs: np.ndarray) -> float:
+        """cost of the optimal route, by trying every order"""
+        end = len(costs) - 1
+        return min(tour_cost(np.array([0, *order, end]), costs) for order in permutations(range(1, end)))
+
+    def test_route_visits_every_fell_once(self):
+        """checks the route starts at the start, ends at the end and visits every fell once in between"""
+        tour = plan_route(route_costs(self.distances, self.start_distances))
+        self.assertEqual(tour[0], 0)
+        self.assertEqual(tour[-1], len(self.points) + 1)
+        self.assertEqual(sorted(tour[1:-1].tolist()), list(range(1, len(self.points) + 1)))
+
+    def test_improvements_never_lengthen_route(self):
+        """checks 2-opt and Or-opt only make the nearest neighbour route cheaper, even with ascent weighting"""
+        costs = route_costs(self.distances, self.start_distances, self.heights, 1.0, return_to_start=True)
+        tour = nearest_neighbour_tour(costs)
+        costs_before = tour_cost(tour, costs)
+        two_opt(tour, costs, float('inf'))
+        after_two_opt = tour_cost(tour, costs)
+        or_opt(tour, costs, float('inf'))
+        self.assertLessEqual(after_two_opt, costs_before)
+        self.assertLessEqual(tour_cost(tour, costs), after_two_opt)
+
+    def test_route_close_to_optimal(self):
+        """checks the planned route is within 10% of the best possible for a small set of fells"""
+        for costs in (route_costs(self.distances, self.start_distances),
+                      route_costs(self.distances, self.start_distances, self.heights, 0.8, return_to_start=True)):
+            self.assertLessEqual(tour_cost(plan_route(costs, 1.0), costs), self.best_cost(costs) * 1.1)
+
+    def test_ascent_weighting_is_asymmetric(self):
+        """checks climbing costs more than descending between the same fells"""
+        costs = route_costs(self.distances, heights=np.arange(8) * 100.0, ascent_weight=1.0)
+        self.assertAlmostEqual(costs[1, 2] - costs[2, 1], 1.0)
+        self.assertTrue((costs[0] == 0).all())
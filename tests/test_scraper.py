@@ -1,3 +1,9 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from urllib.error import HTTPError
+
 import requests
 
 import pandas as pd
@@ -5,7 +11,10 @@ import pandas as pd
 from .framework import Framework
 
 from main import scrape
-from src.scraper import Scraper, WainwrightTables
+from src.scraper import Scraper, WainwrightTables, diff_fells
+
+
+SNAPSHOT = os.path.join(os.path.dirname(__file__), 'fixtures', 'List_of_Wainwrights.html')
 
 
 class TestWainWrightTable(Framework):
@@ -67,4 +76,73 @@ class TestMainScrape(Framework):
         self.assertIn('Longitude', df.columns.tolist())
         self.assertIn('Latitude', df.columns.tolist())
 
-    
\ No newline at end of file
+    
+
+
+class TestIngestionPipeline(Framework):
+    """runs the scraper offline against a saved copy of the page"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'wainwrights.csv')
+        self.outlying_output = os.path.join(self.directory, 'outlying_fells.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_both_tables_parsed_from_snapshot(self):
+        """checks fells and outlying fells are parsed and converted from a saved page"""
+        scraper = Scraper(snapshot_path=SNAPSHOT)
+        scraper.scrape_wikipedia()
+        scraper.convert_grid_references()
+        df = scraper.append_df()
+        self.assertEqual(len(df), 5)
+        self.assertEqual(len(scraper.outlying_fells), 3)
+        self.assertIn('Longitude', scraper.outlying_fells.columns.tolist())
+
+    def test_longitude_and_latitude_not_swapped(self):
+        """checks longitude and latitude are assigned to the right columns and do not build up between runs"""
+        for _ in range(2):
+            scraper = Scraper(snapshot_path=SNAPSHOT)
+            scraper.scrape_wikipedia()
+            scraper.convert_grid_references()
+            df = scraper.append_df()
+        self.assertEqual(len(scraper.longitude), 5)
+        self.assertTrue(df['Longitude'].between(-4, -2).all())
+        self.assertTrue(df['Latitude'].between(54, 55).all())
+
+    def test_refresh_only_writes_when_changed(self):
+        """checks a versioned csv is written on the first refresh but not when nothing has changed"""
+        changes = Scraper(snapshot_path=SNAPSHOT).refresh(self.output, self.outlying_output)
+        self.assertEqual(len(changes[self.output]['added']), 5)
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'versions'))), 2)
+        modified = os.path.getmtime(self.output)
+
+        changes = Scraper(snapshot_path=SNAPSHOT).refresh(self.output, self.outlying_output)
+        self.assertFalse(any(changes[self.output].values()))
+        self.assertEqual(os.path.getmtime(self.output), modified)
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'versions'))), 2)
+
+    def test_diff_finds_added_removed_and_changed(self):
+        """checks the diff names the fells that were added, removed or changed"""
+        current = pd.DataFrame({'Name': ['A', 'B', 'C'], 'Height (m)': [1, 2, 3]})
+        new = pd.DataFrame({'Name': ['B', 'C', 'D'], 'Height (m)': [2, 4, 5]})
+        self.assertEqual(diff_fells(current, new), {'added': ['D'], 'removed': ['A'], 'changed': ['C']})
+
+    def test_conditional_fetch_uses_cached_page(self):
+        """checks a 304 response reuses the cached page and marks it unmodified"""
+        with open(SNAPSHOT, encoding='utf-8') as f:
+            html = f.read()
+        with open(os.path.join(self.directory, 'List_of_Wainwrights.html'), 'w', encoding='utf-8') as f:
+            f.write(html)
+        with open(os.path.join(self.directory, 'List_of_Wainwrights.json'), 'w') as f:
+            f.write('{"etag": "\\"abc\\"", "last_modified": null}')
+
+        scraper = Scraper(cache_dir=self.directory)
+        not_modified = HTTPError(scraper.url, 304, 'Not Modified', {}, None)
+        with mock.patch('src.scraper.urlopen', side_effect=not_modified) as urlopen:
+            self.assertEqual(scraper.fetch(), html)
+        self.assertFalse(scraper.modified)
+        self.assertEqual(urlopen.call_args[0][0].get_header('If-none-match'), '"abc"')
+
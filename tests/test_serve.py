@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+from threading import Thread
+import time
+import unittest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from .framework import Framework
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'workers are forked')
+class TestPreforkServer(Framework):
+    """unittest for the preforking production server, run as a separate process"""
+
+    def setUp(self):
+        super().setUp()
+        # killed servers cannot remove their own
+        self.track_dir = tempfile.mkdtemp()
+        self.process = subprocess.Popen(
+            [sys.executable, 'main.py', 'serve', '--host', '127.0.0.1', '--port', '0', '--workers', '2', '--threads', '2'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env={**os.environ, 'WAINWRIGHTS_TRACK_DIR': self.track_dir},
+        )
+        line = self.process.stdout.readline()
+        self.url = line.split()[2]
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+        shutil.rmtree(self.track_dir)
+
+    def workers(self, count: int = 2) -> list:
+        """pids of the server's workers, waiting for there to be count of them"""
+        deadline = time.monotonic() + 10
+        while True:
+            found = subprocess.run(['pgrep', '-P', str(self.process.pid)], capture_output=True, text=True).stdout.split()
+            if len(found) == count or time.monotonic() > deadline:
+                return [int(pid) for pid in found]
+            time.sleep(0.05)
+
+    def get(self, path: str) -> tuple:
+        with urlopen(self.url + path, timeout=10) as response:
+            return response.status, response.read()
+
+    def test_workers_answer_requests(self):
+        """checks the forked workers serve the preloaded dataset and report ready"""
+        self.assertEqual(self.get('/health/ready')[0], 200)
+        results = []
+        threads = [Thread(target=lambda: results.append(self.get('/fell/' + self.id))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8)
+        self.assertEqual({status for status, _ in results}, {200})
+        self.assertEqual(len({body for _, body in results}), 1)
+        self.assertEqual(json.loads(results[0][1])['Height Rank'], int(self.id) + 1)
+
+    def post(self, path: str) -> tuple:
+        with urlopen(Request(self.url + path, method='POST'), timeout=10) as response:
+            return response.status, json.loads(response.read())
+
+    @staticmethod
+    def next_event(stream) -> dict:
+        """the data of the next nearest event of an open stream"""
+        while True:
+            line = stream.readline().decode('utf-8')
+            if line.startswith('data: '):
+                return json.loads(line[len('data: '):])
+
+    def test_tracking_across_workers(self):
+        """checks positions reach a session's stream whichever worker they are sent to"""
+        status, session = self.post('/track?limit=3&gridref=NY215072')
+        self.assertEqual(status, 201)
+        with urlopen(session['events'], timeout=10) as stream:
+            self.assertEqual(self.next_event(stream)['added'][0]['Name'], 'Scafell Pike')
+            for _ in range(6):
+                self.assertEqual(self.post(f"/track/{session['id']}/position?gridref=NY215072")[0], 202)
+            self.assertEqual(self.post(f"/track/{session['id']}/position?gridref=NY342151")[0], 202)
+            self.assertIn('Helvellyn', [fell['Name'] for fell in self.next_event(stream)['added']])
+
+    def test_streams_leave_threads_free(self):
+        """checks each worker refuses streams beyond half its threads, so it still answers other requests"""
+        streams = []
+        try:
+            refused = None
+            for _ in range(3):
+                _, session = self.post('/track?gridref=NY215072')
+                try:
+                    streams.append(urlopen(session['events'], timeout=10))
+                except HTTPError as error:
+                    refused = error.code
+                    break
+            self.assertEqual(refused, 503)
+            for _ in range(4):
+                self.assertEqual(self.get('/health/live')[0], 200)
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def test_graceful_shutdown(self):
+        """checks SIGTERM stops every worker and the server exits cleanly, ending open tracking streams"""
+        self.get('/health/live')
+        _, session = self.post('/track?gridref=NY215072')
+        with urlopen(session['events'], timeout=10) as stream:
+            self.next_event(stream)
+            self.process.send_signal(signal.SIGTERM)
+            self.assertEqual(self.process.wait(timeout=10), 0)
+
+    def test_dead_worker_replaced(self):
+        """checks a worker that dies is replaced, after a growing delay if it dies soon after starting"""
+        pids = self.workers()
+        self.assertEqual(len(pids), 2)
+        os.kill(pids[0], signal.SIGKILL)
+        self.assertRegex(self.process.stdout.readline(), r'starting another in 0\.5s$')
+        replaced = [pid for pid in self.workers() if pid not in pids]
+        self.assertEqual(len(replaced), 1)
+        os.kill(replaced[0], signal.SIGKILL)
+        self.assertRegex(self.process.stdout.readline(), r'starting another in 1s$')
+        self.assertEqual(len(self.workers()), 2)
+        for _ in range(4):
+            self.assertEqual(self.get('/health/live')[0], 200)
@@ -0,0 +1,90 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.snapshot import build_snapshot, load_fells, load_snapshot
+from src.store import FellStore
+
+from .framework import Framework
+
+
+# seconds allowed from starting python to the first /fell/ response, override with STARTUP_BUDGET
+STARTUP_BUDGET = float(os.environ.get('STARTUP_BUDGET', 3.0))
+
+
+class TestSnapshot(Framework):
+    """unittest for writing and memory-mapping the binary snapshot"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.csv = os.path.join(self.directory, 'wainwrights.csv')
+        shutil.copy('wainwrights.csv', self.csv)
+        self.snapshot_dir = os.path.join(self.directory, 'snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshot_matches_csv(self):
+        """checks the snapshot loads exactly the same fells as the csv"""
+        build_snapshot(self.csv, self.snapshot_dir)
+        store = load_snapshot(self.snapshot_dir, self.csv)
+        expected = FellStore.from_csv(self.csv)
+        self.assertEqual(store.version, expected.version)
+        self.assertEqual(store.view().records(), expected.view().records())
+
+    def test_numeric_columns_memory_mapped(self):
+        """checks numeric columns are memory-mapped rather than copied"""
+        build_snapshot(self.csv, self.snapshot_dir)
+        store = load_snapshot(self.snapshot_dir)
+        self.assertFalse(store.height_m.flags.owndata)
+        self.assertIsInstance(store.height_m.base, np.memmap)
+        self.assertFalse(store.height_m.flags.writeable)
+
+    def test_pairwise_distances_memory_mapped(self):
+        """checks the fell to fell distance table is saved as float32 and mapped rather than recalculated"""
+        build_snapshot(self.csv, self.snapshot_dir)
+        store = load_snapshot(self.snapshot_dir)
+        self.assertIn('pairwise', vars(store))
+        self.assertIsInstance(store.pairwise.distances, np.memmap)
+        self.assertEqual(store.pairwise.distances.dtype, np.float32)
+        expected = FellStore.from_csv(self.csv).pairwise
+        self.assertTrue(np.array_equal(store.pairwise.neighbours, expected.neighbours))
+
+    def test_stale_snapshot_ignored(self):
+        """checks the csv is used when it has changed since the snapshot was built"""
+        build_snapshot(self.csv, self.snapshot_dir)
+        with open(self.csv, 'a', encoding='utf-8') as f:
+            f.write('Extra Fell,215,100,328,10,NY215072,-3.2,54.4\n')
+        self.assertIsNone(load_snapshot(self.snapshot_dir, self.csv))
+        self.assertEqual(len(load_fells(self.csv, self.snapshot_dir)), 215)
+
+    def test_missing_snapshot_falls_back_to_csv(self):
+        """checks the csv is loaded when no snapshot has been built"""
+        self.assertEqual(len(load_fells(self.csv, self.snapshot_dir)), 214)
+
+
+class TestStartup(Framework):
+    """unittest for starting the api from the snapshot quickly and without pandas"""
+
+    def test_startup_within_budget_without_pandas(self):
+        """checks starting python, importing the api and serving the first fell is within budget and does not import pandas"""
+        script = (
+            "import sys\n"
+            "from src.api import app\n"
+            "r = app.test_client().get('/fell/0')\n"
+            "print(r.status_code, 'pandas' in sys.modules)\n"
+        )
+        # timed from here, so the interpreter starting up counts too
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        elapsed = time.perf_counter() - start
+        status_code, pandas_imported = output.split()
+        self.assertEqual(status_code, '200')
+        self.assertEqual(pandas_imported, 'False')
+        self.assertLess(elapsed, STARTUP_BUDGET)
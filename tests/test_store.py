@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.data import Calculator
+from src.store import FellStore, COLUMNS, derive_columns
+
+from .framework import Framework
+
+
+class TestFellStore(Framework):
+    """unittest for the columnar fell store and its views"""
+
+    def setUp(self):
+        super().setUp()
+        self.df = pd.read_csv('wainwrights.csv')
+        self.store = FellStore.from_dataframe(self.df)
+
+    def test_columns_are_read_only(self):
+        """checks the store's arrays cannot be written to"""
+        for column in self.store.columns:
+            with self.assertRaises(ValueError):
+                column[0] = column[1]
+
+    def test_record_matches_dataframe(self):
+        """checks a record holds the same values as the dataframe row"""
+        record = self.store.record(int(self.id))
+        self.assertEqual(list(record), COLUMNS)
+        self.assertEqual(record['Name'], self.df.iloc[int(self.id)]['Name'])
+        self.assertIsInstance(record['Height (m)'], int)
+
+    def test_views_do_not_share_distances(self):
+        """checks sorting one view by distance leaves the store and other views untouched"""
+        view = self.store.view()
+        nearest = view.sort_by_distance(float(self.longitude), float(self.latitude))
+        self.assertIsNone(view.nearest)
+        self.assertNotIn('Nearest', self.store.view().records()[0])
+        self.assertEqual(nearest.records()[0]['Name'], 'Skiddaw')
+
+    def test_concurrent_queries_are_independent(self):
+        """checks many threads sorting by different locations each get their own nearest fell"""
+        locations = list(zip(self.df['Longitude'], self.df['Latitude'], self.df['Name']))
+        def nearest_name(location):
+            longitude, latitude, _ = location
+            return self.store.view().sort_by_distance(longitude, latitude).records()[0]['Name']
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            names = list(executor.map(nearest_name, locations * 4))
+        self.assertEqual(names, [name for _, _, name in locations * 4])
+
+    def test_calculate_nearest_fells_does_not_mutate_dataframe(self):
+        """checks calculate_nearest_fells returns a new dataframe rather than adding a column to the one given"""
+        Calculator.calculate_nearest_fells(self.df, float(self.longitude), float(self.latitude))
+        self.assertNotIn('Nearest', self.df.columns)
+
+    def test_precomputed_distances_match_sorting(self):
+        """checks ordering by a row of the distance matrix gives the same fells as sorting or the spatial index"""
+        longitudes, latitudes = self.df['Longitude'][:3].to_numpy(), self.df['Latitude'][:3].to_numpy()
+        distances = self.store.distance_matrix(longitudes, latitudes).min(axis=0)
+        view = self.store.view()
+        self.assertEqual(view.sort_by_distances(distances).records(), view.sort_by_distance(longitudes, latitudes).records())
+        self.assertEqual(view.sort_by_distances(distances, 10).records(), view.nearest_to(longitudes, latitudes, 10).records())
+        self.assertEqual(view.sort_by_distances(distances, within_km=3).records(), view.nearest_to(longitudes, latitudes, within_km=3).records())
+        self.assertEqual(view.sort_by_distance(longitudes, latitudes, 10).records(), view.nearest_to(longitudes, latitudes, 10).records())
+        self.assertEqual(view.sort_by_distance(longitudes, latitudes, 10, 3).records(), view.nearest_to(longitudes, latitudes, 10, 3).records())
+
+
+class TestDeriveColumns(Framework):
+    """unittest for reading hill lists and deriving the columns they lack"""
+
+    def test_outlying_fells_ranked_by_height(self):
+        """checks a list without Height Rank or coordinates has them derived, in height rank order"""
+        store = FellStore.from_csv('tests/fixtures/outlying_fells.csv')
+        self.assertEqual(store.names.tolist(), ['Black Combe', "Lord's Seat (Crook)", 'Hampsfell'])
+        self.assertEqual(store.height_rank.tolist(), [1, 2, 3])
+        longitude, latitude = Calculator.get_longlat('SD135854')
+        self.assertAlmostEqual(store.longitudes[0], longitude)
+        self.assertAlmostEqual(store.latitudes[0], latitude)
+
+    def test_equal_heights_share_a_rank(self):
+        """checks hills of the same height have the same rank and feet are derived from metres"""
+        columns = derive_columns({
+            'Name': ['a', 'b', 'c'], 'Height (m)': np.array([500.0, 700.0, 500.0]), 'Prom. (m)': np.array([30.0, 100.0, 15.0]),
+            'OS Grid Reference': ['NY215072', 'NY206064', 'NY342151'],
+        })
+        self.assertEqual(columns['Height Rank'].tolist(), [2, 1, 2])
+        self.assertEqual(columns['Height (ft)'].tolist(), [1640, 2297, 1640])
+        self.assertEqual(columns['Prom. (ft)'].tolist(), [98, 328, 49])
+
+    def test_missing_columns_raise(self):
+        """checks a list without heights or prominences cannot be loaded, naming what it lacks"""
+        with self.assertRaises(ValueError):
+            derive_columns({'Name': ['a'], 'OS Grid Reference': ['NY215072']})
+        with self.assertRaisesRegex(ValueError, r'^Missing columns: Prom\. \(ft\) \(or Prom\. \(m\)\)$'):
+            derive_columns({'Name': ['a'], 'Height (m)': np.array([500.0]), 'OS Grid Reference': ['NY215072']})
+
+    def test_other_columns_ignored(self):
+        """checks text columns that are not needed, such as a region, do not stop a list loading"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'list.csv')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('Name,Region,Height (m),Prom. (m),OS Grid Reference\nBlack Combe,Western,600,359,SD135854\n')
+            store = FellStore.from_csv(path)
+        self.assertEqual(store.record(0)['Prom. (ft)'], 1178)
+
+    def test_blank_cells_raise(self):
+        """checks a blank or non-numeric cell is reported with its column and line"""
+        with self.assertRaisesRegex(ValueError, r'Height \(m\) is blank on line 3'):
+            FellStore.from_csv('tests/fixtures/blank_height.csv')
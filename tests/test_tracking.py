@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.store import FellStore
+from src.tracking import NearestTracker, TrackingSessions
+
+from .framework import Framework
+
+
+class TestNearestTracker(Framework):
+    """unittest for tracking the nearest fells to a moving location"""
+
+    def setUp(self):
+        super().setUp()
+        self.store = FellStore.from_dataframe(pd.read_csv('wainwrights.csv'))
+        # a walk north east from Scafell Pike in steps of about 100m
+        self.walk = [(-3.2124 + 0.0010 * step, 54.4541 + 0.0006 * step) for step in range(60)]
+
+    def test_matches_full_sort_along_walk(self):
+        """checks the nearest fells after every step are those of sorting every distance"""
+        tracker = NearestTracker(self.store, 5)
+        for longitude, latitude in self.walk:
+            positions, distances = tracker.nearest(longitude, latitude)
+            expected = self.store.view().sort_by_distance(longitude, latitude).head(5)
+            self.assertEqual(positions.tolist(), expected.positions.tolist())
+            self.assertTrue(np.allclose(distances, expected.nearest))
+            tracker.positions = positions
+        self.assertLess(tracker.rescans, len(self.walk) / 4)
+
+    def test_updates_only_changes(self):
+        """checks the first update adds every nearest fell, and later ones only what changed"""
+        tracker = NearestTracker(self.store, 3)
+        first = tracker.update(*self.walk[0])
+        self.assertEqual(len(first['added']), 3)
+        self.assertEqual(first['removed'], [])
+        self.assertEqual([fell['id'] for fell in first['added']], [position for position, _ in first['nearest']])
+        self.assertIsNone(tracker.update(*self.walk[0]))
+        changes = [tracker.update(longitude, latitude) for longitude, latitude in self.walk[1:]]
+        swapped = [change for change in changes if change is not None and change['added']]
+        self.assertTrue(swapped)
+        for change in swapped:
+            self.assertEqual(len(change['added']), len(change['removed']))
+            self.assertEqual(len(change['nearest']), 3)
+
+
+class TestTrackingSessions(Framework):
+    """unittest for the tracking sessions shared between processes"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.now = 1000.0
+        self.sessions = TrackingSessions(self.directory, ttl=60, max_sessions=2, clock=lambda: self.now)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_idle_sessions_expire(self):
+        """checks a session unused for ttl seconds is closed"""
+        id = self.sessions.create({'limit': 3})
+        self.now += 30
+        self.assertTrue(self.sessions.send(id, 0.0, 0.0))
+        self.now += 50
+        self.assertEqual(self.sessions.get(id), {'settings': {'limit': 3}, 'location': [0.0, 0.0]})
+        self.now += 20
+        self.assertIsNone(self.sessions.get(id))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_max_sessions(self):
+        """checks no more than max_sessions are opened"""
+        self.sessions.create({})
+        id = self.sessions.create({})
+        self.assertIsNone(self.sessions.create({}))
+        self.assertTrue(self.sessions.close(id))
+        self.assertFalse(self.sessions.close(id))
+        self.assertIsNotNone(self.sessions.create({}))
+
+    def test_ids_cannot_name_other_files(self):
+        """checks ids that are not session ids are never looked up as paths"""
+        for id in ('../wainwrights', '', 'a' * 21):
+            self.assertIsNone(self.sessions.get(id))
+            self.assertFalse(self.sessions.close(id))
+
+    def test_shared_between_processes(self):
+        """checks a session opened by one instance (as in one worker) is used and closed through another on the same folder"""
+        other = TrackingSessions(self.directory, ttl=60, clock=lambda: self.now)
+        id = self.sessions.create({'limit': 3}, [-3.2, 54.4])
+        watch = other.watch(id, heartbeat=10, poll=0.01)
+        self.assertEqual(next(watch), (-3.2, 54.4))
+        self.sessions.send(id, -3.1, 54.5)
+        self.sessions.send(id, -3.0, 54.6)
+        self.assertEqual(next(watch), (-3.0, 54.6))
+        self.sessions.close(id)
+        self.assertIsNone(next(watch, None))
+        self.assertIsNone(other.get(id))
+
+    def test_watch_woken_by_send(self):
+        """checks a location sent in the same process reaches its stream at once, rather than at the next poll"""
+        id = self.sessions.create({}, [-3.2, 54.4])
+        watch = self.sessions.watch(id, heartbeat=60, poll=60)
+        self.assertEqual(next(watch), (-3.2, 54.4))
+        threading.Timer(0.05, self.sessions.send, (id, -3.1, 54.5)).start()
+        started = time.monotonic()
+        self.assertEqual(next(watch), (-3.1, 54.5))
+        self.assertLess(time.monotonic() - started, 5)
+        threading.Timer(0.05, self.sessions.close, (id,)).start()
+        self.assertIsNone(next(watch, None))
+        self.assertEqual(self.sessions.watching, {})
+
+    def test_temporary_folder_made_on_first_use(self):
+        """checks sessions without a folder only make a temporary one once used"""
+        sessions = TrackingSessions()
+        self.assertIsNone(sessions._directory)
+        id = sessions.create({})
+        self.assertTrue(os.path.isfile(os.path.join(sessions.directory, id + '.json')))
+        shutil.rmtree(sessions.directory)
+
+    def test_watch_heartbeat_keeps_session_open(self):
+        """checks a watched session with no new locations gives heartbeats and is touched by them"""
+        id = self.sessions.create({})
+        watch = self.sessions.watch(id, heartbeat=0.05, poll=0.01)
+        self.now += 50
+        self.assertIsNone(next(watch))
+        self.now += 50
+        self.assertIsNotNone(self.sessions.get(id))
+
+    def test_streams_limited(self):
+        """checks no more than max_streams are counted as open at once"""
+        self.assertTrue(self.sessions.start_stream(1))
+        self.assertFalse(self.sessions.start_stream(1))
+        self.sessions.end_stream()
+        self.assertTrue(self.sessions.start_stream(1))